@@ -0,0 +1,176 @@
+"""
+End-to-end benchmarks against the local stub servers.
+Starts the Stability and OpenRouter stubs in-process, points the app at
+them and reports throughput and p50/p95/p99 latency for preprocessing,
+single requests, batch runs and concurrent UI sessions. No API quota is
+used.
+
+Usage: python -m benchmarks.bench_end_to_end [--scenarios preprocess,single,batch,sessions]
+       [--requests 20] [--batch 32] [--sessions 8] [--turns 3] [--latency lognormal:0.5:0.3]
+"""
+
+import os
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Callable, List
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.stub_servers import add_behaviour_arguments, behaviours_from_args, start_openrouter_stub, start_stability_stub
+
+SCENARIOS = ("preprocess", "single", "batch", "sessions")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    rank = max(1, int(np.ceil(pct / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def report(name: str, latencies: List[float], elapsed: float, failures: int = 0) -> None:
+    """Print throughput and latency percentiles of one scenario."""
+    if not latencies:
+        print(f"{name:<28} no samples")
+        return
+    print(
+        f"{name:<28} n={len(latencies):<4} fail={failures:<3} {len(latencies) / elapsed:7.2f}/s  "
+        f"p50={percentile(latencies, 50) * 1000:8.1f}ms  p95={percentile(latencies, 95) * 1000:8.1f}ms  "
+        f"p99={percentile(latencies, 99) * 1000:8.1f}ms"
+    )
+
+
+def timed(fn: Callable, *args):
+    """Call fn and return its result and wall-clock seconds."""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def random_image(rng: np.random.Generator, size) -> Image.Image:
+    """Make a noisy RGB test image of (width, height)."""
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+
+
+def bench_preprocess(args, rng) -> None:
+    """Preprocessing alone, for typical phone and screenshot sizes."""
+    from src.image_preprocessing import preprocess_for_upload, snap_to_sdxl
+
+    for size in [(640, 480), (1920, 1080), (4032, 3024)]:
+        image = random_image(rng, size)
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            _, seconds = timed(preprocess_for_upload, image, snap_to_sdxl)
+            latencies.append(seconds)
+        report(f"preprocess {size[0]}x{size[1]}", latencies, time.perf_counter() - start)
+
+
+def bench_single(args, rng) -> None:
+    """Sequential ImageDryer requests."""
+    from src.image_dryer import ImageDryer
+
+    dryer = ImageDryer(cache=None)
+    latencies, failures = [], 0
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        result, seconds = timed(dryer.process_image, random_image(rng, (1024, 1024)))
+        latencies.append(seconds)
+        failures += result is None
+    report("single ImageDryer", latencies, time.perf_counter() - start, failures)
+
+
+def bench_batch(args, rng) -> None:
+    """A concurrent EnhancedImageDryer batch on the async path."""
+    from src.background_loop import run_sync
+    from src.enhanced_image_dryer import EnhancedImageDryer
+
+    dryer = EnhancedImageDryer(cache=None)
+    images = [random_image(rng, (1024, 768)) for _ in range(args.batch)]
+    latencies = []
+
+    async def timed_item(image):
+        item_start = time.perf_counter()
+        result = await dryer.aprocess_image(image, use_cache=False)
+        latencies.append(time.perf_counter() - item_start)
+        return result
+
+    async def run_batch():
+        return await asyncio.gather(*(timed_item(image) for image in images))
+
+    start = time.perf_counter()
+    results = run_sync(run_batch())
+    failures = sum(result is None for result in results)
+    report(f"batch x{args.batch} Enhanced", latencies, time.perf_counter() - start, failures)
+
+
+def bench_sessions(args, rng) -> None:
+    """Concurrent UI sessions, each sending several turns with an image."""
+    from src.app import DryingApp
+
+    app = DryingApp()
+    images = [random_image(rng, (1024, 1024)) for _ in range(args.sessions)]
+    latencies = []
+
+    def run_session(index: int) -> int:
+        request = SimpleNamespace(session_hash=f"bench-{index}")
+        history, failures = [], 0
+        for turn in range(args.turns):
+            (history, processed), seconds = timed(
+                app.process_interaction, f"How do I dry this, step {turn}?", images[index], history, request
+            )
+            latencies.append(seconds)
+            failures += processed is None
+        return failures
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        failures = sum(pool.map(run_session, range(args.sessions)))
+    report(f"sessions x{args.sessions} turns", latencies, time.perf_counter() - start, failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per sequential scenario")
+    parser.add_argument("--batch", type=int, default=32, help="Images per batch run")
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent UI sessions")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per UI session")
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    image_behaviour, chat_behaviour = behaviours_from_args(args)
+    stability = start_stability_stub(image_behaviour)
+    openrouter = start_openrouter_stub(chat_behaviour)
+
+    # The app reads its endpoints from the environment when its clients are created
+    os.environ["STABILITY_API_HOST"] = stability.url
+    os.environ["OPENROUTER_BASE_URL"] = f"{openrouter.url}/api/v1"
+    os.environ.setdefault("STABILITY_API_KEY", "stub")
+    os.environ.setdefault("OPENROUTER_API_KEY", "stub")
+    os.environ["DRYER_CACHE_ENABLED"] = "false"
+    os.environ.setdefault("STABILITY_RETRY_BASE_DELAY", "0.2")
+
+    print(f"Stubs: stability={stability.url} openrouter={openrouter.url} latency={args.latency} "
+          f"errors={args.error_rate} 429s={args.rate_limit_rate}")
+    rng = np.random.default_rng(0)
+    try:
+        for name in scenarios:
+            globals()[f"bench_{name}"](args, rng)
+    finally:
+        stability.stop()
+        openrouter.stop()
+    print(f"Stability responses: {dict(stability.statuses)}  chat responses: {dict(openrouter.statuses)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark the local fallback drying effect.
+Compares the original per-pixel implementation against the vectorized
+NumPy engine in src.drying_effect, whole-image and tiled.
+
+Usage: python -m benchmarks.bench_fallback_effect [--size 1024] [--repeat 5]
+"""
+
+import argparse
+import time
+from colorsys import rgb_to_hsv, hsv_to_rgb
+
+import numpy as np
+from PIL import Image
+
+from src.drying_effect import apply_drying_effect
+
+
+def legacy_drying_effect(image: Image.Image) -> Image.Image:
+    """Original per-pixel fallback effect, kept here as the baseline."""
+    result = image.convert("RGB")
+    result = result.point(lambda p: min(255, int(p * 1.2)))
+    result = result.point(lambda p: min(255, int(128 + 1.1 * (p - 128))))
+    width, height = result.size
+    for x in range(width):
+        for y in range(height):
+            r, g, b = result.getpixel((x, y))
+            h, s, v = rgb_to_hsv(r / 255, g / 255, b / 255)
+            s *= 0.8
+            r, g, b = hsv_to_rgb(h, s, v)
+            result.putpixel((x, y), (int(r * 255), int(g * 255), int(b * 255)))
+    return result
+
+
+def best_of(fn, image, repeat):
+    """Return the best wall-clock time of fn(image) over repeat runs."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(image)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=1024, help="Square image size in pixels")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per vectorized variant")
+    parser.add_argument("--skip-legacy", action="store_true", help="Skip the slow per-pixel baseline")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8))
+
+    print(f"Fallback drying effect on a {args.size}x{args.size} RGB image")
+    vectorized = best_of(apply_drying_effect, image, args.repeat)
+    tiled = best_of(lambda im: apply_drying_effect(im, tile_rows=128), image, args.repeat)
+    print(f"vectorized:        {vectorized * 1000:9.1f} ms")
+    print(f"vectorized, tiled: {tiled * 1000:9.1f} ms")
+
+    if not args.skip_legacy:
+        legacy = best_of(legacy_drying_effect, image, 1)
+        print(f"legacy per-pixel:  {legacy * 1000:9.1f} ms")
+        print(f"speedup:           {legacy / vectorized:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Local stand-ins for the Stability AI and OpenRouter APIs.
+The Stability stub answers /v1/generation/{engine}/image-to-image with a PNG
+(binary or base64 JSON, following the Accept header) and the OpenRouter stub
+answers OpenAI-compatible /chat/completions, streamed or not. Both draw their
+latency from a configurable distribution and inject 500s and 429s at
+configurable rates, so the app can be load-tested without API quota.
+
+Point the app at them with:
+    STABILITY_API_HOST=http://127.0.0.1:8601
+    OPENROUTER_BASE_URL=http://127.0.0.1:8602/api/v1
+
+Usage: python -m benchmarks.stub_servers [--latency lognormal:0.8:0.4] [--error-rate 0.02]
+"""
+
+import io
+import json
+import math
+import time
+import base64
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+
+class LatencyModel:
+    def __init__(self, kind: str = "fixed", a: float = 0.0, b: float = 0.0):
+        """Initialize the latency distribution.
+
+        Args:
+            kind: "fixed" (a seconds), "uniform" (between a and b) or "lognormal" (median a, sigma b)
+            a: First distribution parameter in seconds
+            b: Second distribution parameter
+        """
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        self.kind = kind
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        """Parse a spec such as "0.5", "fixed:0.5", "uniform:0.2:0.8" or "lognormal:0.5:0.4"."""
+        parts = spec.split(":")
+        if len(parts) == 1:
+            return cls("fixed", float(parts[0]))
+        return cls(parts[0], *(float(part) for part in parts[1:]))
+
+    def sample(self, rng: random.Random) -> float:
+        """Draw one latency in seconds."""
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        if self.kind == "lognormal":
+            return rng.lognormvariate(math.log(self.a), self.b) if self.a > 0 else 0.0
+        return self.a
+
+
+class StubBehaviour:
+    def __init__(
+        self,
+        latency: Optional[LatencyModel] = None,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        max_rps: Optional[float] = None,
+        retry_after: float = 1.0,
+        engine_latency: Optional[Dict[str, LatencyModel]] = None,
+        seed: Optional[int] = None
+    ):
+        """Initialize the stub behaviour.
+
+        Args:
+            latency: Latency distribution of every response
+            error_rate: Fraction of requests answered with a 500
+            rate_limit_rate: Fraction of requests answered with a 429
+            max_rps: Sustained requests per second before every request gets a 429, or None
+            retry_after: Retry-After seconds sent with each 429
+            engine_latency: Per-engine latency overriding latency for generation requests
+            seed: Seed for reproducible latencies and faults
+        """
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.max_rps = max_rps
+        self.retry_after = retry_after
+        self.engine_latency = engine_latency or {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = max_rps or 0.0
+        self._refilled = time.monotonic()
+
+    def _take_token(self) -> bool:
+        """Take a token from the rate limit bucket, which holds one second's worth of requests."""
+        now = time.monotonic()
+        self._tokens = min(self.max_rps, self._tokens + (now - self._refilled) * self.max_rps)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def decide(self, engine: Optional[str] = None) -> Tuple[float, int]:
+        """Draw the latency and status code of one request."""
+        with self._lock:
+            delay = self.engine_latency.get(engine, self.latency).sample(self._rng)
+            if self.max_rps is not None and not self._take_token():
+                return delay, 429
+            roll = self._rng.random()
+            if roll < self.rate_limit_rate:
+                return delay, 429
+            if roll < self.rate_limit_rate + self.error_rate:
+                return delay, 500
+            return delay, 200
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server_version = "DryingStub/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Keep the benchmark output clean."""
+
+    def _read_body(self) -> bytes:
+        """Read the request body."""
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        """Send a complete response."""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.server.record(status)
+        self.wfile.write(body)
+
+    def _send_fault(self, status: int) -> None:
+        """Send a 429 or 500 error response."""
+        headers = {}
+        if status == 429:
+            headers["Retry-After"] = f"{self.server.behaviour.retry_after:g}"
+        body = json.dumps({"name": "stub_error", "message": f"Stub returned {status}"}).encode()
+        self._send(status, body, "application/json", headers)
+
+    def do_HEAD(self):
+        """Answer connection warm-up requests."""
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class _StabilityHandler(_StubHandler):
+    def do_POST(self):
+        """Answer image-to-image generation requests."""
+        self._read_body()
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 4 or parts[:2] != ["v1", "generation"] or parts[3] != "image-to-image":
+            self._send(404, b'{"message": "not found"}', "application/json")
+            return
+
+        delay, status = self.server.behaviour.decide(parts[2])
+        time.sleep(delay)
+        if status != 200:
+            self._send_fault(status)
+            return
+
+        png = self.server.image_png
+        if "image/png" in self.headers.get("Accept", ""):
+            self._send(200, png, "image/png", {"Finish-Reason": "SUCCESS", "Seed": "0"})
+        else:
+            artifact = {"base64": base64.b64encode(png).decode(), "seed": 0, "finishReason": "SUCCESS"}
+            self._send(200, json.dumps({"artifacts": [artifact]}).encode(), "application/json")
+
+
+class _ChatHandler(_StubHandler):
+    def do_POST(self):
+        """Answer OpenAI-compatible chat completion requests."""
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._read_body()
+            self._send(404, b'{"error": {"message": "not found"}}', "application/json")
+            return
+
+        request = json.loads(self._read_body() or b"{}")
+        delay, status = self.server.behaviour.decide()
+        time.sleep(delay)
+        if status != 200:
+            self._send_fault(status)
+            return
+
+        last = next((m.get("content", "") for m in reversed(request.get("messages", [])) if m.get("role") == "user"), "")
+        reply = f"{self.server.reply} (re: {str(last)[:60]})"
+        model = request.get("model", "stub")
+        created = int(time.time())
+        if request.get("stream"):
+            self._stream_reply(reply, model, created)
+            return
+
+        body = {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(reply.split()), "total_tokens": len(reply.split())}
+        }
+        self._send(200, json.dumps(body).encode(), "application/json")
+
+    def _stream_reply(self, reply: str, model: str, created: int) -> None:
+        """Send the reply word by word as server-sent events."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        self.server.record(200)
+
+        def event(delta: dict, finish_reason: Optional[str] = None) -> bytes:
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(chunk)}\n\n".encode()
+
+        self.wfile.write(event({"role": "assistant", "content": ""}))
+        for word in reply.split(" "):
+            time.sleep(self.server.chunk_delay)
+            self.wfile.write(event({"content": word + " "}))
+            self.wfile.flush()
+        self.wfile.write(event({}, "stop"))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, behaviour: StubBehaviour, host: str = "127.0.0.1", port: int = 0):
+        """Initialize the server; port 0 picks a free port."""
+        super().__init__((host, port), handler)
+        self.behaviour = behaviour
+        self.statuses: Counter = Counter()
+        self._status_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Get the base URL of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, status: int) -> None:
+        """Count a response status."""
+        with self._status_lock:
+            self.statuses[status] += 1
+
+    def start(self) -> "StubServer":
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name=f"stub-{self.url}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+
+
+def start_stability_stub(
+    behaviour: Optional[StubBehaviour] = None,
+    port: int = 0,
+    image_size: Tuple[int, int] = (1024, 1024)
+) -> StubServer:
+    """Start a Stability AI stub returning a PNG of image_size."""
+    server = StubServer(_StabilityHandler, behaviour or StubBehaviour(), port=port)
+    buffered = io.BytesIO()
+    Image.new("RGB", image_size, (200, 180, 150)).save(buffered, format="PNG")
+    server.image_png = buffered.getvalue()
+    return server.start()
+
+
+def start_openrouter_stub(
+    behaviour: Optional[StubBehaviour] = None,
+    port: int = 0,
+    reply: str = "Spread the item out in a warm, ventilated place and turn it every hour.",
+    chunk_delay: float = 0.0
+) -> StubServer:
+    """Start an OpenRouter stub; its OpenAI base URL is server.url + "/api/v1"."""
+    server = StubServer(_ChatHandler, behaviour or StubBehaviour(), port=port)
+    server.reply = reply
+    server.chunk_delay = chunk_delay
+    return server.start()
+
+
+def add_behaviour_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the stub behaviour options to a command line parser."""
+    parser.add_argument("--latency", default="lognormal:0.5:0.3", help="Image latency: seconds, fixed:s, uniform:lo:hi or lognormal:median:sigma")
+    parser.add_argument("--chat-latency", default="lognormal:0.3:0.3", help="Chat latency, same format as --latency")
+    parser.add_argument("--engine-latency", action="append", default=[], metavar="ENGINE=SPEC", help="Latency of one engine")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--max-rps", type=float, default=None, help="Requests per second before the image stub sends 429s")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible latencies and faults")
+
+
+def behaviours_from_args(args: argparse.Namespace) -> Tuple[StubBehaviour, StubBehaviour]:
+    """Build the image and chat stub behaviours from parsed options."""
+    engine_latency = {}
+    for item in args.engine_latency:
+        engine, spec = item.split("=", 1)
+        engine_latency[engine] = LatencyModel.parse(spec)
+    image = StubBehaviour(
+        latency=LatencyModel.parse(args.latency),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        max_rps=args.max_rps,
+        retry_after=args.retry_after,
+        engine_latency=engine_latency,
+        seed=args.seed
+    )
+    chat = StubBehaviour(
+        latency=LatencyModel.parse(args.chat_latency),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+    return image, chat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stability-port", type=int, default=8601)
+    parser.add_argument("--openrouter-port", type=int, default=8602)
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    image_behaviour, chat_behaviour = behaviours_from_args(args)
+    stability = start_stability_stub(image_behaviour, port=args.stability_port)
+    openrouter = start_openrouter_stub(chat_behaviour, port=args.openrouter_port)
+    print(f"STABILITY_API_HOST={stability.url}")
+    print(f"OPENROUTER_BASE_URL={openrouter.url}/api/v1")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stability.stop()
+        openrouter.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ setup(
         "python-dotenv>=1.0.0",
         "pytest>=7.0.0",
         "pillow>=10.0.0",
+        "numpy>=1.24.0",
         "torch>=2.0.0",
         "transformers>=4.30.0",
         "black>=23.0.0",
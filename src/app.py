@@ -1,31 +1,161 @@
 import os
+import time
+import logging
+import threading
+from collections import OrderedDict
 import gradio as gr
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from PIL import Image
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Callable, Dict, Any, Iterator, List
 from dotenv import load_dotenv
 from .drying_agent import DryingAgent
+from .http_transport import get_api_host, get_transport
+from .metrics import ACTIVE_SESSIONS, INTERACTIONS, REGISTRY, STAGE_SECONDS
+from .profiling import profiled
+from .structured_logging import get_logger, log_event
 
 # Load environment variables
 load_dotenv()
 
+logger = get_logger("app")
+
+def _image_bytes(image: Optional[Image.Image]) -> int:
+    """Estimate the memory held by a decoded PIL image."""
+    if image is None:
+        return 0
+    width, height = image.size
+    return width * height * len(image.getbands())
+
+class AgentPool:
+    def __init__(
+        self,
+        agent_factory: Callable[[], DryingAgent] = DryingAgent,
+        max_sessions: int = 200,
+        idle_timeout: float = 30 * 60,
+        max_image_bytes: int = 512 * 1024 * 1024
+    ):
+        """Initialize a pool holding one DryingAgent per Gradio session.
+
+        Args:
+            agent_factory: Callable creating a new agent
+            max_sessions: Maximum number of live sessions
+            idle_timeout: Seconds after which an unused session is evicted
+            max_image_bytes: Budget for the images held by all agents
+        """
+        self.agent_factory = agent_factory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_image_bytes = max_image_bytes
+        # session id -> (agent, last used), least recently used first
+        self._sessions: "OrderedDict[str, Tuple[DryingAgent, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def _agent_image_bytes(agent: DryingAgent) -> int:
+        """Get the memory held by the current and processed images of an agent."""
+        return _image_bytes(agent.current_image) + _image_bytes(agent.processed_image)
+    
+    def _held_image_bytes(self) -> int:
+        """Get the memory held by the current and processed images of all agents."""
+        return sum(self._agent_image_bytes(agent) for agent, _ in self._sessions.values())
+    
+    def _evict(self, keep: Optional[str] = None) -> List[DryingAgent]:
+        """Evict idle sessions, then least recently used ones until within limits.
+
+        Returns:
+            The evicted agents, whose pending work the caller cancels outside the lock
+        """
+        evicted = []
+        now = time.monotonic()
+        for session_id, (agent, last_used) in list(self._sessions.items()):
+            if session_id != keep and now - last_used > self.idle_timeout:
+                del self._sessions[session_id]
+                evicted.append(agent)
+        
+        # Images change outside the pool, so the total is counted once and reduced as agents go
+        held = self._held_image_bytes()
+        while len(self._sessions) > self.max_sessions or held > self.max_image_bytes:
+            session_id = next((sid for sid in self._sessions if sid != keep), None)
+            if session_id is None:
+                break
+            agent, _ = self._sessions.pop(session_id)
+            held -= self._agent_image_bytes(agent)
+            evicted.append(agent)
+        self.evictions += len(evicted)
+        return evicted
+    
+    def get(self, session_id: str) -> DryingAgent:
+        """Get the agent for a session, creating it if needed."""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                agent = self.agent_factory()
+                self.created += 1
+            else:
+                agent = entry[0]
+            self._sessions[session_id] = (agent, time.monotonic())
+            evicted = self._evict(keep=session_id)
+            ACTIVE_SESSIONS.set(len(self._sessions))
+        # Free the scheduler slots and API calls of speculative and in-flight images nobody will see
+        for old in evicted:
+            old.cancel_pending("evicted")
+        return agent
+    
+    def remove(self, session_id: str) -> Optional[DryingAgent]:
+        """Drop a session, returning its agent if it had one."""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            ACTIVE_SESSIONS.set(len(self._sessions))
+            return entry[0] if entry is not None else None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get live session and memory statistics."""
+        with self._lock:
+            return {
+                "live_sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "image_bytes": self._held_image_bytes(),
+                "max_image_bytes": self.max_image_bytes,
+                "created": self.created,
+                "evictions": self.evictions
+            }
+
+def _session_id(request: Optional[gr.Request]) -> str:
+    """Get the Gradio session hash of a request."""
+    return getattr(request, "session_hash", None) or "default"
+
 class DryingApp:
     def __init__(self):
-        """Initialize the DryingApp with the agent and interface."""
-        self.agent = DryingAgent()
+        """Initialize the DryingApp with a per-session agent pool."""
+        self.agents = AgentPool(
+            max_sessions=int(os.getenv("DRYING_MAX_SESSIONS", 200)),
+            idle_timeout=float(os.getenv("DRYING_SESSION_IDLE_TIMEOUT", 30 * 60)),
+            max_image_bytes=int(os.getenv("DRYING_SESSION_IMAGE_BUDGET", 512 * 1024 * 1024))
+        )
+        # Start drying uploaded images while the user is still typing
+        self.speculative = os.getenv("DRYING_SPECULATIVE", "true").lower() == "true"
         
+    @profiled("process_interaction")
     def process_interaction(
         self,
         message: str,
         image: Optional[Image.Image],
-        history: list
+        history: list,
+        request: gr.Request = None
     ) -> Tuple[list, Optional[Image.Image]]:
         """Process user interaction and update chat history."""
         if not message.strip():
             return history, None
             
+        start = time.perf_counter()
         try:
-            # Get response from agent
-            messages, processed_image = self.agent.process_message(message, image)
+            # Get response from this session's agent
+            agent = self.agents.get(_session_id(request))
+            messages, processed_image = agent.process_message(message, image)
             
             # Update history with proper message format
             if not history:
@@ -39,18 +169,75 @@ class DryingApp:
                 {"role": "assistant", "content": assistant_response}
             ])
             
+            INTERACTIONS.inc(handler="process", outcome="ok")
             return history, processed_image
         except Exception as e:
-            print(f"Error in process_interaction: {str(e)}")
+            INTERACTIONS.inc(handler="process", outcome="error")
+            log_event(logger, logging.ERROR, "process_interaction_failed", error=str(e))
             if not history:
                 history = []
             history.append({"role": "assistant", "content": f"Error: {str(e)}"})
             return history, None
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, component="app", stage="interaction")
+        
+    @profiled("process_interaction_stream")
+    def process_interaction_stream(
+        self,
+        message: str,
+        image: Optional[Image.Image],
+        history: list,
+        request: gr.Request = None
+    ) -> Iterator[Tuple[list, Optional[Image.Image]]]:
+        """Process user interaction, streaming the assistant reply into the chat history."""
+        if not message.strip():
+            yield history, None
+            return
+        
+        history = list(history or [])
+        history.append({"role": "user", "content": message})
+        history.append({"role": "assistant", "content": ""})
         
-    def reset_conversation(self):
-        """Reset the conversation and agent state."""
-        self.agent.reset()
+        start = time.perf_counter()
+        try:
+            agent = self.agents.get(_session_id(request))
+            first_chunk = True
+            for partial_response, processed_image in agent.stream_message(message, image):
+                if first_chunk and partial_response:
+                    STAGE_SECONDS.observe(time.perf_counter() - start, component="app", stage="first_chunk")
+                    first_chunk = False
+                history[-1] = {"role": "assistant", "content": partial_response}
+                yield history, processed_image
+            INTERACTIONS.inc(handler="stream", outcome="ok")
+        except Exception as e:
+            INTERACTIONS.inc(handler="stream", outcome="error")
+            log_event(logger, logging.ERROR, "process_interaction_stream_failed", error=str(e))
+            history[-1] = {"role": "assistant", "content": f"Error: {str(e)}"}
+            yield history, None
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, component="app", stage="interaction")
+        
+    def speculate(self, image: Optional[Image.Image], request: gr.Request = None) -> None:
+        """Start drying a new upload in the background, or cancel it when the image is replaced or cleared."""
+        if not self.speculative:
+            return
+        try:
+            self.agents.get(_session_id(request)).speculate(image)
+        except Exception as e:
+            log_event(logger, logging.WARNING, "speculation_failed", error=str(e))
+    
+    def reset_conversation(self, request: gr.Request = None):
+        """Reset the conversation and agent state, cancelling image work still in flight."""
+        agent = self.agents.remove(_session_id(request))
+        if agent is not None:
+            agent.cancel_pending("reset")
         return [], None
+    
+    def end_session(self, request: gr.Request = None):
+        """Release the agent of a session whose browser tab was closed."""
+        agent = self.agents.remove(_session_id(request))
+        if agent is not None:
+            agent.cancel_pending("session_closed")
         
     def create_interface(self):
         """Create and configure the Gradio interface."""
@@ -107,7 +294,7 @@ class DryingApp:
             
             # Set up event handlers
             submit.click(
-                fn=self.process_interaction,
+                fn=self.process_interaction_stream,
                 inputs=[message, image_input, chatbot],
                 outputs=[chatbot, image_output],
                 api_name="process"
@@ -117,7 +304,7 @@ class DryingApp:
             )
             
             message.submit(
-                fn=self.process_interaction,
+                fn=self.process_interaction_stream,
                 inputs=[message, image_input, chatbot],
                 outputs=[chatbot, image_output],
                 api_name="process_enter"
@@ -126,6 +313,14 @@ class DryingApp:
                 outputs=[message]
             )
             
+            image_input.change(
+                fn=self.speculate,
+                inputs=[image_input],
+                outputs=[],
+                show_progress="hidden",
+                api_name=False
+            )
+            
             reset.click(
                 fn=self.reset_conversation,
                 inputs=[],
@@ -133,20 +328,41 @@ class DryingApp:
                 api_name="reset"
             )
             
+            interface.unload(self.end_session)
+            
         return interface
 
+def metrics_endpoint() -> PlainTextResponse:
+    """Serve all metrics in the Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def create_server(app: DryingApp) -> FastAPI:
+    """Mount the Gradio interface on a FastAPI server with a /metrics route next to it."""
+    server = FastAPI()
+    if REGISTRY.enabled:
+        server.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+    return gr.mount_gradio_app(
+        server,
+        app.create_interface(),
+        path="/",
+        allowed_paths=["test_images"],  # Allow access to test images
+        show_error=True
+    )
+
 def main():
     """Main function to run the application."""
     app = DryingApp()
-    interface = app.create_interface()
-    interface.launch(
-        server_name="0.0.0.0",
-        server_port=7860,
-        share=False,  # Disable sharing to avoid cross-origin issues
-        show_error=True,
-        allowed_paths=["test_images"],  # Allow access to test images
-        quiet=True  # Reduce console output
-    )
+    
+    # Open connections to the Stability API while the interface starts
+    threading.Thread(
+        target=get_transport().warm_up,
+        args=(get_api_host(),),
+        kwargs={"connections": int(os.getenv("STABILITY_WARMUP_CONNECTIONS", 2))},
+        daemon=True
+    ).start()
+    
+    # Gradio UI at /, Prometheus metrics at /metrics
+    uvicorn.run(create_server(app), host="0.0.0.0", port=7860, log_level="warning")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
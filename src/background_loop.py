@@ -0,0 +1,63 @@
+"""
+Shared background event loop for running coroutines from synchronous code.
+Sync callers such as Gradio worker threads submit coroutines here instead of
+calling asyncio.run, so async clients and their pooled connections live on
+one long-running loop.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import CancelledError
+from typing import Any, Awaitable, Optional
+
+from .cancellation import CancellationToken, OperationCancelled
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """Get the background event loop, starting its thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="background-loop", daemon=True)
+            thread.start()
+        return _loop
+
+
+def run_sync(coro: Awaitable[Any], timeout: Optional[float] = None, token: Optional[CancellationToken] = None) -> Any:
+    """Run a coroutine on the background loop and block until it finishes.
+
+    Args:
+        coro: Coroutine to run
+        timeout: Seconds to wait for the result; the coroutine is cancelled on timeout
+        token: Cancellation token; cancelling it cancels the coroutine and raises OperationCancelled
+
+    Returns:
+        The coroutine's result
+    """
+    loop = get_background_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("run_sync cannot be called from the background loop itself")
+
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    remove = token.add_callback(future.cancel) if token is not None else None
+    try:
+        return future.result(timeout)
+    except CancelledError:
+        if token is not None and token.cancelled:
+            raise OperationCancelled(token.reason)
+        raise
+    except BaseException:
+        future.cancel()
+        raise
+    finally:
+        if remove is not None:
+            remove()
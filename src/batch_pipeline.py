@@ -0,0 +1,340 @@
+"""
+Staged, resumable batch drying for folders of images.
+Images flow through three stages connected by bounded queues: decode and
+resize on a process pool, drying on a pool of I/O threads that call the
+dryer backends concurrently, and a single writer thread that saves results.
+Every finished input is appended to a manifest file, so an interrupted run
+picks up where it stopped and unchanged inputs that were already dried are
+skipped. Results of a fallback backend, such as the local effect standing in
+for the API during an outage, are saved but dried again by the next run.
+"""
+
+import os
+import json
+import time
+import queue
+import logging
+import datetime
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from .image_preprocessing import fit_within, prepare_image
+from .metrics import QUEUE_WAIT_SECONDS, STAGE_SECONDS
+from .request_scheduler import BATCH, RequestTicket, use_ticket
+from .structured_logging import get_logger, log_event
+
+logger = get_logger("batch")
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif")
+
+# Marks the end of the work in a stage queue
+_DONE = object()
+
+
+def find_images(input_dir: str) -> List[str]:
+    """List the image files of a directory, sorted by name."""
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def file_fingerprint(path: str) -> Dict[str, int]:
+    """Get the size and modification time identifying a version of a file."""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_and_prepare(path: str, max_size: int) -> Tuple[str, Tuple[int, int], bytes]:
+    """Decode an image file and scale it to fit max_size; runs in a worker process.
+
+    Returns:
+        The mode, size and raw pixel data of the prepared image
+    """
+    image = prepare_image(path, fit_within(max_size))
+    return image.mode, image.size, image.tobytes()
+
+
+class BatchManifest:
+    def __init__(self, path: str):
+        """Initialize the manifest, loading the records of earlier runs.
+
+        Args:
+            path: JSON-lines file with one record per finished input; the last record of an input wins
+        """
+        self.path = path
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut short by an interrupted run
+                        continue
+                    self.records[record["input"]] = record
+
+    def is_done(self, input_path: str, fingerprint: Dict[str, int]) -> bool:
+        """Check whether this version of an input was already dried and its output still exists."""
+        record = self.records.get(input_path)
+        return (
+            record is not None
+            and record.get("status") == "done"
+            and record.get("fingerprint") == fingerprint
+            and os.path.exists(record.get("output") or "")
+        )
+
+    def record(self, input_path: str, fingerprint: Dict[str, int], status: str, **fields: Any) -> None:
+        """Append the outcome of an input and flush it to disk."""
+        record = {"input": input_path, "fingerprint": fingerprint, "status": status, "finished": time.time(), **fields}
+        with self._lock:
+            self.records[input_path] = record
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+# Dries one prepared image, returning None on failure, optionally with the name of the backend used
+ProcessResult = Union[Optional[Image.Image], Tuple[Optional[Image.Image], Optional[str]]]
+
+
+class BatchPipeline:
+    def __init__(
+        self,
+        process: Callable[[Image.Image], ProcessResult],
+        output_dir: str = "test_results",
+        manifest_path: Optional[str] = None,
+        workers: Optional[int] = None,
+        concurrency: int = 4,
+        max_size: int = 1024,
+        output_prefix: str = "enhanced_dried_",
+        fallback_backends: Collection[str] = ()
+    ):
+        """Initialize the pipeline.
+
+        Args:
+            process: Dries one prepared image, returning None on failure; called from several threads.
+                It may return (image, backend name), e.g. BackendRouter.route
+            output_dir: Directory for the dried images
+            manifest_path: Manifest file, by default manifest.jsonl in output_dir
+            workers: Processes decoding and resizing images, by default one per CPU
+            concurrency: Images being dried at once
+            max_size: Longest side images are scaled down to before drying
+            output_prefix: Prefix of the output file names
+            fallback_backends: Backends whose results are saved but recorded as "fallback", so the next run dries the input again
+        """
+        self.process = process
+        self.output_dir = output_dir
+        self.manifest = BatchManifest(manifest_path or os.path.join(output_dir, "manifest.jsonl"))
+        self.workers = workers or os.cpu_count() or 1
+        self.concurrency = max(1, concurrency)
+        self.max_size = max_size
+        self.output_prefix = output_prefix
+        self.fallback_backends = set(fallback_backends)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # First error that stopped a stage, re-raised by run
+        self._error: Optional[BaseException] = None
+        self.counts = {"processed": 0, "skipped": 0, "failed": 0, "fallback": 0}
+
+    def _count(self, outcome: str) -> None:
+        """Count the outcome of one input."""
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def _fail(self, stage: str, error: BaseException) -> None:
+        """Stop the pipeline after a stage failed; the remaining work is drained and dropped."""
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+        log_event(logger, logging.ERROR, "stage_failed", stage=stage, error=str(error))
+
+    def _put(self, stage_queue: queue.Queue, item: Any) -> None:
+        """Put an item on a bounded stage queue, giving up when the pipeline stops.
+
+        End markers are put with a plain blocking put instead: every stage
+        keeps draining its queue until it has seen them, even after a stop.
+        """
+        while not self._stop.is_set():
+            try:
+                stage_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _prepare_stage(self, inputs: List[Tuple[str, Dict[str, int]]], dry_queue: queue.Queue) -> None:
+        """Decode and resize inputs on the process pool.
+
+        Futures are queued in input order; the bounded queue limits how many
+        images are decoded ahead of the dryers.
+        """
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                for path, fingerprint in inputs:
+                    if self._stop.is_set():
+                        pool.shutdown(cancel_futures=True)
+                        return
+                    submitted = time.monotonic()
+                    future = pool.submit(load_and_prepare, path, self.max_size)
+                    future.add_done_callback(lambda _, submitted=submitted: STAGE_SECONDS.observe(
+                        time.monotonic() - submitted, component="batch", stage="prepare"
+                    ))
+                    self._put(dry_queue, (path, fingerprint, future))
+        except BaseException as e:
+            # E.g. BrokenProcessPool when a worker process died
+            self._fail("prepare", e)
+        finally:
+            for _ in range(self.concurrency):
+                dry_queue.put(_DONE)
+
+    def _dry_stage(self, dry_queue: queue.Queue, write_queue: queue.Queue) -> None:
+        """Dry prepared images with the dryer backends."""
+        try:
+            while True:
+                item = dry_queue.get()
+                if item is _DONE:
+                    return
+                path, fingerprint, future = item
+                if self._stop.is_set():
+                    continue
+                try:
+                    waited = time.monotonic()
+                    mode, size, pixels = future.result()
+                    QUEUE_WAIT_SECONDS.observe(time.monotonic() - waited, queue="batch_prepare")
+                    start = time.monotonic()
+                    # Batch requests take the API capacity interactive users leave over
+                    with use_ticket(RequestTicket(BATCH)):
+                        result = self.process(Image.frombytes(mode, size, pixels))
+                    result, backend = result if isinstance(result, tuple) else (result, None)
+                    STAGE_SECONDS.observe(time.monotonic() - start, component="batch", stage="dry")
+                    error = None if result is not None else "drying failed"
+                except Exception as e:
+                    result, backend, error = None, None, str(e)
+                self._put(write_queue, (path, fingerprint, result, backend, error))
+        except BaseException as e:
+            self._fail("dry", e)
+            # Keep draining so the prepare stage can deliver its end markers
+            while dry_queue.get() is not _DONE:
+                pass
+        finally:
+            write_queue.put(_DONE)
+
+    def _write_stage(self, write_queue: queue.Queue, producers: int, on_result: Optional[Callable[..., None]]) -> None:
+        """Save dried images and record every outcome in the manifest.
+
+        The writer drains its queue until every dry thread has finished, also
+        after a failure, so the dry threads never block on a full queue.
+        """
+        remaining = producers
+        while remaining:
+            item = write_queue.get()
+            if item is _DONE:
+                remaining -= 1
+                continue
+            if self._stop.is_set():
+                continue
+            try:
+                self._write(*item, on_result)
+            except BaseException as e:
+                self._fail("write", e)
+
+    def _write(
+        self,
+        path: str,
+        fingerprint: Dict[str, int],
+        result: Optional[Image.Image],
+        backend: Optional[str],
+        error: Optional[str],
+        on_result: Optional[Callable[..., None]]
+    ) -> None:
+        """Save one dried image, recording the input as failed if it cannot be saved."""
+        output = None
+        if result is not None:
+            try:
+                start = time.monotonic()
+                os.makedirs(self.output_dir, exist_ok=True)
+                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+                stem = os.path.splitext(os.path.basename(path))[0]
+                output = os.path.join(self.output_dir, f"{self.output_prefix}{stem}_{timestamp}.png")
+                result.save(output)
+                STAGE_SECONDS.observe(time.monotonic() - start, component="batch", stage="write")
+            except Exception as e:
+                output, error = None, f"saving failed: {e}"
+        if output is None:
+            self.manifest.record(path, fingerprint, "failed", error=error)
+            self._count("failed")
+            log_event(logger, logging.WARNING, "input_failed", input=path, error=error)
+        elif backend in self.fallback_backends:
+            # Kept for now, but not done: the next run tries the preferred backends again
+            self.manifest.record(path, fingerprint, "fallback", output=output, backend=backend)
+            self._count("fallback")
+            log_event(logger, logging.WARNING, "input_fallback", input=path, output=output, backend=backend)
+        else:
+            fields = {"backend": backend} if backend is not None else {}
+            self.manifest.record(path, fingerprint, "done", output=output, **fields)
+            self._count("processed")
+            log_event(logger, logging.INFO, "input_done", input=path, output=output)
+        if on_result is not None:
+            on_result(path, self.manifest.records[path])
+
+    def run(self, inputs: List[str], on_result: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """Dry a list of image files, skipping those the manifest shows as done.
+
+        Args:
+            inputs: Paths of the images to dry
+            on_result: Called from the writer thread with each input and its manifest record
+
+        Returns:
+            The number of processed, skipped, failed and fallback inputs and the elapsed seconds
+        """
+        start = time.monotonic()
+        pending = []
+        for path in inputs:
+            fingerprint = file_fingerprint(path)
+            if self.manifest.is_done(path, fingerprint):
+                self._count("skipped")
+            else:
+                pending.append((path, fingerprint))
+        log_event(
+            logger, logging.INFO, "batch_started",
+            inputs=len(inputs), pending=len(pending), workers=self.workers, concurrency=self.concurrency
+        )
+
+        # Bounded queues keep memory flat: decoded images wait for a dryer slot, results for the writer
+        dry_queue: queue.Queue = queue.Queue(maxsize=self.workers + self.concurrency)
+        write_queue: queue.Queue = queue.Queue(maxsize=self.concurrency * 2)
+        threads = [threading.Thread(target=self._prepare_stage, args=(pending, dry_queue), name="batch-prepare", daemon=True)]
+        threads += [
+            threading.Thread(target=self._dry_stage, args=(dry_queue, write_queue), name=f"batch-dry-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        threads.append(threading.Thread(
+            target=self._write_stage, args=(write_queue, self.concurrency, on_result), name="batch-write", daemon=True
+        ))
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            # Finished inputs are already in the manifest, the next run resumes from there
+            self._stop.set()
+            log_event(logger, logging.WARNING, "batch_interrupted", **self.counts)
+            raise
+        if self._error is not None:
+            # Finished inputs are in the manifest, a rerun resumes after fixing the cause
+            raise self._error
+
+        summary = dict(self.counts, seconds=round(time.monotonic() - start, 3))
+        log_event(logger, logging.INFO, "batch_finished", **summary)
+        return summary
@@ -0,0 +1,171 @@
+"""
+Cooperative cancellation for image drying.
+A CancellationToken is attached to the context a piece of work runs in, and
+the agent, router and dryers check it between steps: before each API
+attempt, during retry sleeps and while waiting for an HTTP response. When
+the token is cancelled (the conversation was reset, or a newer message
+superseded the request) the work raises OperationCancelled at the next
+check instead of running its remaining retries, so the worker thread and
+API quota go to live requests.
+"""
+
+import os
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional
+
+from .metrics import CANCELLATIONS, CANCELLED_WORK
+from .structured_logging import get_logger, log_event
+
+logger = get_logger("cancellation")
+
+_current_token: contextvars.ContextVar[Optional["CancellationToken"]] = contextvars.ContextVar(
+    "drying_cancellation_token", default=None
+)
+
+# Threads that wait on blocking calls so the caller can give up on them when cancelled
+_call_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("DRYING_CANCELLABLE_CALL_WORKERS", 32)),
+    thread_name_prefix="drying-cancellable"
+)
+
+
+class OperationCancelled(BaseException):
+    """Raised at a cancellation check once the work's token is cancelled.
+
+    Like asyncio.CancelledError it derives from BaseException, so the
+    generic error handling around API calls does not mistake it for a
+    failed request.
+    """
+
+
+class CancellationToken:
+    def __init__(self):
+        """Initialize a token that has not been cancelled."""
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], Any]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        """Check whether the token has been cancelled."""
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        """Cancel the token and run its callbacks.
+
+        Returns:
+            True if this call cancelled the token, False if it already was
+        """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        CANCELLATIONS.inc(reason=reason)
+        log_event(logger, logging.INFO, "cancelled", reason=reason)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                log_event(logger, logging.WARNING, "cancel_callback_failed", error=str(e))
+        return True
+
+    def add_callback(self, callback: Callable[[], Any]) -> Callable[[], None]:
+        """Run a callback when the token is cancelled, straight away if it already is.
+
+        Returns:
+            A function removing the callback again
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback: Callable[[], Any]) -> None:
+        """Remove a callback that has not run yet."""
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the token is cancelled or the timeout passes.
+
+        Returns:
+            Whether the token was cancelled
+        """
+        return self._event.wait(timeout)
+
+
+def current_token() -> Optional[CancellationToken]:
+    """Get the token of the work running in the current context, if any."""
+    return _current_token.get()
+
+
+@contextmanager
+def use_token(token: Optional[CancellationToken]) -> Iterator[None]:
+    """Make a token the current one while the with block runs."""
+    reset = _current_token.set(token)
+    try:
+        yield
+    finally:
+        _current_token.reset(reset)
+
+
+def check_cancelled(component: str, stage: str) -> None:
+    """Raise OperationCancelled if the current token is cancelled, counting where the work stopped."""
+    token = _current_token.get()
+    if token is not None and token.cancelled:
+        _stopped(component, stage, token)
+
+
+def _stopped(component: str, stage: str, token: CancellationToken) -> None:
+    """Count and log work stopped by a cancelled token, then raise OperationCancelled."""
+    CANCELLED_WORK.inc(component=component, stage=stage)
+    log_event(logger, logging.INFO, "work_stopped", component=component, stage=stage, reason=token.reason)
+    raise OperationCancelled(token.reason)
+
+
+def cancellable_sleep(seconds: float, component: str, stage: str = "retry_sleep") -> None:
+    """Sleep, waking up early with OperationCancelled if the current token is cancelled."""
+    token = _current_token.get()
+    if token is None:
+        time.sleep(seconds)
+        return
+    if token.wait(seconds):
+        _stopped(component, stage, token)
+
+
+def cancellable_call(fn: Callable[..., Any], *args, component: str, stage: str = "request", **kwargs) -> Any:
+    """Call a blocking function, giving up on it with OperationCancelled if the current token is cancelled.
+
+    Without a current token the function is called directly. Otherwise it
+    runs on a helper thread, so the caller can return as soon as the token is
+    cancelled; the abandoned call finishes in the background and its result
+    is dropped. Use this for calls that cannot be interrupted, such as a
+    blocking HTTP request.
+    """
+    token = _current_token.get()
+    if token is None:
+        return fn(*args, **kwargs)
+    check_cancelled(component, stage)
+    context = contextvars.copy_context()
+    future = _call_executor.submit(context.run, fn, *args, **kwargs)
+    done = threading.Event()
+    future.add_done_callback(lambda _: done.set())
+    remove = token.add_callback(done.set)
+    try:
+        done.wait()
+    finally:
+        remove()
+    if not future.done():
+        _stopped(component, stage, token)
+    return future.result()
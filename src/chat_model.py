@@ -2,13 +2,14 @@ from langchain.chat_models import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
 import os
 from dotenv import load_dotenv
+from .response_cache import get_response_cache
 
 class ChatModel:
     def __init__(self):
         load_dotenv()
         self.model = ChatOpenAI(
             model_name="google/gemini-2.0-flash-lite-preview-02-05:free",
-            openai_api_base="https://openrouter.ai/api/v1",
+            openai_api_base=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
             openai_api_key=os.getenv("OPENROUTER_API_KEY"),
             temperature=0.7,
         )
@@ -21,6 +22,9 @@ class ChatModel:
         3. Maintain conversation context
         4. Be helpful and informative about drying processes
         """
+        
+        # Opt-in cache of answers to questions asked without chat history
+        self.response_cache = get_response_cache()
 
     def get_response(self, message: str, chat_history: list = None) -> str:
         """
@@ -33,6 +37,12 @@ class ChatModel:
         Returns:
             Model's response
         """
+        cache_context = (self.model.model_name, self.model.temperature, self.system_prompt)
+        if self.response_cache is not None and not chat_history:
+            cached = self.response_cache.get(message, *cache_context)
+            if cached is not None:
+                return cached
+        
         messages = [SystemMessage(content=self.system_prompt)]
         
         if chat_history:
@@ -42,4 +52,7 @@ class ChatModel:
         messages.append(HumanMessage(content=message))
         
         response = self.model(messages)
+        
+        if self.response_cache is not None and not chat_history:
+            self.response_cache.put(message, *cache_context, response.content)
         return response.content 
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""
+Per-engine circuit breakers for the Stability AI API.
+Breakers are shared by every dryer in the process, so once an engine has
+failed repeatedly, later requests skip it until a half-open trial request
+succeeds instead of rediscovering the failure with their own retries.
+"""
+
+import os
+import time
+import threading
+from typing import Optional, Dict, Any
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 3, recovery_timeout: float = 30.0):
+        """Initialize the breaker.
+
+        Args:
+            failure_threshold: Consecutive failures that open the circuit
+            recovery_timeout: Seconds the circuit stays open before a trial request
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._open_until = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """Get the current state, moving from open to half-open once the timeout passes."""
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._open_until:
+                self._state = HALF_OPEN
+                self._trial_in_flight = False
+            return self._state
+
+    def allow_request(self) -> bool:
+        """Check whether a request may be sent, reserving the trial slot when half-open."""
+        state = self.state
+        with self._lock:
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        """Close the circuit after a successful request."""
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self, retry_after: Optional[float] = None) -> None:
+        """Count a failed request, opening the circuit past the threshold.
+
+        Args:
+            retry_after: Seconds the server asked us to wait; opens the circuit for at least that long
+        """
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            duration = 0.0
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                duration = self.recovery_timeout
+            if retry_after:
+                duration = max(duration, retry_after)
+            if duration > 0:
+                self._state = OPEN
+                self._open_until = max(self._open_until, time.monotonic() + duration)
+
+    def release(self) -> None:
+        """Release a half-open trial slot without recording an outcome."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the breaker state and failure count."""
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "open_for": max(0.0, self._open_until - time.monotonic()) if state == OPEN else 0.0
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(engine: str) -> CircuitBreaker:
+    """Get the process-wide circuit breaker for an engine."""
+    with _breakers_lock:
+        breaker = _breakers.get(engine)
+        if breaker is None:
+            breaker = _breakers[engine] = CircuitBreaker(
+                failure_threshold=int(os.getenv("STABILITY_BREAKER_THRESHOLD", 3)),
+                recovery_timeout=float(os.getenv("STABILITY_BREAKER_RECOVERY", 30))
+            )
+        return breaker
+
+
+def reset_circuit_breakers() -> None:
+    """Drop all breakers, closing every circuit."""
+    with _breakers_lock:
+        _breakers.clear()
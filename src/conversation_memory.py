@@ -0,0 +1,165 @@
+"""
+Token-budgeted conversation memory for the DryingAgent.
+Recent turns are kept verbatim while they fit a token budget. Older turns
+are folded into a running summary by one summarization call every few
+turns, so prompt size stays flat however long the conversation gets.
+"""
+
+import logging
+import threading
+from typing import List, Union, Callable, Dict, Any
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, AIMessage
+
+from .structured_logging import get_logger, log_event
+
+logger = get_logger("memory")
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an assistant that helps dry items.
+Update the summary with the new messages. Keep the items discussed, their condition and the advice already given.
+Reply with the updated summary only."""
+
+
+def estimate_tokens(messages: List[BaseMessage]) -> int:
+    """Estimate the token count of messages at roughly four characters per token."""
+    return sum(len(str(message.content)) // 4 + 4 for message in messages)
+
+
+class ConversationMemory:
+    def __init__(
+        self,
+        summarizer=None,
+        max_tokens: int = 1500,
+        recent_turns: int = 2,
+        summarize_every: int = 4,
+        token_counter: Callable[[List[BaseMessage]], int] = estimate_tokens
+    ):
+        """Initialize the memory.
+
+        Args:
+            summarizer: Chat model used to fold old turns into the summary, or None to drop them
+            max_tokens: Token budget for the summary and verbatim history
+            recent_turns: Number of most recent turns always kept verbatim
+            summarize_every: Number of overflowing turns folded per summarization call
+            token_counter: Function counting the tokens of a list of messages
+        """
+        self.summarizer = summarizer
+        self.max_tokens = max_tokens
+        self.recent_turns = recent_turns
+        self.summarize_every = summarize_every
+        self.token_counter = token_counter
+        self.messages: List[Union[HumanMessage, AIMessage]] = []
+        self.summary = ""
+        self.summarizations = 0
+        self._lock = threading.Lock()
+        self._summarizing = False
+        self._generation = 0
+
+    def _summary_messages(self) -> List[BaseMessage]:
+        """Get the summary as prompt messages."""
+        if not self.summary:
+            return []
+        return [SystemMessage(content=f"Summary of the earlier conversation: {self.summary}")]
+
+    def _overflow_turns(self) -> int:
+        """Count the oldest turns that do not fit the token budget."""
+        turns = len(self.messages) // 2
+        overflow = 0
+        while turns - overflow > self.recent_turns:
+            kept = self.messages[overflow * 2:]
+            if self.token_counter(self._summary_messages() + kept) <= self.max_tokens:
+                break
+            overflow += 1
+        return overflow
+
+    def build_prompt(self, system_prompt: SystemMessage, message: str) -> List[BaseMessage]:
+        """Build the prompt for a new user message from the summary and verbatim history."""
+        with self._lock:
+            return [system_prompt] + self._summary_messages() + list(self.messages) + [HumanMessage(content=message)]
+
+    def count_tokens(self, messages: List[BaseMessage]) -> int:
+        """Count the tokens of a list of messages."""
+        return self.token_counter(messages)
+
+    def add_exchange(self, message: str, response_content: str) -> None:
+        """Add a user message and assistant response to the history."""
+        with self._lock:
+            self.messages.append(HumanMessage(content=message))
+            self.messages.append(AIMessage(content=response_content))
+            # Without a summarizer overflowing turns are dropped; with one, only
+            # when summarization falls behind by more than two batches
+            limit = 0 if self.summarizer is None else self.summarize_every * 2
+            overflow = self._overflow_turns()
+            if overflow > limit:
+                del self.messages[:(overflow - limit) * 2]
+
+    def needs_summary(self) -> bool:
+        """Check whether enough turns overflow the budget to fold them into the summary."""
+        with self._lock:
+            return (
+                self.summarizer is not None
+                and not self._summarizing
+                and self._overflow_turns() >= self.summarize_every
+            )
+
+    def maybe_summarize(self) -> bool:
+        """Fold overflowing turns into the summary with one summarization call.
+
+        Overflowing turns stay in the prompt verbatim until the call finishes.
+
+        Returns:
+            True if the summary was updated
+        """
+        with self._lock:
+            if self.summarizer is None or self._summarizing:
+                return False
+            overflow = self._overflow_turns()
+            if overflow < self.summarize_every:
+                return False
+            self._summarizing = True
+            generation = self._generation
+            folded = self.messages[:overflow * 2]
+            previous_summary = self.summary
+
+        try:
+            transcript = "\n".join(
+                f"{'User' if isinstance(m, HumanMessage) else 'Assistant'}: {m.content}" for m in folded
+            )
+            response = self.summarizer.invoke([
+                SystemMessage(content=SUMMARY_PROMPT),
+                HumanMessage(content=f"Current summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}")
+            ])
+            summary = response.content if hasattr(response, 'content') else str(response)
+        except Exception as e:
+            log_event(logger, logging.ERROR, "summarize_failed", error=str(e))
+            with self._lock:
+                self._summarizing = False
+            return False
+
+        with self._lock:
+            self._summarizing = False
+            if generation != self._generation:
+                # The memory was reset while summarizing
+                return False
+            self.summary = summary
+            folded_ids = {id(m) for m in folded}
+            while self.messages and id(self.messages[0]) in folded_ids:
+                self.messages.pop(0)
+            self.summarizations += 1
+            return True
+
+    def reset(self) -> None:
+        """Clear the summary and history."""
+        with self._lock:
+            self.messages = []
+            self.summary = ""
+            self._generation += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the current history size and summarization count."""
+        with self._lock:
+            return {
+                "verbatim_messages": len(self.messages),
+                "summary_tokens": self.token_counter(self._summary_messages()),
+                "history_tokens": self.token_counter(self._summary_messages() + self.messages),
+                "summarizations": self.summarizations
+            }
@@ -0,0 +1,129 @@
+"""
+Pluggable backends that turn an image into its dried version.
+Every way of drying an image (Stability SDXL, the other Stability engines
+and the local NumPy effect) implements the same DryerBackend interface, and
+backends are created by name from a registry so the router, the agent and
+the batch tools share one code path.
+"""
+
+import os
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image
+
+from .circuit_breaker import OPEN, get_circuit_breaker
+from .drying_effect import apply_drying_effect
+from .enhanced_image_dryer import EnhancedImageDryer
+from .image_dryer import ImageDryer
+
+
+class DryerBackend:
+    # Name used in the registry, metrics and logs
+    name = ""
+    # Whether the backend calls a remote API; local backends are the last resort
+    remote = True
+
+    def available(self) -> bool:
+        """Check whether the backend can take a request right now."""
+        return True
+
+    def process_image(self, image: Image.Image, use_cache: bool = True) -> Optional[Image.Image]:
+        """Dry an image.
+
+        Returns:
+            The dried image, or None if the backend failed
+        """
+        raise NotImplementedError
+
+
+class StabilityXLBackend(DryerBackend):
+    name = "stability-xl"
+
+    def __init__(self, dryer: Optional[ImageDryer] = None):
+        """Initialize the backend with the SDXL image-to-image dryer."""
+        self.dryer = dryer or ImageDryer()
+
+    def available(self) -> bool:
+        """Check that an API key is set and the engine's circuit is not open."""
+        return bool(self.dryer.api_key) and get_circuit_breaker(self.dryer.engine_id).state != OPEN
+
+    def process_image(self, image: Image.Image, use_cache: bool = True) -> Optional[Image.Image]:
+        """Dry an image with SDXL, snapped to its supported dimensions."""
+        return self.dryer.process_image(image, use_cache=use_cache)
+
+
+class StabilityEngineBackend(DryerBackend):
+    def __init__(self, engine: str, dryer: Optional[EnhancedImageDryer] = None):
+        """Initialize the backend for one Stability engine.
+
+        Args:
+            engine: Stability engine id, also used as the backend name
+            dryer: Dryer to send requests with; by default one limited to this engine
+        """
+        self.name = engine
+        self.engine = engine
+        self.dryer = dryer or EnhancedImageDryer(engines=[engine])
+        # Failing over to another backend is the router's job
+        self.dryer.max_retries = 1
+
+    def available(self) -> bool:
+        """Check that an API key is set and the engine's circuit is not open."""
+        return bool(self.dryer.api_key) and get_circuit_breaker(self.engine).state != OPEN
+
+    def process_image(self, image: Image.Image, use_cache: bool = True) -> Optional[Image.Image]:
+        """Dry an image with the engine."""
+        return self.dryer.process_image(image, use_cache=use_cache)
+
+
+class LocalEffectBackend(DryerBackend):
+    name = "local"
+    remote = False
+
+    def __init__(self, brightness: float = 1.2, contrast: float = 1.1, saturation: float = 0.8):
+        """Initialize the local effect with its tone and saturation parameters."""
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+
+    def process_image(self, image: Image.Image, use_cache: bool = True) -> Optional[Image.Image]:
+        """Brighten, add contrast and reduce saturation to simulate drying."""
+        return apply_drying_effect(
+            image,
+            brightness=self.brightness,
+            contrast=self.contrast,
+            saturation=self.saturation
+        )
+
+
+_factories: Dict[str, Callable[[], DryerBackend]] = {
+    "stability-xl": StabilityXLBackend,
+    "stable-diffusion-v1-5": lambda: StabilityEngineBackend("stable-diffusion-v1-5"),
+    "stable-diffusion-512-v2-1": lambda: StabilityEngineBackend("stable-diffusion-512-v2-1"),
+    "local": LocalEffectBackend
+}
+
+DEFAULT_BACKENDS = "stability-xl,stable-diffusion-v1-5,stable-diffusion-512-v2-1,local"
+
+
+def register_backend(name: str, factory: Callable[[], DryerBackend]) -> None:
+    """Register a backend factory under a name, replacing any existing one."""
+    _factories[name] = factory
+
+
+def backend_names() -> List[str]:
+    """Get the names of all registered backends."""
+    return list(_factories)
+
+
+def create_backend(name: str) -> DryerBackend:
+    """Create a registered backend by name."""
+    factory = _factories.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown dryer backend: {name}. Registered: {', '.join(_factories)}")
+    return factory()
+
+
+def create_backends(names: Optional[str] = None) -> List[DryerBackend]:
+    """Create backends from a comma-separated list, by default DRYING_BACKENDS."""
+    names = names or os.getenv("DRYING_BACKENDS", DEFAULT_BACKENDS)
+    return [create_backend(name.strip()) for name in names.split(",") if name.strip()]
@@ -0,0 +1,246 @@
+"""
+Latency-aware routing between dryer backends.
+The router keeps a rolling window of latency and success for every backend
+and sends each request to the fastest healthy remote backend whose p95
+latency meets the SLO, failing over along that order and ending with the
+local effect. Backends without recent samples are treated optimistically so
+they are probed again once their old samples age out. Identical concurrent
+requests to a remote backend are coalesced before they take a scheduler
+slot, so waiting duplicates hold neither a slot nor API quota.
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import nullcontext
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from .cancellation import check_cancelled
+from .dryer_backends import DryerBackend, create_backends
+from .image_preprocessing import image_digest
+from .metrics import BACKEND_REQUESTS, STAGE_SECONDS
+from .request_scheduler import RequestScheduler, get_request_scheduler
+from .single_flight import SingleFlight, get_single_flight
+from .structured_logging import get_logger, log_event
+
+logger = get_logger("router")
+
+
+class BackendStats:
+    def __init__(self, max_samples: int = 50, max_age: float = 300.0):
+        """Initialize the rolling window.
+
+        Args:
+            max_samples: Number of recent requests kept
+            max_age: Seconds after which a sample no longer counts
+        """
+        self.max_age = max_age
+        # (finished at, latency, succeeded)
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=max_samples)
+
+    def record(self, latency: float, succeeded: bool) -> None:
+        """Record the outcome of one request."""
+        self._samples.append((time.monotonic(), latency, succeeded))
+
+    def _prune(self) -> None:
+        """Drop samples older than max_age."""
+        cutoff = time.monotonic() - self.max_age
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def summary(self) -> Dict[str, Any]:
+        """Get the request count, success rate and success latency percentiles of the window."""
+        self._prune()
+        latencies = sorted(latency for _, latency, ok in self._samples if ok)
+
+        def percentile(pct: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[max(1, math.ceil(pct / 100 * len(latencies))) - 1]
+
+        count = len(self._samples)
+        return {
+            "requests": count,
+            "successes": len(latencies),
+            "success_rate": len(latencies) / count if count else None,
+            "p50": percentile(50),
+            "p95": percentile(95)
+        }
+
+
+class BackendRouter:
+    def __init__(
+        self,
+        backends: List[DryerBackend],
+        slo: float = 30.0,
+        min_samples: int = 3,
+        min_success_rate: float = 0.5,
+        max_samples: int = 50,
+        max_age: float = 300.0,
+        scheduler: Optional[RequestScheduler] = None,
+        coalescer: Optional[SingleFlight] = None
+    ):
+        """Initialize the router.
+
+        Args:
+            backends: Backends in order of preference when nothing is known about them
+            slo: Target p95 latency in seconds for a remote backend, and the budget of one request
+            min_samples: Samples needed before a backend's latency or success rate is trusted
+            min_success_rate: Success rate below which a backend is considered unhealthy
+            max_samples: Requests kept per backend
+            max_age: Seconds a sample counts towards the statistics
+            scheduler: Scheduler granting remote requests a slot by priority class; None sends them straight away
+            coalescer: Group sharing one remote request between identical concurrent requests; None sends each
+        """
+        self.backends = backends
+        self.slo = slo
+        self.min_samples = min_samples
+        self.min_success_rate = min_success_rate
+        self.scheduler = scheduler
+        self.coalescer = coalescer
+        self._stats = {backend.name: BackendStats(max_samples, max_age) for backend in backends}
+        self._lock = threading.Lock()
+        self.last_route: Optional[Dict[str, Any]] = None
+
+    def get(self, name: str) -> DryerBackend:
+        """Get a backend by name."""
+        for backend in self.backends:
+            if backend.name == name:
+                return backend
+        raise ValueError(f"Unknown dryer backend: {name}")
+
+    def plan(self) -> List[DryerBackend]:
+        """Order the backends to try for a request: healthy remote backends meeting the SLO,
+        fastest first, then local backends."""
+        remote: List[Tuple[float, int, DryerBackend]] = []
+        local: List[DryerBackend] = []
+        with self._lock:
+            summaries = {name: stats.summary() for name, stats in self._stats.items()}
+        for index, backend in enumerate(self.backends):
+            if not backend.available():
+                continue
+            if not backend.remote:
+                local.append(backend)
+                continue
+            summary = summaries[backend.name]
+            if summary["requests"] >= self.min_samples and summary["success_rate"] < self.min_success_rate:
+                continue
+            if summary["successes"] >= self.min_samples:
+                if summary["p95"] > self.slo:
+                    continue
+                expected = summary["p50"]
+            else:
+                # Too little recent data: optimistic, so the backend gets probed
+                expected = 0.0
+            remote.append((expected, index, backend))
+        return [backend for _, _, backend in sorted(remote, key=lambda item: item[:2])] + local
+
+    def record(self, name: str, latency: float, succeeded: bool) -> None:
+        """Record the outcome of a request to a backend."""
+        with self._lock:
+            self._stats[name].record(latency, succeeded)
+        BACKEND_REQUESTS.inc(backend=name, outcome="success" if succeeded else "failure")
+        STAGE_SECONDS.observe(latency, component="router", stage=name)
+
+    def _call_remote(self, backend: DryerBackend, image: Image.Image, use_cache: bool) -> Tuple[Optional[Image.Image], float]:
+        """Send an image to a remote backend once it holds a scheduler slot.
+
+        Returns:
+            The dried image, or None on failure, and the seconds spent in the backend
+        """
+        with self.scheduler.slot() if self.scheduler is not None else nullcontext():
+            start = time.monotonic()
+            try:
+                result = backend.process_image(image, use_cache=use_cache)
+            except Exception as e:
+                log_event(logger, logging.WARNING, "backend_error", backend=backend.name, error=str(e))
+                result = None
+            return result, time.monotonic() - start
+
+    def process_image(self, image: Image.Image, use_cache: bool = True) -> Optional[Image.Image]:
+        """Dry an image with the best backend, failing over along the plan.
+
+        Remote backends are skipped once the request has used up the SLO. A
+        cancelled request raises OperationCancelled without counting against
+        the backend it was stopped in.
+
+        Returns:
+            The dried image, or None if every backend failed
+        """
+        return self.route(image, use_cache)[0]
+
+    def route(self, image: Image.Image, use_cache: bool = True) -> Tuple[Optional[Image.Image], Optional[str]]:
+        """Dry an image like process_image, also telling which backend made the result.
+
+        Returns:
+            The dried image and the name of its backend, or (None, None) if every backend failed
+        """
+        start = time.monotonic()
+        tried = []
+        digest = None
+        for backend in self.plan():
+            check_cancelled("router", "backend")
+            if backend.remote and time.monotonic() - start > self.slo:
+                log_event(logger, logging.INFO, "backend_skipped", backend=backend.name, reason="slo_exhausted")
+                continue
+            tried.append(backend.name)
+            shared = False
+            if not backend.remote:
+                attempt_start = time.monotonic()
+                try:
+                    result = backend.process_image(image, use_cache=use_cache)
+                except Exception as e:
+                    log_event(logger, logging.WARNING, "backend_error", backend=backend.name, error=str(e))
+                    result = None
+                latency = time.monotonic() - attempt_start
+            elif self.coalescer is None:
+                result, latency = self._call_remote(backend, image, use_cache)
+            else:
+                # Duplicates wait here, before the scheduler, and get a copy of the shared result
+                digest = digest or image_digest(image)
+                (result, latency), shared = self.coalescer.do(
+                    f"{backend.name}:{digest}:{use_cache}", self._call_remote, backend, image, use_cache
+                )
+                if shared and result is not None:
+                    result = result.copy()
+            # A shared request was already recorded by the caller that made it
+            if not shared:
+                self.record(backend.name, latency, result is not None)
+            if result is not None:
+                self.last_route = {"backend": backend.name, "tried": tried, "latency": time.monotonic() - start}
+                log_event(logger, logging.INFO, "routed", backend=backend.name, tried=",".join(tried))
+                return result, backend.name
+        self.last_route = {"backend": None, "tried": tried, "latency": time.monotonic() - start}
+        log_event(logger, logging.ERROR, "all_backends_failed", tried=",".join(tried))
+        return None, None
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get the rolling statistics of every backend."""
+        with self._lock:
+            return {name: stats.summary() for name, stats in self._stats.items()}
+
+
+_default_router: Optional[BackendRouter] = None
+_default_router_lock = threading.Lock()
+
+
+def get_dryer_router() -> BackendRouter:
+    """Get the process-wide router over the DRYING_BACKENDS backends."""
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = BackendRouter(
+                create_backends(),
+                slo=float(os.getenv("DRYING_ROUTER_SLO", 30)),
+                min_samples=int(os.getenv("DRYING_ROUTER_MIN_SAMPLES", 3)),
+                min_success_rate=float(os.getenv("DRYING_ROUTER_MIN_SUCCESS_RATE", 0.5)),
+                max_age=float(os.getenv("DRYING_ROUTER_WINDOW", 300)),
+                scheduler=get_request_scheduler(),
+                coalescer=get_single_flight()
+            )
+        return _default_router
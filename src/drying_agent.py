@@ -1,31 +1,256 @@
 import os
-from typing import Optional, Tuple, List, Union
+import time
+import uuid
+import queue
+import logging
+import threading
+import contextvars
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import nullcontext
+from typing import Optional, Tuple, List, Union, Callable, Any, Iterator
 from PIL import Image
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
-from .image_dryer import ImageDryer
+from .cancellation import CancellationToken, OperationCancelled, check_cancelled, use_token
+from .conversation_memory import ConversationMemory
+from .dryer_backends import LocalEffectBackend
+from .dryer_router import get_dryer_router
+from .image_preprocessing import fit_within, image_digest
+from .metrics import FREED_WORKERS, PROGRESSIVE_RESULTS, QUEUE_WAIT_SECONDS, SPECULATIONS, STAGE_SECONDS
+from .perceptual_index import use_index_owner
+from .profiling import attach_current_thread
+from .request_scheduler import INTERACTIVE, SPECULATIVE, RequestTicket, get_request_scheduler, use_ticket
+from .response_cache import get_response_cache
+from .structured_logging import get_logger, log_event
+
+logger = get_logger("agent")
+
+# Worker threads shared by all agents for running the chat and image legs concurrently
+_leg_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("DRYING_AGENT_WORKERS", 16)),
+    thread_name_prefix="drying-agent"
+)
+
+def _submit_leg(
+    stage: str,
+    fn: Callable[..., Any],
+    *args,
+    token: Optional[CancellationToken] = None,
+    ticket: Optional[RequestTicket] = None
+) -> Future:
+    """Run fn on the shared executor, recording its queue wait and duration under a stage name.
+
+    With a cancellation token the leg stops at the next cancellation check
+    once the token is cancelled, freeing its worker thread. The ticket sets
+    the priority class of the API requests the leg makes.
+    """
+    submitted = time.monotonic()
+    # Carry the caller's context over, so a request being profiled includes the leg
+    context = contextvars.copy_context()
+    
+    def run() -> Any:
+        start = time.monotonic()
+        QUEUE_WAIT_SECONDS.observe(start - submitted, queue="agent_legs")
+        try:
+            with attach_current_thread(), use_token(token) if token is not None else nullcontext():
+                with use_ticket(ticket) if ticket is not None else nullcontext():
+                    check_cancelled("agent", stage)
+                    return fn(*args)
+        except OperationCancelled:
+            FREED_WORKERS.inc(stage=stage)
+            log_event(logger, logging.INFO, "worker_freed", stage=stage, seconds=round(time.monotonic() - start, 3))
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            STAGE_SECONDS.observe(elapsed, component="agent", stage=stage)
+            log_event(logger, logging.DEBUG, "leg_finished", stage=stage, seconds=round(elapsed, 3))
+    
+    return _leg_executor.submit(context.run, run)
 
 class DryingAgent:
     def __init__(self):
         """Initialize the DryingAgent with chat model and image processor."""
         self.chat_model = ChatOpenAI(
-            base_url="https://openrouter.ai/api/v1",
+            base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
             model_name="google/gemini-pro",
             openai_api_key=os.getenv("OPENROUTER_API_KEY"),
             temperature=0.7
         )
         
-        self.image_dryer = ImageDryer()
-        self.chat_history: List[Union[HumanMessage, AIMessage]] = []
+        # Shared router picking the fastest healthy dryer backend per request
+        self.image_dryer = get_dryer_router()
+        # Recent turns verbatim, older turns folded into a running summary
+        self.memory = ConversationMemory(
+            summarizer=self.chat_model,
+            max_tokens=int(os.getenv("DRYING_MEMORY_MAX_TOKENS", 1500)),
+            recent_turns=int(os.getenv("DRYING_MEMORY_RECENT_TURNS", 2)),
+            summarize_every=int(os.getenv("DRYING_MEMORY_SUMMARIZE_EVERY", 4))
+        )
+        self.last_prompt_tokens = 0
+        # Opt-in cache of answers to first-turn questions
+        self.response_cache = get_response_cache()
         self.current_image: Optional[Image.Image] = None
         self.processed_image: Optional[Image.Image] = None
         
+        # Per-leg timeouts in seconds
+        self.chat_timeout = float(os.getenv("DRYING_CHAT_TIMEOUT", 60))
+        self.image_timeout = float(os.getenv("DRYING_IMAGE_TIMEOUT", 180))
+        
+        # Progressive results: stream a local preview first, upgrade it when the API
+        # returns, and keep the preview once the deadline has passed
+        self.progressive = os.getenv("DRYING_PROGRESSIVE", "true").lower() == "true"
+        self.progressive_deadline = float(os.getenv("DRYING_PROGRESSIVE_DEADLINE", 60))
+        self.preview_backend = LocalEffectBackend()
+        self.preview_max_size = int(os.getenv("DRYING_PREVIEW_MAX_SIZE", 1024))
+        
+        # Image leg started when the image was uploaded: (image digest, future, token, ticket)
+        self._speculation: Optional[Tuple[str, Future, CancellationToken, RequestTicket]] = None
+        # Image leg of the latest message, cancelled when a message with another image or a reset
+        # supersedes it: (image digest, future, token)
+        self._pending_image: Optional[Tuple[str, Future, CancellationToken]] = None
+        self._speculation_lock = threading.Lock()
+        # Identifies this session to the near-duplicate index
+        self.session_key = uuid.uuid4().hex
+        
         # System prompt for the agent
         self.system_prompt = SystemMessage(content="""You are a helpful assistant specialized in drying items. 
         Your main task is to help users dry various items and provide advice about drying processes. 
         When users provide images, you should analyze them and suggest appropriate drying methods. 
         Always maintain a professional and helpful tone while focusing on drying-related queries.""")
     
+    @property
+    def chat_history(self) -> List[Union[HumanMessage, AIMessage]]:
+        """Get the messages kept verbatim in memory."""
+        return self.memory.messages
+    
+    def _build_messages(self, message: str) -> list:
+        """Build the prompt messages for a new user message and record their token count."""
+        messages = self.memory.build_prompt(self.system_prompt, message)
+        self.last_prompt_tokens = self.memory.count_tokens(messages)
+        log_event(logger, logging.DEBUG, "prompt_built", prompt_tokens=self.last_prompt_tokens)
+        return messages
+    
+    def _cached_response(self, message: str) -> Tuple[bool, Optional[str]]:
+        """Look up a cached answer for a first-turn message.
+
+        Returns:
+            Whether the message is cacheable and the cached response, if any
+        """
+        # Only the first turn has no conversation context the answer could depend on
+        if self.response_cache is None or self.memory.messages or self.memory.summary:
+            return False, None
+        return True, self.response_cache.get(message, *self._response_cache_context())
+    
+    def _response_cache_context(self) -> Tuple[str, float, str]:
+        """Get the model name, temperature and system prompt the cached answers depend on."""
+        return (
+            str(getattr(self.chat_model, "model_name", "")),
+            float(getattr(self.chat_model, "temperature", 0) or 0),
+            self.system_prompt.content
+        )
+    
+    def _remember(self, message: str, response_content: str) -> None:
+        """Add an exchange to memory, folding old turns into the summary in the background."""
+        self.memory.add_exchange(message, response_content)
+        if self.memory.needs_summary():
+            _submit_leg("summarize", self.memory.maybe_summarize)
+    
+    def speculate(self, image: Optional[Image.Image]) -> None:
+        """Start drying an uploaded image before the message is sent.
+
+        The result is picked up by the next message with the same image. A
+        different image, or None when the image is cleared, cancels the
+        previous speculation.
+        """
+        key = image_digest(image) if image is not None else None
+        with self._speculation_lock:
+            if self._speculation is not None and self._speculation[0] == key:
+                return
+            self._cancel_speculation("image_replaced" if image is not None else "image_cleared")
+            if image is None:
+                return
+            # Speculative requests yield to interactive ones until a message picks them up
+            token, ticket = CancellationToken(), RequestTicket(SPECULATIVE)
+            future = _submit_leg("speculative_image", self._dry_image, image, token=token, ticket=ticket)
+            self._speculation = (key, future, token, ticket)
+        SPECULATIONS.inc(outcome="started")
+        log_event(logger, logging.DEBUG, "speculation_started", image=key)
+    
+    def _cancel_speculation(self, reason: str) -> None:
+        """Drop the current speculation and cancel its leg; call with the lock held."""
+        if self._speculation is None:
+            return
+        key, future, token, _ = self._speculation
+        self._speculation = None
+        if not future.done():
+            token.cancel(reason)
+            future.cancel()
+            SPECULATIONS.inc(outcome="cancelled")
+            log_event(logger, logging.DEBUG, "speculation_cancelled", image=key, reason=reason)
+    
+    def _dry_image(self, image: Image.Image) -> Optional[Image.Image]:
+        """Dry an image, reusing near-duplicate results only from this session's earlier images."""
+        with use_index_owner(self.session_key):
+            return self.image_dryer.process_image(image)
+    
+    def _image_leg(self, image: Image.Image) -> Future:
+        """Get the image leg for a message, reusing the speculation or previous leg for the same image.
+
+        The image leg of the previous message is cancelled unless it is reused.
+        """
+        key = image_digest(image)
+        with self._speculation_lock:
+            leg = None
+            if self._speculation is not None:
+                speculated, future, token, ticket = self._speculation
+                if speculated != key:
+                    self._cancel_speculation("image_replaced")
+                elif self._usable(future):
+                    SPECULATIONS.inc(outcome="used")
+                    leg = (key, future, token)
+                    # The user is waiting for it now
+                    if not future.done():
+                        ticket.promote(INTERACTIVE)
+                        get_request_scheduler().wake()
+            if leg is None and self._pending_image is not None:
+                # A resend of the same image keeps the request already in flight
+                if self._pending_image[0] == key and self._usable(self._pending_image[1]):
+                    leg = self._pending_image
+            if leg is None:
+                token = CancellationToken()
+                leg = (key, _submit_leg("image", self._dry_image, image, token=token), token)
+            if self._pending_image is not None and self._pending_image[1] is not leg[1]:
+                self._cancel_leg(self._pending_image, "superseded")
+            self._pending_image = leg
+        return leg[1]
+    
+    @staticmethod
+    def _usable(future: Future) -> bool:
+        """Check whether an image leg is still running or succeeded; a failed leg is retried instead."""
+        return not (future.done() and (future.cancelled() or future.exception() or future.result() is None))
+    
+    def _cancel_leg(self, leg: Tuple[str, Future, CancellationToken], reason: str) -> None:
+        """Cancel an image leg that has not finished yet."""
+        _, future, token = leg
+        if not future.done():
+            token.cancel(reason)
+            future.cancel()
+    
+    def _abandon_leg(self, future: Future, reason: str) -> None:
+        """Cancel the in-flight image leg once nobody waits for its result any more."""
+        with self._speculation_lock:
+            if self._pending_image is not None and self._pending_image[1] is future:
+                self._cancel_leg(self._pending_image, reason)
+                self._pending_image = None
+    
+    def cancel_pending(self, reason: str = "cancelled") -> None:
+        """Cancel the speculative and in-flight image legs, e.g. when the conversation is reset."""
+        with self._speculation_lock:
+            self._cancel_speculation(reason)
+            if self._pending_image is not None:
+                self._cancel_leg(self._pending_image, reason)
+                self._pending_image = None
+    
     def process_message(self, message: str, image: Optional[Image.Image] = None) -> Tuple[list, Optional[Image.Image]]:
         """Process a user message and optional image, return response and processed image."""
         try:
@@ -33,21 +258,41 @@ class DryingAgent:
                 raise ValueError("Message must be a non-empty string")
             
             self.current_image = image
-            messages = [self.system_prompt] + self.chat_history + [HumanMessage(content=message)]
+            messages = self._build_messages(message)
             
-            response = self.chat_model.invoke(messages)
-            response_content = response.content if hasattr(response, 'content') else str(response)
+            cacheable, cached_response = self._cached_response(message)
             
+            # The chat completion and image drying are independent, run them concurrently
+            start = time.monotonic()
+            image_future = None
             if image is not None:
-                self.processed_image = self.image_dryer.process_image(image)
+                image_future = self._image_leg(image)
+            
+            if cached_response is not None:
+                log_event(logger, logging.INFO, "response_cache_hit")
+                response_content = cached_response
             else:
-                self.processed_image = None
+                chat_future = _submit_leg("chat", self.chat_model.invoke, messages)
+                try:
+                    response = chat_future.result(timeout=self.chat_timeout)
+                except FuturesTimeoutError:
+                    raise TimeoutError(f"Chat completion timed out after {self.chat_timeout:.0f}s")
+                response_content = response.content if hasattr(response, 'content') else str(response)
+                if cacheable:
+                    self.response_cache.put(message, *self._response_cache_context(), response_content)
             
-            self.chat_history.append(HumanMessage(content=message))
-            self.chat_history.append(AIMessage(content=response_content))
+            self.processed_image = None
+            if image_future is not None:
+                remaining = max(0.0, self.image_timeout - (time.monotonic() - start))
+                try:
+                    self.processed_image = image_future.result(timeout=remaining)
+                except FuturesTimeoutError:
+                    log_event(logger, logging.WARNING, "image_timed_out", timeout=self.image_timeout)
+                    self._abandon_leg(image_future, "deadline")
+                except (OperationCancelled, CancelledError):
+                    log_event(logger, logging.INFO, "image_cancelled")
             
-            if len(self.chat_history) > 20:
-                self.chat_history = self.chat_history[-20:]
+            self._remember(message, response_content)
             
             return [
                 {"role": "user", "content": message},
@@ -57,11 +302,142 @@ class DryingAgent:
         except ValueError as ve:
             return [{"role": "assistant", "content": f"Invalid input: {str(ve)}"}], None
         except Exception as e:
-            print(f"Error in process_message: {str(e)}")
+            log_event(logger, logging.ERROR, "process_message_failed", error=str(e))
             return [{"role": "assistant", "content": f"An error occurred: {str(e)}"}], None
     
+    def _preview(self, image: Image.Image) -> Optional[Image.Image]:
+        """Dry a downscaled copy of an image with the local effect."""
+        start = time.monotonic()
+        try:
+            size = fit_within(self.preview_max_size)(image.size)
+            if size != image.size:
+                image = image.resize(size, Image.Resampling.BILINEAR)
+            return self.preview_backend.process_image(image)
+        except Exception as e:
+            log_event(logger, logging.WARNING, "preview_failed", error=str(e))
+            return None
+        finally:
+            STAGE_SECONDS.observe(time.monotonic() - start, component="agent", stage="preview")
+    
+    def _stream_chat(self, messages: list, events: queue.Queue) -> None:
+        """Stream the chat completion into an event queue."""
+        try:
+            for chunk in self.chat_model.stream(messages):
+                text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                if text:
+                    events.put(("chunk", text))
+            events.put(("chat_done", None))
+        except Exception as e:
+            events.put(("chat_error", e))
+    
+    def stream_message(self, message: str, image: Optional[Image.Image] = None) -> Iterator[Tuple[str, Optional[Image.Image]]]:
+        """Stream the response to a user message while the optional image is processed.
+
+        In progressive mode a local preview of the dried image is yielded first
+        and replaced by the API result when it arrives. If the API has not
+        answered by the progressive deadline, or fails, the preview is final and
+        the API request is cancelled. The deadline also caps the image timeout,
+        which is DRYING_IMAGE_TIMEOUT without a preview.
+
+        Yields:
+            The response text so far and the processed image, which is None (or the preview) until it is ready
+        """
+        if not message or not isinstance(message, str):
+            yield "Invalid input: Message must be a non-empty string", None
+            return
+        
+        self.current_image = image
+        self.processed_image = None
+        messages = self._build_messages(message)
+        cacheable, cached_response = self._cached_response(message)
+        
+        # Both legs report to one queue so the image is shown as soon as it is ready
+        events: queue.Queue = queue.Queue()
+        start = time.monotonic()
+        image_pending = image is not None
+        if image_pending:
+            image_future = self._image_leg(image)
+            image_future.add_done_callback(lambda future: events.put(("image", future)))
+        if cached_response is not None:
+            log_event(logger, logging.INFO, "response_cache_hit")
+            events.put(("chunk", cached_response))
+            events.put(("chat_done", None))
+        else:
+            _submit_leg("chat", self._stream_chat, messages, events)
+        
+        response_content = ""
+        preview = None
+        image_timeout = self.image_timeout
+        if image_pending and self.progressive:
+            # The API call is already under way, the preview only takes the local effect's time
+            image_timeout = min(self.image_timeout, self.progressive_deadline)
+            preview = self._preview(image)
+            self.processed_image = preview
+            if preview is not None:
+                yield response_content, preview
+        
+        chat_pending = True
+        # Set once the image is given up on; its leg may still report back while the chat streams
+        abandoned = False
+        while chat_pending or image_pending:
+            # Wait until the earliest timeout of the legs still pending
+            timeouts = [self.chat_timeout] if chat_pending else []
+            if image_pending:
+                timeouts.append(image_timeout)
+            deadline = start + min(timeouts)
+            try:
+                kind, value = events.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                if chat_pending and time.monotonic() - start >= self.chat_timeout:
+                    yield f"An error occurred: Chat completion timed out after {self.chat_timeout:.0f}s", None
+                    return
+                log_event(logger, logging.WARNING, "image_timed_out", timeout=image_timeout, preview=preview is not None)
+                if preview is not None:
+                    PROGRESSIVE_RESULTS.inc(outcome="deadline")
+                # The result would no longer be shown, free its scheduler slot and API call
+                self._abandon_leg(image_future, "deadline")
+                image_pending = False
+                abandoned = True
+                continue
+            
+            if kind == "chunk":
+                response_content += value
+                yield response_content, self.processed_image
+            elif kind == "chat_done":
+                chat_pending = False
+            elif kind == "chat_error":
+                log_event(logger, logging.ERROR, "stream_message_failed", error=str(value))
+                yield f"An error occurred: {str(value)}", None
+                return
+            elif kind == "image":
+                if abandoned:
+                    continue
+                image_pending = False
+                cancelled = False
+                try:
+                    self.processed_image = value.result()
+                except (OperationCancelled, CancelledError):
+                    cancelled = True
+                    log_event(logger, logging.INFO, "image_cancelled")
+                except Exception as e:
+                    log_event(logger, logging.ERROR, "process_image_failed", error=str(e))
+                if preview is not None:
+                    if self.processed_image is None:
+                        # Keep showing the preview rather than blanking the output
+                        self.processed_image = preview
+                        PROGRESSIVE_RESULTS.inc(outcome="cancelled" if cancelled else "failed")
+                    else:
+                        PROGRESSIVE_RESULTS.inc(outcome="upgraded")
+                yield response_content, self.processed_image
+        
+        if cacheable and cached_response is None:
+            self.response_cache.put(message, *self._response_cache_context(), response_content)
+        self._remember(message, response_content)
+        yield response_content, self.processed_image
+    
     def reset(self):
         """Reset the agent's state."""
-        self.chat_history = []
+        self.memory.reset()
+        self.cancel_pending("reset")
         self.current_image = None
         self.processed_image = None 
\ No newline at end of file
@@ -6,46 +6,89 @@ with improved error handling, retry logic, and alternative API endpoints.
 
 import os
 import time
+import asyncio
 import io
-import base64
-import requests
+import json
 import random
-from typing import Optional, List, Dict, Any
+import logging
+from typing import Optional, List, Dict, Any, Tuple
 from PIL import Image
 from dotenv import load_dotenv
 
+from .background_loop import run_sync
+from .cancellation import OperationCancelled, cancellable_call, cancellable_sleep, check_cancelled, current_token
+from .circuit_breaker import get_circuit_breaker, OPEN
+from .drying_effect import apply_drying_effect
+from .http_transport import accept_header, get_api_host, get_binary_responses, read_artifact, AsyncStabilityTransport, StabilityTransport, get_async_transport, get_transport
+from .image_preprocessing import decode_image, fit_within, get_compress_level, prepare_image, preprocess_for_upload
+from .latency_tracker import get_latency_tracker
+from .metrics import ENGINE_ATTEMPTS, FALLBACKS, QUEUE_WAIT_SECONDS, STAGE_SECONDS, attempt_outcome
+from .perceptual_index import ImageSignature, PerceptualIndex, get_perceptual_index, image_signature
+from .profiling import profiled
+from .rate_limiter import SharedRateLimiter, get_rate_limiter
+from .result_cache import ResultCache, get_default_cache, make_cache_key
+from .retry_policy import RetryPolicy
+from .structured_logging import get_logger, log_event
+
 # Load environment variables
 load_dotenv()
 
+logger = get_logger("enhanced_dryer")
+
 class EnhancedImageDryer:
-    def __init__(self):
+    def __init__(
+        self,
+        cache: Optional[ResultCache] = None,
+        transport: Optional[StabilityTransport] = None,
+        async_transport: Optional[AsyncStabilityTransport] = None,
+        engines: Optional[List[str]] = None,
+        rate_limiter: Optional[SharedRateLimiter] = None,
+        near_duplicates: Optional[PerceptualIndex] = None
+    ):
         """Initialize the EnhancedImageDryer with Stability AI API."""
         self.api_key = os.getenv("STABILITY_API_KEY")
-        self.api_host = "https://api.stability.ai"
+        self.api_host = get_api_host()
         # List of available engines to try
-        self.engines = [
+        self.engines = engines or [
             "stable-diffusion-xl-1024-v1-0",
             "stable-diffusion-v1-5",
             "stable-diffusion-512-v2-1"
         ]
         self.current_engine = self.engines[0]
         self.max_retries = 3
-        self.retry_delay = 2  # seconds between retries
+        # Exponential backoff with full jitter, honouring Retry-After
+        self.retry_policy = RetryPolicy(
+            base_delay=float(os.getenv("STABILITY_RETRY_BASE_DELAY", 2)),
+            max_delay=float(os.getenv("STABILITY_RETRY_MAX_DELAY", 30))
+        )
+        self.max_size = 1024
+        self.binary_responses = get_binary_responses()
+        self.png_compress_level = get_compress_level()
+        self.last_preprocess_timings: Dict[str, float] = {}
+        self.cache = cache if cache is not None else get_default_cache()
+        self.transport = transport or get_transport()
+        self.async_transport = async_transport or get_async_transport()
+        # Token buckets per engine shared with the other processes on this host
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter()
+        # Results of earlier inputs found by perceptual similarity
+        self.near_duplicates = near_duplicates if near_duplicates is not None else get_perceptual_index()
+        # Maximum number of uploads in flight at once on the async path
+        self.max_concurrent_uploads = int(os.getenv("STABILITY_MAX_CONCURRENCY", 8))
+        self._upload_semaphore: Optional[asyncio.Semaphore] = None
+        self._upload_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Hedged requests: send to the next engine when the current one is slower than usual
+        self.hedging_enabled = os.getenv("STABILITY_HEDGING", "false").lower() == "true"
+        self.hedge_percentile = float(os.getenv("STABILITY_HEDGE_PERCENTILE", 95))
+        self.hedge_default_delay = float(os.getenv("STABILITY_HEDGE_DELAY", 10))  # seconds, until enough samples
+        self.hedge_min_samples = 5
+        self.latency_tracker = get_latency_tracker()
+        self.hedge_stats: Dict[str, Any] = {"races": 0, "hedges_sent": 0, "wins": {}}
+        self.last_winner: Optional[Dict[str, Any]] = None
         
     def preprocess_image(self, image: Image.Image) -> Image.Image:
         """Preprocess the image to meet API requirements."""
-        # Convert to RGB if needed
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-            
-        # Resize if larger than 1024x1024
-        max_size = 1024
-        if max(image.size) > max_size:
-            ratio = max_size / max(image.size)
-            new_size = tuple(int(dim * ratio) for dim in image.size)
-            image = image.resize(new_size, Image.LANCZOS)
-            
-        return image
+        # Convert to RGB and resize if larger than 1024x1024
+        return prepare_image(image, fit_within(self.max_size))
     
     def get_prompt_variations(self) -> List[Dict[str, Any]]:
         """Get different prompt variations to try for better results."""
@@ -86,104 +129,531 @@ class EnhancedImageDryer:
         ]
         return prompt_variations
     
-    def process_image(self, image: Image.Image) -> Optional[Image.Image]:
-        """Process an image to make it appear dry using Stability AI API with robust error handling."""
+    def get_generation_params(self, engine: str) -> Dict[str, Any]:
+        """Get the generation parameters to use for an engine."""
+        if "xl" not in engine:
+            # Adjust parameters for non-XL models
+            return {"image_strength": 0.4, "cfg_scale": 8, "steps": 25}
+        return {"image_strength": 0.35, "cfg_scale": 7, "steps": 30}
+    
+    def get_attempt_plan(self) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """Get the (engine, prompts) pair to use for each retry attempt."""
+        prompt_variations = self.get_prompt_variations()
+        return [
+            (self.engines[retry % len(self.engines)], prompt_variations[retry % len(prompt_variations)])
+            for retry in range(self.max_retries)
+        ]
+    
+    def get_cache_key(self, img_bytes: bytes, engine: str, prompts: List[Dict[str, Any]]) -> str:
+        """Get the result cache key for an encoded image, engine and prompt set."""
+        params = self.get_generation_params(engine)
+        return make_cache_key(
+            img_bytes, engine, prompts,
+            params["image_strength"], params["cfg_scale"], params["steps"]
+        )
+    
+    def get_plan_params(self, attempt_plan: List[Tuple[str, List[Dict[str, Any]]]]) -> str:
+        """Serialize the engines, prompts and generation parameters of an attempt plan."""
+        return json.dumps(
+            [[engine, prompts, self.get_generation_params(engine)] for engine, prompts in attempt_plan],
+            sort_keys=True
+        )
+    
+    def encode_image(self, image: Image.Image) -> bytes:
+        """Preprocess an image and encode it as PNG for upload."""
+        img_bytes, self.last_preprocess_timings = preprocess_for_upload(
+            image, fit_within(self.max_size), self.png_compress_level
+        )
+        return img_bytes
+    
+    def get_cached_result(
+        self,
+        img_bytes: bytes,
+        attempt_plan: List[Tuple[str, List[Dict[str, Any]]]]
+    ) -> Optional[Image.Image]:
+        """Return a cached result from any engine/prompt pair we would try."""
+        if self.cache is None:
+            return None
+        for engine, prompts in attempt_plan:
+            cached = self.cache.get(self.get_cache_key(img_bytes, engine, prompts))
+            if cached is not None:
+                log_event(logger, logging.INFO, "cache_hit", engine=engine)
+                return decode_image(cached)
+        return None
+    
+    def get_near_duplicate(
+        self,
+        image: Image.Image,
+        attempt_plan: List[Tuple[str, List[Dict[str, Any]]]]
+    ) -> Tuple[Optional[ImageSignature], Optional[Image.Image]]:
+        """Look up the stored result of a perceptually near-identical earlier input.
+
+        Returns:
+            The image's signature, None when near-duplicate lookup is off, and the
+            stored result resized to this image's upload size, or None
+        """
+        if self.near_duplicates is None or self.cache is None or not isinstance(image, Image.Image):
+            return None, None
+        signature = image_signature(image)
+        result = self.near_duplicates.find_result(
+            signature, self.get_plan_params(attempt_plan), self.cache,
+            fit_within(self.max_size)(image.size), "enhanced_dryer"
+        )
+        return signature, result
+    
+    def remember_result(
+        self,
+        signature: Optional[ImageSignature],
+        img_bytes: bytes,
+        attempt_plan: List[Tuple[str, List[Dict[str, Any]]]]
+    ) -> None:
+        """Index a dried input so near-duplicates find its cached result."""
+        if signature is None or self.near_duplicates is None:
+            return
+        # The result is cached under the key of whichever engine and prompts succeeded
+        keys = [self.get_cache_key(img_bytes, engine, prompts) for engine, prompts in attempt_plan]
+        self.near_duplicates.add(signature, self.get_plan_params(attempt_plan), keys)
+    
+    def build_request(
+        self,
+        engine: str,
+        prompts: List[Dict[str, Any]],
+        img_bytes: bytes
+    ) -> Tuple[str, Dict[str, str], Dict[str, Any], Dict[str, Any]]:
+        """Build the URL, headers, files and form data for an image-to-image request."""
+        url = f"{self.api_host}/v1/generation/{engine}/image-to-image"
+        
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            **accept_header(self.binary_responses)
+        }
+        
+        # Adjust parameters based on the engine
+        params = self.get_generation_params(engine)
+        
+        # Prepare files and data for multipart form request
+        files = {
+            "init_image": ("image.png", img_bytes, "image/png"),
+        }
+        
+        data = {
+            "image_strength": params["image_strength"],
+            "cfg_scale": params["cfg_scale"],
+            "samples": 1,
+            "steps": params["steps"]
+        }
+        
+        # Add text prompts
+        for i, prompt in enumerate(prompts):
+            data[f"text_prompts[{i}][text]"] = prompt["text"]
+            data[f"text_prompts[{i}][weight]"] = prompt["weight"]
+        
+        return url, headers, files, data
+    
+    def handle_success(
+        self,
+        response: Any,
+        img_bytes: bytes,
+        engine: str,
+        prompts: List[Dict[str, Any]],
+        use_cache: bool
+    ) -> Image.Image:
+        """Decode a successful API response and store it in the result cache."""
+        with STAGE_SECONDS.time(component="enhanced_dryer", stage="response_decode"):
+            image_data = read_artifact(response)
+        
+        if use_cache and self.cache is not None:
+            self.cache.put(self.get_cache_key(img_bytes, engine, prompts), image_data)
+        
+        # Convert to PIL Image
+        result = decode_image(image_data)
+        log_event(logger, logging.INFO, "image_processed", engine=engine)
+        return result
+    
+    def record_outcome(self, engine: str, status_code: Optional[int], retry_after: Optional[float] = None) -> None:
+        """Update the engine's shared circuit breaker and attempt counters with the outcome of a request."""
+        ENGINE_ATTEMPTS.inc(engine=engine, outcome=attempt_outcome(status_code))
+        breaker = get_circuit_breaker(engine)
+        if status_code == 200:
+            breaker.record_success()
+        elif RetryPolicy.is_retryable(status_code):
+            breaker.record_failure(retry_after)
+        else:
+            # Client errors say nothing about the engine's health
+            breaker.release()
+    
+    def acquire_rate_limit(self, engine: str) -> bool:
+        """Wait for a token of the engine's shared rate limit.
+
+        Returns:
+            False if the engine is over its rate for longer than the limiter's max wait
+        """
+        return self.rate_limiter is None or self.rate_limiter.acquire(engine)
+    
+    async def aacquire_rate_limit(self, engine: str) -> bool:
+        """Async variant of acquire_rate_limit."""
+        return self.rate_limiter is None or await self.rate_limiter.aacquire(engine)
+    
+    def skip_throttled(self, engine: str) -> None:
+        """Give back the engine's breaker slot for an attempt the rate limiter refused."""
+        get_circuit_breaker(engine).release()
+        ENGINE_ATTEMPTS.inc(engine=engine, outcome="throttled")
+        log_event(logger, logging.INFO, "engine_skipped", engine=engine, reason="rate_limited")
+    
+    def get_next_engine(self, attempt_plan: List[Tuple[str, List[Dict[str, Any]]]], retry: int) -> Optional[str]:
+        """Get the engine of the next attempt whose circuit is not open, if any."""
+        for engine, _ in attempt_plan[retry + 1:]:
+            if get_circuit_breaker(engine).state != OPEN:
+                return engine
+        return None
+    
+    def get_retry_delay(
+        self,
+        retry: int,
+        engine: str,
+        next_engine: str,
+        status_code: Optional[int] = None,
+        retry_after: Optional[float] = None
+    ) -> float:
+        """Get the number of seconds to wait before the next attempt."""
+        # Check for rate limiting or server errors
+        if status_code == 429:  # Too Many Requests
+            log_event(logger, logging.WARNING, "rate_limited", engine=engine, retry_after=retry_after)
+            return self.retry_policy.get_delay(retry, retry_after)
+        if next_engine == engine:
+            return self.retry_policy.get_delay(retry, retry_after)
+        # A different engine can be tried straight away
+        if status_code is not None and status_code >= 500:  # Server errors
+            log_event(logger, logging.WARNING, "server_error", engine=engine, status_code=status_code, next_engine=next_engine)
+        return 0.0
+    
+    @profiled("process_image")
+    def process_image(self, image: Image.Image, use_cache: bool = True) -> Optional[Image.Image]:
+        """Process an image to make it appear dry using Stability AI API with robust error handling.
+
+        Args:
+            image: Image to process
+            use_cache: Look up and store the result in the result cache
+        """
         if not self.api_key:
-            print("Error: No Stability API key found in environment variables.")
+            log_event(logger, logging.ERROR, "missing_api_key")
             return None
-            
-        # Preprocess the image
-        processed_image = self.preprocess_image(image)
         
-        # Convert image to bytes
-        buffered = io.BytesIO()
-        processed_image.save(buffered, format="PNG")
-        img_bytes = buffered.getvalue()
+        # Preprocess the image and convert it to bytes
+        img_bytes = self.encode_image(image)
         
         # Try different engines and prompts
-        prompt_variations = self.get_prompt_variations()
+        attempt_plan = self.get_attempt_plan()
+        
+        signature = None
+        if use_cache:
+            signature, near_duplicate = self.get_near_duplicate(image, attempt_plan)
+            if near_duplicate is not None:
+                return near_duplicate
+        
+        result = self._process_encoded(img_bytes, attempt_plan, use_cache)
+        if result is not None:
+            self.remember_result(signature, img_bytes, attempt_plan)
+        return result
+    
+    def _process_encoded(
+        self,
+        img_bytes: bytes,
+        attempt_plan: List[Tuple[str, List[Dict[str, Any]]]],
+        use_cache: bool
+    ) -> Optional[Image.Image]:
+        """Dry an encoded image, trying the engines and prompts of the attempt plan."""
+        if self.hedging_enabled:
+            # Racing engines needs concurrent requests, run the async path
+            return run_sync(self._aprocess_encoded(img_bytes, attempt_plan, use_cache), token=current_token())
         
-        for retry in range(self.max_retries):
-            # Select engine based on retry count
-            self.current_engine = self.engines[retry % len(self.engines)]
+        if use_cache:
+            cached = self.get_cached_result(img_bytes, attempt_plan)
+            if cached is not None:
+                return cached
+        
+        for retry, (engine, prompts) in enumerate(attempt_plan):
+            check_cancelled("enhanced_dryer", "attempt")
+            if not get_circuit_breaker(engine).allow_request():
+                log_event(logger, logging.INFO, "engine_skipped", engine=engine, reason="circuit_open")
+                ENGINE_ATTEMPTS.inc(engine=engine, outcome="circuit_open")
+                continue
             
-            # Select prompt variation
-            prompts = prompt_variations[retry % len(prompt_variations)]
+            self.current_engine = engine
+            status_code = None
+            retry_after = None
             
-            print(f"Attempt {retry+1}/{self.max_retries} using engine: {self.current_engine}")
+            log_event(logger, logging.INFO, "engine_attempt", engine=engine, attempt=retry + 1, max_attempts=self.max_retries)
             
             try:
-                # Prepare the API request
-                url = f"{self.api_host}/v1/generation/{self.current_engine}/image-to-image"
-                
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}"
-                }
+                if not self.acquire_rate_limit(engine):
+                    self.skip_throttled(engine)
+                    continue
+                url, headers, files, data = self.build_request(engine, prompts, img_bytes)
                 
-                # Adjust parameters based on the engine
-                image_strength = 0.35
-                cfg_scale = 7
-                steps = 30
-                
-                if "xl" not in self.current_engine:
-                    # Adjust parameters for non-XL models
-                    image_strength = 0.4
-                    cfg_scale = 8
-                    steps = 25
-                
-                # Prepare files and data for multipart form request
-                files = {
-                    "init_image": ("image.png", img_bytes, "image/png"),
-                }
+                # Make the API request
+                start = time.monotonic()
+                response = cancellable_call(
+                    self.transport.post, url, headers=headers, files=files, data=data, component="enhanced_dryer"
+                )
+                latency = time.monotonic() - start
+                STAGE_SECONDS.observe(latency, component="enhanced_dryer", stage="network")
+                status_code = response.status_code
                 
-                data = {
-                    "image_strength": image_strength,
-                    "cfg_scale": cfg_scale,
-                    "samples": 1,
-                    "steps": steps
-                }
+                if status_code == 200:
+                    self.latency_tracker.record(engine, latency)
+                    result = self.handle_success(response, img_bytes, engine, prompts, use_cache)
+                    self.record_outcome(engine, status_code)
+                    return result
+                retry_after = RetryPolicy.parse_retry_after(response.headers.get("Retry-After"))
+                log_event(logger, logging.WARNING, "request_failed", engine=engine, status_code=status_code, body=response.text[:200])
+                        
+            except OperationCancelled:
+                get_circuit_breaker(engine).release()
+                ENGINE_ATTEMPTS.inc(engine=engine, outcome="cancelled")
+                raise
+            except Exception as e:
+                status_code = None
+                log_event(logger, logging.WARNING, "request_error", engine=engine, error=str(e))
+            
+            self.record_outcome(engine, status_code, retry_after)
+            
+            # Wait before retrying
+            next_engine = self.get_next_engine(attempt_plan, retry)
+            if next_engine is not None:
+                delay = self.get_retry_delay(retry, engine, next_engine, status_code, retry_after)
+                if delay > 0:
+                    log_event(logger, logging.INFO, "retry_scheduled", engine=engine, delay=round(delay, 2))
+                    cancellable_sleep(delay, component="enhanced_dryer")
+        
+        log_event(logger, logging.ERROR, "all_attempts_failed")
+        return None
+    
+    def _get_upload_semaphore(self) -> asyncio.Semaphore:
+        """Get the semaphore bounding concurrent uploads on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._upload_semaphore is None or self._upload_semaphore_loop is not loop:
+            self._upload_semaphore = asyncio.Semaphore(self.max_concurrent_uploads)
+            self._upload_semaphore_loop = loop
+        return self._upload_semaphore
+    
+    async def _asend_attempt(self, engine: str, prompts: List[Dict[str, Any]], img_bytes: bytes):
+        """Send a single async request and record its latency when it succeeds."""
+        url, headers, files, data = self.build_request(engine, prompts, img_bytes)
+        
+        queued = time.monotonic()
+        async with self._get_upload_semaphore():
+            start = time.monotonic()
+            QUEUE_WAIT_SECONDS.observe(start - queued, queue="upload_slots")
+            response = await self.async_transport.post(url, headers=headers, files=files, data=data)
+        latency = time.monotonic() - start
+        STAGE_SECONDS.observe(latency, component="enhanced_dryer", stage="network")
+        
+        if response.status_code == 200:
+            self.latency_tracker.record(engine, latency)
+        return response
+    
+    async def _arace_attempt(self, engine: str, prompts: List[Dict[str, Any]], img_bytes: bytes):
+        """Wait for the engine's rate limit and send; returns None if the limiter refused."""
+        if not await self.aacquire_rate_limit(engine):
+            return None
+        return await self._asend_attempt(engine, prompts, img_bytes)
+    
+    def get_hedge_delay(self, engine: str) -> float:
+        """Get how long to wait on an engine before hedging to the next one."""
+        delay = self.latency_tracker.percentile(engine, self.hedge_percentile, self.hedge_min_samples)
+        return self.hedge_default_delay if delay is None else delay
+    
+    async def _arace_engines(
+        self,
+        img_bytes: bytes,
+        attempt_plan: List[Tuple[str, List[Dict[str, Any]]]],
+        use_cache: bool
+    ) -> Optional[Image.Image]:
+        """Send to engines in plan order, adding the next one whenever the requests
+        in flight exceed their hedge delay, and return the first successful result."""
+        # One candidate per engine, in plan order
+        candidates = []
+        for engine, prompts in attempt_plan:
+            if engine not in (candidate[0] for candidate in candidates):
+                candidates.append((engine, prompts))
+        
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        pending: Dict[asyncio.Task, Tuple[str, List[Dict[str, Any]]]] = {}
+        next_index = 0
+        next_launch = start
+        self.hedge_stats["races"] += 1
+        
+        try:
+            while True:
+                # Launch the next engine immediately if nothing is in flight, or once the hedge delay passed
+                if next_index < len(candidates) and (not pending or loop.time() >= next_launch):
+                    engine, prompts = candidates[next_index]
+                    if not get_circuit_breaker(engine).allow_request():
+                        log_event(logger, logging.INFO, "engine_skipped", engine=engine, reason="circuit_open")
+                        ENGINE_ATTEMPTS.inc(engine=engine, outcome="circuit_open")
+                        next_index += 1
+                        continue
+                    if next_index > 0:
+                        self.hedge_stats["hedges_sent"] += 1
+                    log_event(logger, logging.INFO, "engine_attempt", engine=engine, hedge=next_index > 0)
+                    task = asyncio.create_task(self._arace_attempt(engine, prompts, img_bytes))
+                    pending[task] = (engine, prompts)
+                    next_launch = loop.time() + self.get_hedge_delay(engine)
+                    next_index += 1
+                    continue
                 
-                # Add text prompts
-                for i, prompt in enumerate(prompts):
-                    data[f"text_prompts[{i}][text]"] = prompt["text"]
-                    data[f"text_prompts[{i}][weight]"] = prompt["weight"]
+                if not pending:
+                    return None
                 
-                # Make the API request
-                print(f"Sending request to Stability AI API...")
-                response = requests.post(url, headers=headers, files=files, data=data, timeout=60)
+                timeout = max(0.0, next_launch - loop.time()) if next_index < len(candidates) else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
                 
-                if response.status_code == 200:
-                    # Process the response
-                    data = response.json()
-                    image_data = base64.b64decode(data["artifacts"][0]["base64"])
+                for task in done:
+                    engine, prompts = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        log_event(logger, logging.WARNING, "request_error", engine=engine, error=str(e))
+                        self.record_outcome(engine, None)
+                        continue
                     
-                    # Convert to PIL Image
-                    result = Image.open(io.BytesIO(image_data))
-                    print(f"Successfully processed image with engine: {self.current_engine}")
-                    return result
-                else:
-                    print(f"API request failed with status code {response.status_code}: {response.text}")
+                    if response is None:
+                        self.skip_throttled(engine)
+                        continue
                     
-                    # Check for rate limiting or server errors
-                    if response.status_code == 429:  # Too Many Requests
-                        print("Rate limited. Waiting longer before retry...")
-                        time.sleep(self.retry_delay * 3)  # Wait longer for rate limiting
-                    elif response.status_code >= 500:  # Server errors
-                        print("Server error. Retrying with different engine...")
-                    else:
-                        print(f"Error: {response.text}")
-                        
+                    if response.status_code != 200:
+                        log_event(
+                            logger, logging.WARNING, "request_failed",
+                            engine=engine, status_code=response.status_code, body=response.text[:200]
+                        )
+                        retry_after = RetryPolicy.parse_retry_after(response.headers.get("Retry-After"))
+                        self.record_outcome(engine, response.status_code, retry_after)
+                        continue
+                    
+                    self.record_outcome(engine, 200)
+                    
+                    latency = loop.time() - start
+                    wins = self.hedge_stats["wins"]
+                    wins[engine] = wins.get(engine, 0) + 1
+                    self.last_winner = {"engine": engine, "latency": latency, "engines_tried": next_index}
+                    self.current_engine = engine
+                    log_event(logger, logging.INFO, "race_won", engine=engine, latency=round(latency, 3), engines_tried=next_index)
+                    return await asyncio.to_thread(
+                        self.handle_success, response, img_bytes, engine, prompts, use_cache
+                    )
+        finally:
+            # Cancel the slower requests still in flight
+            for task, (engine, _) in pending.items():
+                task.cancel()
+                get_circuit_breaker(engine).release()
+                ENGINE_ATTEMPTS.inc(engine=engine, outcome="cancelled")
+            await asyncio.gather(*pending, return_exceptions=True)
+    
+    async def aprocess_image(self, image: Image.Image, use_cache: bool = True) -> Optional[Image.Image]:
+        """Async variant of process_image that backs off without blocking the event loop.
+
+        Args:
+            image: Image to process
+            use_cache: Look up and store the result in the result cache
+        """
+        if not self.api_key:
+            log_event(logger, logging.ERROR, "missing_api_key")
+            return None
+        
+        # Preprocessing and PNG encoding are CPU-bound, keep them off the event loop
+        img_bytes = await asyncio.to_thread(self.encode_image, image)
+        attempt_plan = self.get_attempt_plan()
+        
+        signature = None
+        if use_cache:
+            signature, near_duplicate = await asyncio.to_thread(self.get_near_duplicate, image, attempt_plan)
+            if near_duplicate is not None:
+                return near_duplicate
+        
+        result = await self._aprocess_encoded(img_bytes, attempt_plan, use_cache)
+        if result is not None:
+            self.remember_result(signature, img_bytes, attempt_plan)
+        return result
+    
+    async def _aprocess_encoded(
+        self,
+        img_bytes: bytes,
+        attempt_plan: List[Tuple[str, List[Dict[str, Any]]]],
+        use_cache: bool
+    ) -> Optional[Image.Image]:
+        """Async variant of _process_encoded."""
+        if use_cache:
+            cached = await asyncio.to_thread(self.get_cached_result, img_bytes, attempt_plan)
+            if cached is not None:
+                return cached
+        
+        if self.hedging_enabled:
+            result = await self._arace_engines(img_bytes, attempt_plan, use_cache)
+            if result is None:
+                log_event(logger, logging.ERROR, "all_attempts_failed", hedged=True)
+            return result
+        
+        for retry, (engine, prompts) in enumerate(attempt_plan):
+            if not get_circuit_breaker(engine).allow_request():
+                log_event(logger, logging.INFO, "engine_skipped", engine=engine, reason="circuit_open")
+                ENGINE_ATTEMPTS.inc(engine=engine, outcome="circuit_open")
+                continue
+            
+            status_code = None
+            retry_after = None
+            
+            log_event(logger, logging.INFO, "engine_attempt", engine=engine, attempt=retry + 1, max_attempts=self.max_retries)
+            
+            try:
+                if not await self.aacquire_rate_limit(engine):
+                    self.skip_throttled(engine)
+                    continue
+                response = await self._asend_attempt(engine, prompts, img_bytes)
+                status_code = response.status_code
+                
+                if status_code == 200:
+                    result = await asyncio.to_thread(
+                        self.handle_success, response, img_bytes, engine, prompts, use_cache
+                    )
+                    self.record_outcome(engine, status_code)
+                    return result
+                retry_after = RetryPolicy.parse_retry_after(response.headers.get("Retry-After"))
+                log_event(logger, logging.WARNING, "request_failed", engine=engine, status_code=status_code, body=response.text[:200])
+                
+            except asyncio.CancelledError:
+                get_circuit_breaker(engine).release()
+                ENGINE_ATTEMPTS.inc(engine=engine, outcome="cancelled")
+                raise
             except Exception as e:
-                print(f"Error during API request: {str(e)}")
+                status_code = None
+                log_event(logger, logging.WARNING, "request_error", engine=engine, error=str(e))
+            
+            self.record_outcome(engine, status_code, retry_after)
             
             # Wait before retrying
-            if retry < self.max_retries - 1:
-                delay = self.retry_delay * (retry + 1)  # Increase delay with each retry
-                print(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
+            next_engine = self.get_next_engine(attempt_plan, retry)
+            if next_engine is not None:
+                delay = self.get_retry_delay(retry, engine, next_engine, status_code, retry_after)
+                if delay > 0:
+                    log_event(logger, logging.INFO, "retry_scheduled", engine=engine, delay=round(delay, 2))
+                    await asyncio.sleep(delay)
         
-        print("All retry attempts failed.")
+        log_event(logger, logging.ERROR, "all_attempts_failed")
         return None
+    
+    async def aprocess_many(
+        self,
+        images: List[Image.Image],
+        use_cache: bool = True
+    ) -> List[Optional[Image.Image]]:
+        """Process a batch of images concurrently, bounded by max_concurrent_uploads.
+
+        Returns:
+            Results in the same order as the input, None for images that failed
+        """
+        return await asyncio.gather(*(self.aprocess_image(image, use_cache) for image in images))
         
     def save_image(self, image: Image.Image, filename: str) -> None:
         """Save an image to a file."""
@@ -195,40 +665,16 @@ class EnhancedImageDryer:
         image.save(img_byte_arr, format='PNG')
         return img_byte_arr.getvalue()
         
-    def apply_fallback_drying_effect(self, image: Image.Image) -> Image.Image:
+    def apply_fallback_drying_effect(self, image: Image.Image, tile_rows: Optional[int] = None) -> Image.Image:
         """Apply a simple drying effect as a fallback when API fails."""
-        print("Applying fallback drying effect...")
+        log_event(logger, logging.INFO, "fallback_applied")
+        FALLBACKS.inc()
         
-        # Convert to RGB if not already
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            
-        # Create a copy to work with
-        result = image.copy()
-        
-        # Apply brightness and contrast adjustments to simulate drying
-        brightness_factor = 1.2
-        contrast_factor = 1.1
-        saturation_reduction = 0.8
-        
-        # Apply adjustments
-        # 1. Increase brightness
-        result = result.point(lambda p: min(255, int(p * brightness_factor)))
-        
-        # 2. Increase contrast
-        result = result.point(lambda p: min(255, int(128 + contrast_factor * (p - 128))))
-        
-        # 3. Convert to HSV to reduce saturation
-        from colorsys import rgb_to_hsv, hsv_to_rgb
-        
-        # Process each pixel
-        width, height = result.size
-        for x in range(width):
-            for y in range(height):
-                r, g, b = result.getpixel((x, y))
-                h, s, v = rgb_to_hsv(r/255, g/255, b/255)
-                s *= saturation_reduction  # Reduce saturation
-                r, g, b = hsv_to_rgb(h, s, v)
-                result.putpixel((x, y), (int(r*255), int(g*255), int(b*255)))
-        
-        return result
+        # Brighten, add contrast and reduce saturation to simulate drying
+        return apply_drying_effect(
+            image,
+            brightness=1.2,
+            contrast=1.1,
+            saturation=0.8,
+            tile_rows=tile_rows
+        )
@@ -0,0 +1,230 @@
+"""
+Shared HTTP transport for Stability AI API calls.
+This module provides a pooled, keep-alive requests.Session so that every
+image and every retry reuses open TCP/TLS connections instead of paying a
+new handshake, with separate connect and read timeouts. An httpx-based
+async transport with the same settings, one client per event loop, serves the
+asyncio code paths.
+Generation responses are requested as raw PNG bytes where possible, with
+the JSON/base64 form as a fallback.
+"""
+
+import os
+import base64
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Dict, Optional, Tuple, Union
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from .structured_logging import get_logger, log_event
+
+logger = get_logger("transport")
+
+DEFAULT_API_HOST = "https://api.stability.ai"
+
+
+def get_api_host() -> str:
+    """Get the base URL of the Stability AI REST API, overridable with STABILITY_API_HOST to point at a local stub.
+
+    Read on every call rather than at import, so a value set in .env after the
+    src modules were imported still applies.
+    """
+    return os.getenv("STABILITY_API_HOST", DEFAULT_API_HOST)
+
+
+def get_binary_responses() -> bool:
+    """Check whether generated images are asked for as raw PNG bytes instead of base64 inside JSON."""
+    return os.getenv("STABILITY_BINARY_RESPONSES", "true").lower() == "true"
+
+
+def accept_header(binary: Optional[bool] = None) -> Dict[str, str]:
+    """Get the Accept header for a generation request.
+
+    Args:
+        binary: Ask for raw PNG bytes; by default STABILITY_BINARY_RESPONSES decides
+    """
+    if binary is None:
+        binary = get_binary_responses()
+    return {"Accept": "image/png" if binary else "application/json"}
+
+
+def read_artifact(response: Union[requests.Response, httpx.Response]) -> bytes:
+    """Get the image bytes of a successful generation response.
+
+    Binary image responses are handed over as received, without a JSON parse or
+    base64 decode; JSON responses fall back to decoding the first artifact.
+    """
+    content_type = response.headers.get("Content-Type", "")
+    if content_type.startswith("image/"):
+        return response.content
+    return base64.b64decode(response.json()["artifacts"][0]["base64"])
+
+
+class StabilityTransport:
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0
+    ):
+        """Initialize the transport.
+
+        Args:
+            pool_size: Maximum number of connections kept open per host
+            connect_timeout: Seconds to wait for a connection to be established
+            read_timeout: Seconds to wait between bytes of the response
+        """
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self.session = requests.Session()
+        self.session.headers["Connection"] = "keep-alive"
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        """Get the default (connect, read) timeout pair."""
+        return (self.connect_timeout, self.read_timeout)
+
+    def post(self, url: str, timeout: Optional[Tuple[float, float]] = None, **kwargs) -> requests.Response:
+        """Send a POST request over a pooled connection."""
+        return self.session.post(url, timeout=timeout or self.timeout, **kwargs)
+
+    def get(self, url: str, timeout: Optional[Tuple[float, float]] = None, **kwargs) -> requests.Response:
+        """Send a GET request over a pooled connection."""
+        return self.session.get(url, timeout=timeout or self.timeout, **kwargs)
+
+    def warm_up(self, url: str, connections: int = 1) -> int:
+        """Open connections to a host ahead of the first real request.
+
+        Args:
+            url: Any URL on the host to connect to
+            connections: Number of pooled connections to open concurrently
+
+        Returns:
+            Number of connections that were established
+        """
+        connections = max(1, min(connections, self.pool_size))
+        established = []
+
+        def _connect():
+            try:
+                # Any response, even an error status, leaves an open connection in the pool
+                self.session.head(url, timeout=(self.connect_timeout, self.connect_timeout))
+                established.append(True)
+            except requests.RequestException as e:
+                log_event(logger, logging.WARNING, "warm_up_failed", url=url, error=str(e))
+
+        threads = [threading.Thread(target=_connect) for _ in range(connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        log_event(logger, logging.INFO, "warmed_up", url=url, established=len(established), requested=connections)
+        return len(established)
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self.session.close()
+
+
+class AsyncStabilityTransport:
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0
+    ):
+        """Initialize the async transport.
+
+        Args:
+            pool_size: Maximum number of connections kept open per event loop
+            connect_timeout: Seconds to wait for a connection to be established
+            read_timeout: Seconds to wait between bytes of the response
+        """
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # Pooled connections belong to the loop that opened them, so each loop gets its own
+        # client; entries go away with their loop
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        """Get the default timeout with separate connect and read phases."""
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get the client for the running event loop, creating it if needed."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.get(loop)
+            if client is None or client.is_closed:
+                # Drop the clients of loops that were closed but are still referenced
+                for stale in [other for other in self._clients if other.is_closed()]:
+                    del self._clients[stale]
+                client = self._clients[loop] = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size
+                    ),
+                    timeout=self.timeout
+                )
+            return client
+
+    def client_count(self) -> int:
+        """Get the number of event loops with a client."""
+        with self._lock:
+            return len(self._clients)
+
+    async def post(self, url: str, timeout: Optional[httpx.Timeout] = None, **kwargs) -> httpx.Response:
+        """Send a POST request over a pooled connection."""
+        return await self._get_client().post(url, timeout=timeout or self.timeout, **kwargs)
+
+    async def aclose(self) -> None:
+        """Close the pooled connections of the running event loop."""
+        with self._lock:
+            client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+_default_transport: Optional[StabilityTransport] = None
+_default_async_transport: Optional[AsyncStabilityTransport] = None
+_default_transport_lock = threading.Lock()
+
+
+def get_transport() -> StabilityTransport:
+    """Get the process-wide transport configured from environment variables."""
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = StabilityTransport(
+                pool_size=int(os.getenv("STABILITY_POOL_SIZE", 10)),
+                connect_timeout=float(os.getenv("STABILITY_CONNECT_TIMEOUT", 5)),
+                read_timeout=float(os.getenv("STABILITY_READ_TIMEOUT", 60))
+            )
+        return _default_transport
+
+
+def get_async_transport() -> AsyncStabilityTransport:
+    """Get the process-wide async transport configured from environment variables."""
+    global _default_async_transport
+    with _default_transport_lock:
+        if _default_async_transport is None:
+            _default_async_transport = AsyncStabilityTransport(
+                pool_size=int(os.getenv("STABILITY_POOL_SIZE", 10)),
+                connect_timeout=float(os.getenv("STABILITY_CONNECT_TIMEOUT", 5)),
+                read_timeout=float(os.getenv("STABILITY_READ_TIMEOUT", 60))
+            )
+        return _default_async_transport
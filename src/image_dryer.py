@@ -1,118 +1,214 @@
 import os
-from typing import Optional
+import json
+import time
+import logging
+from typing import Optional, Dict
 from PIL import Image
 import io
-import base64
-import requests
 from dotenv import load_dotenv
 
+from .cancellation import OperationCancelled, cancellable_call
+from .circuit_breaker import get_circuit_breaker
+from .image_preprocessing import (
+    SDXL_DIMENSIONS, decode_image, get_compress_level, prepare_image, preprocess_for_upload, snap_to_sdxl
+)
+from .http_transport import StabilityTransport, accept_header, get_api_host, get_binary_responses, get_transport, read_artifact
+from .metrics import ENGINE_ATTEMPTS, STAGE_SECONDS, attempt_outcome
+from .perceptual_index import PerceptualIndex, get_perceptual_index, image_signature
+from .profiling import profiled
+from .rate_limiter import SharedRateLimiter, get_rate_limiter
+from .result_cache import ResultCache, get_default_cache, make_cache_key
+from .retry_policy import RetryPolicy
+from .structured_logging import get_logger, log_event
+
 load_dotenv()
 
+logger = get_logger("image_dryer")
+
 class ImageDryer:
-    def __init__(self):
+    def __init__(
+        self,
+        cache: Optional[ResultCache] = None,
+        transport: Optional[StabilityTransport] = None,
+        rate_limiter: Optional[SharedRateLimiter] = None,
+        near_duplicates: Optional[PerceptualIndex] = None
+    ):
         """Initialize the ImageDryer with Stability AI API."""
         self.api_key = os.getenv("STABILITY_API_KEY")
-        self.api_host = "https://api.stability.ai"
+        self.api_host = get_api_host()
         self.engine_id = "stable-diffusion-xl-1024-v1-0"
+        self.prompts = [
+            {
+                "text": "A completely dry version of this item, photorealistic, detailed texture, no water or moisture",
+                "weight": 1
+            },
+            {
+                "text": "wet, moist, damp, water droplets, puddles, stains",
+                "weight": -1
+            }
+        ]
+        self.image_strength = 0.35
+        self.cfg_scale = 7
+        self.steps = 30
+        self.cache = cache if cache is not None else get_default_cache()
+        self.transport = transport or get_transport()
+        # Token buckets per engine shared with the other processes on this host
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter()
+        # Results of earlier inputs found by perceptual similarity
+        self.near_duplicates = near_duplicates if near_duplicates is not None else get_perceptual_index()
+        self.png_compress_level = get_compress_level()
+        self.binary_responses = get_binary_responses()
+        self.last_preprocess_timings: Dict[str, float] = {}
         
     def preprocess_image(self, image: Image.Image) -> Image.Image:
         """Preprocess the image to meet API requirements."""
         try:
-            # Convert to RGB if needed
-            if image.mode != "RGB":
-                image = image.convert("RGB")
-                
-            # Get current dimensions
-            width, height = image.size
-            
-            # Calculate aspect ratio
-            aspect_ratio = width / height
-            
-            # Define supported dimensions
-            supported_dimensions = [
-                (1024, 1024),  # 1:1
-                (1152, 896),   # 1.29:1
-                (1216, 832),   # 1.46:1
-                (1344, 768),   # 1.75:1
-                (1536, 640),   # 2.4:1
-                (640, 1536),   # 1:2.4
-                (768, 1344),   # 1:1.75
-                (832, 1216),   # 1:1.46
-                (896, 1152)    # 1:1.29
-            ]
-            
-            # Find the closest aspect ratio
-            target_dims = min(supported_dimensions, 
-                            key=lambda dims: abs((dims[0]/dims[1]) - aspect_ratio))
-            
-            # Print debug info
-            print(f"Original dimensions: {width}x{height}, aspect ratio: {aspect_ratio:.2f}")
-            print(f"Selected target dimensions: {target_dims[0]}x{target_dims[1]}")
-            
-            # Resize image to target dimensions using high-quality resampling
-            image = image.resize(target_dims, Image.Resampling.LANCZOS)
+            # Resize to the supported dimensions with the closest aspect ratio
+            image = prepare_image(image, snap_to_sdxl)
             
             # Verify final dimensions
             final_width, final_height = image.size
-            if (final_width, final_height) not in supported_dimensions:
+            if (final_width, final_height) not in SDXL_DIMENSIONS:
                 raise ValueError(f"Failed to resize to supported dimensions. Got {final_width}x{final_height}")
                 
             return image
             
         except Exception as e:
-            print(f"Error in preprocess_image: {str(e)}")
+            log_event(logger, logging.ERROR, "preprocess_failed", error=str(e))
             raise
         
-    def process_image(self, image: Image.Image) -> Optional[Image.Image]:
-        """Process an image to make it appear dry using Stability AI API."""
+    @profiled("process_image")
+    def process_image(self, image: Image.Image, use_cache: bool = True) -> Optional[Image.Image]:
+        """Process an image to make it appear dry using Stability AI API.
+
+        Args:
+            image: Image to process
+            use_cache: Look up and store the result in the result cache
+        """
         try:
-            # Preprocess the image
-            processed_image = self.preprocess_image(image)
-            
-            # Convert image to bytes
-            buffered = io.BytesIO()
-            processed_image.save(buffered, format="PNG")
-            img_bytes = buffered.getvalue()
-            
-            # Prepare the API request
-            url = f"{self.api_host}/v1/generation/{self.engine_id}/image-to-image"
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            files = {
-                "init_image": ("image.png", img_bytes, "image/png"),
-            }
-            
-            data = {
-                "image_strength": 0.35,
-                "text_prompts[0][text]": "A completely dry version of this item, photorealistic, detailed texture, no water or moisture",
-                "text_prompts[0][weight]": 1,
-                "text_prompts[1][text]": "wet, moist, damp, water droplets, puddles, stains",
-                "text_prompts[1][weight]": -1,
-                "cfg_scale": 7,
-                "samples": 1,
-                "steps": 30
-            }
-            
-            # Make the API request
-            response = requests.post(url, headers=headers, files=files, data=data)
-            
-            if response.status_code != 200:
-                raise Exception(f"API request failed: {response.text}")
-            
-            # Process the response
-            data = response.json()
-            image_data = base64.b64decode(data["artifacts"][0]["base64"])
-            
-            # Convert to PIL Image
-            result = Image.open(io.BytesIO(image_data))
+            # Preprocess the image and convert it to bytes
+            img_bytes, self.last_preprocess_timings = preprocess_for_upload(
+                image, snap_to_sdxl, self.png_compress_level
+            )
+            cache_key = make_cache_key(
+                img_bytes, self.engine_id, self.prompts,
+                self.image_strength, self.cfg_scale, self.steps
+            )
+            
+            # Reuse the result of a perceptually near-identical earlier input
+            signature = None
+            if use_cache and self.near_duplicates is not None and self.cache is not None and isinstance(image, Image.Image):
+                signature = image_signature(image)
+                near_duplicate = self.near_duplicates.find_result(
+                    signature, self.get_params_scope(), self.cache, snap_to_sdxl(image.size), "image_dryer"
+                )
+                if near_duplicate is not None:
+                    return near_duplicate
+            
+            result = self._process_encoded(img_bytes, cache_key, use_cache)
+            if signature is not None:
+                self.near_duplicates.add(signature, self.get_params_scope(), [cache_key])
             return result
             
         except Exception as e:
-            print(f"Error processing image: {str(e)}")
+            log_event(logger, logging.ERROR, "process_image_failed", engine=self.engine_id, error=str(e))
             return None
+    
+    def get_params_scope(self) -> str:
+        """Serialize the engine, prompts and generation parameters results are made with."""
+        return json.dumps(
+            [self.engine_id, self.prompts, self.image_strength, self.cfg_scale, self.steps], sort_keys=True
+        )
+    
+    def _process_encoded(self, img_bytes: bytes, cache_key: str, use_cache: bool) -> Image.Image:
+        """Dry an encoded image, raising on failure.
+
+        Args:
+            img_bytes: Preprocessed image encoded as PNG
+            cache_key: Result cache key of the image and generation parameters
+            use_cache: Look up and store the result in the result cache
+        """
+        # Return a cached result for the same image and parameters
+        cache = self.cache if use_cache else None
+        if cache is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                log_event(logger, logging.INFO, "cache_hit", engine=self.engine_id)
+                return decode_image(cached)
+        
+        # Prepare the API request
+        url = f"{self.api_host}/v1/generation/{self.engine_id}/image-to-image"
+        
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            **accept_header(self.binary_responses)
+        }
+        
+        files = {
+            "init_image": ("image.png", img_bytes, "image/png"),
+        }
+        
+        data = {
+            "image_strength": self.image_strength,
+            "cfg_scale": self.cfg_scale,
+            "samples": 1,
+            "steps": self.steps
+        }
+        
+        for i, prompt in enumerate(self.prompts):
+            data[f"text_prompts[{i}][text]"] = prompt["text"]
+            data[f"text_prompts[{i}][weight]"] = prompt["weight"]
+        
+        # Skip the engine while its shared circuit is open
+        breaker = get_circuit_breaker(self.engine_id)
+        if not breaker.allow_request():
+            ENGINE_ATTEMPTS.inc(engine=self.engine_id, outcome="circuit_open")
+            raise Exception(f"Circuit open for {self.engine_id}")
+        
+        # Wait for a token of the engine's shared rate limit
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(self.engine_id):
+            breaker.release()
+            ENGINE_ATTEMPTS.inc(engine=self.engine_id, outcome="throttled")
+            raise Exception("Rate limit exceeded for longer than the maximum wait")
+        
+        # Make the API request
+        start = time.perf_counter()
+        try:
+            response = cancellable_call(
+                self.transport.post, url, headers=headers, files=files, data=data, component="image_dryer"
+            )
+        except OperationCancelled:
+            breaker.release()
+            ENGINE_ATTEMPTS.inc(engine=self.engine_id, outcome="cancelled")
+            raise
+        except Exception:
+            breaker.record_failure()
+            ENGINE_ATTEMPTS.inc(engine=self.engine_id, outcome="error")
+            raise
+        STAGE_SECONDS.observe(time.perf_counter() - start, component="image_dryer", stage="network")
+        ENGINE_ATTEMPTS.inc(engine=self.engine_id, outcome=attempt_outcome(response.status_code))
+        
+        if response.status_code == 200:
+            breaker.record_success()
+        elif RetryPolicy.is_retryable(response.status_code):
+            breaker.record_failure(RetryPolicy.parse_retry_after(response.headers.get("Retry-After")))
+        else:
+            # Client errors say nothing about the engine's health
+            breaker.release()
+        
+        if response.status_code != 200:
+            raise Exception(f"API request failed: {response.text}")
+        
+        # Process the response, raw PNG bytes or base64 inside JSON
+        with STAGE_SECONDS.time(component="image_dryer", stage="response_decode"):
+            image_data = read_artifact(response)
+        
+        if cache is not None:
+            cache.put(cache_key, image_data)
+        
+        # Convert to PIL Image
+        result = decode_image(image_data)
+        return result
 
     def save_image(self, image: Image.Image, filename: str) -> None:
         """Save an image to a file."""
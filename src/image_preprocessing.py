@@ -0,0 +1,181 @@
+"""
+Image preprocessing shared by ImageDryer and EnhancedImageDryer.
+Images are decoded at reduced scale where the format allows it (JPEG draft
+mode), shrunk with Image.reduce before the final LANCZOS resample, left
+untouched when they already have the target size, and encoded as PNG with
+a configurable compression level. Each stage is timed.
+"""
+
+import io
+import os
+import time
+import hashlib
+import logging
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from .metrics import STAGE_SECONDS
+from .structured_logging import get_logger, log_event
+
+logger = get_logger("preprocess")
+
+# Dimensions supported by the SDXL image-to-image endpoint
+SDXL_DIMENSIONS: List[Tuple[int, int]] = [
+    (1024, 1024),  # 1:1
+    (1152, 896),   # 1.29:1
+    (1216, 832),   # 1.46:1
+    (1344, 768),   # 1.75:1
+    (1536, 640),   # 2.4:1
+    (640, 1536),   # 1:2.4
+    (768, 1344),   # 1:1.75
+    (832, 1216),   # 1:1.46
+    (896, 1152)    # 1:1.29
+]
+
+DEFAULT_COMPRESS_LEVEL = 6
+
+TargetSize = Callable[[Tuple[int, int]], Tuple[int, int]]
+
+
+def get_compress_level() -> int:
+    """Get the PNG compression level for uploads from STABILITY_PNG_COMPRESS_LEVEL."""
+    return int(os.getenv("STABILITY_PNG_COMPRESS_LEVEL", DEFAULT_COMPRESS_LEVEL))
+
+
+def snap_to_sdxl(size: Tuple[int, int]) -> Tuple[int, int]:
+    """Get the SDXL-supported dimensions with the closest aspect ratio."""
+    width, height = size
+    aspect_ratio = width / height
+    return min(SDXL_DIMENSIONS, key=lambda dims: abs((dims[0] / dims[1]) - aspect_ratio))
+
+
+def fit_within(max_size: int) -> TargetSize:
+    """Get a target size function that scales images down to fit max_size, keeping the aspect ratio."""
+    def target(size: Tuple[int, int]) -> Tuple[int, int]:
+        if max(size) <= max_size:
+            return size
+        ratio = max_size / max(size)
+        return tuple(int(dim * ratio) for dim in size)
+    return target
+
+
+class PreprocessTimer:
+    def __init__(self):
+        """Initialize an empty set of stage timings."""
+        self.timings: Dict[str, float] = {}
+        self._start = time.perf_counter()
+
+    def mark(self, stage: str) -> None:
+        """Record the time since the previous mark under a stage name."""
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - self._start
+        self._start = now
+
+    def summary(self) -> str:
+        """Format the stage timings in milliseconds."""
+        parts = [f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in self.timings.items()]
+        return ", ".join(parts)
+
+
+def prepare_image(
+    image: Union[Image.Image, str],
+    target_size: TargetSize,
+    timer: Optional[PreprocessTimer] = None
+) -> Image.Image:
+    """Decode, convert and resize an image to the target size.
+
+    Args:
+        image: Image or path to an image file; JPEG files given by path are decoded at reduced scale
+        target_size: Function mapping the original size to the target size
+        timer: Optional timer receiving decode, reduce and resize stage timings
+
+    Returns:
+        An RGB image with the target size
+    """
+    timer = timer or PreprocessTimer()
+    owned = isinstance(image, str)
+    if owned:
+        image = Image.open(image)
+
+    target = target_size(image.size)
+
+    # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding. Only done for
+    # images opened here, since draft() changes the image object in place.
+    if owned and image.format == "JPEG" and target != image.size:
+        image.draft("RGB", target)
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    else:
+        image.load()
+    timer.mark("decode")
+
+    if image.size == target:
+        return image
+
+    # Cheap box reduction down to about twice the target before the LANCZOS pass
+    factor = min(image.width // target[0], image.height // target[1]) // 2
+    if factor >= 2:
+        image = image.reduce(factor)
+        timer.mark("reduce")
+
+    image = image.resize(target, Image.Resampling.LANCZOS)
+    timer.mark("resize")
+    return image
+
+
+def encode_png(
+    image: Image.Image,
+    compress_level: Optional[int] = None,
+    timer: Optional[PreprocessTimer] = None
+) -> bytes:
+    """Encode an image as PNG bytes, by default at the level set by STABILITY_PNG_COMPRESS_LEVEL."""
+    if compress_level is None:
+        compress_level = get_compress_level()
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG", compress_level=compress_level)
+    if timer is not None:
+        timer.mark("encode")
+    return buffered.getvalue()
+
+
+def decode_image(data: bytes) -> Image.Image:
+    """Decode encoded image bytes right away.
+
+    Image.open reads pixels lazily on first use, which is not safe once the
+    image is handed to several threads, e.g. callers sharing a coalesced result.
+    """
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def image_digest(image: Image.Image) -> str:
+    """Hash the mode, size and pixels of a decoded image."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("ascii"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def preprocess_for_upload(
+    image: Union[Image.Image, str],
+    target_size: TargetSize,
+    compress_level: Optional[int] = None
+) -> Tuple[bytes, Dict[str, float]]:
+    """Prepare an image for upload and encode it as PNG.
+
+    Returns:
+        The PNG bytes and the seconds spent in each stage
+    """
+    timer = PreprocessTimer()
+    prepared = prepare_image(image, target_size, timer)
+    img_bytes = encode_png(prepared, compress_level, timer)
+    for stage, seconds in timer.timings.items():
+        STAGE_SECONDS.observe(seconds, component="preprocess", stage=stage)
+    log_event(
+        logger, logging.DEBUG, "image_preprocessed",
+        width=prepared.size[0], height=prepared.size[1], bytes=len(img_bytes), timings=timer.summary()
+    )
+    return img_bytes, timer.timings
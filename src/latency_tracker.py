@@ -0,0 +1,68 @@
+"""
+Rolling latency statistics per Stability engine.
+This module keeps a bounded window of recent request latencies for each
+engine so callers can derive percentile-based timeouts, such as the delay
+before a hedged request is sent to a second engine.
+"""
+
+import math
+import threading
+from collections import deque
+from typing import Optional, Dict, Deque
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 100):
+        """Initialize the tracker.
+
+        Args:
+            window: Number of recent samples kept per engine
+        """
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, latency: float) -> None:
+        """Record the latency in seconds of a successful request."""
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(latency)
+
+    def count(self, key: str) -> int:
+        """Get the number of samples currently held for a key."""
+        with self._lock:
+            return len(self._samples.get(key, ()))
+
+    def percentile(self, key: str, pct: float, min_samples: int = 1) -> Optional[float]:
+        """Get the pct-th percentile latency for a key.
+
+        Returns:
+            The latency in seconds, or None with fewer than min_samples samples
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        # Nearest-rank percentile
+        rank = max(1, math.ceil(pct / 100 * len(samples)))
+        return samples[min(rank, len(samples)) - 1]
+
+    def reset(self) -> None:
+        """Drop all samples."""
+        with self._lock:
+            self._samples.clear()
+
+
+_default_tracker: Optional[LatencyTracker] = None
+_default_tracker_lock = threading.Lock()
+
+
+def get_latency_tracker() -> LatencyTracker:
+    """Get the process-wide latency tracker."""
+    global _default_tracker
+    with _default_tracker_lock:
+        if _default_tracker is None:
+            _default_tracker = LatencyTracker()
+        return _default_tracker
@@ -0,0 +1,294 @@
+"""
+In-process metrics for the drying pipeline.
+Counters, gauges and histograms with labels, rendered in the Prometheus
+text exposition format for the /metrics route of the web app. Recording is
+a dictionary update under a lock and becomes a no-op when
+DRYING_METRICS_ENABLED is false.
+"""
+
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from PNG encoding up to slow generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Format a label set as {name="value",...}."""
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value, using integers where exact."""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labelnames: Sequence[str] = ()):
+        """Initialize the metric; use the registry's factory methods instead."""
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """Get the label values in label name order."""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        """Render the metric in the Prometheus text format."""
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        """Increase the counter of a label set."""
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        """Get the current value of a label set."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [
+                f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        """Set the gauge of a label set."""
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        """Decrease the gauge of a label set."""
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts with a final +Inf bucket, sum, count)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        """Record one observation for a label set."""
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the wall-clock seconds spent in a with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        """Get the number of observations of a label set."""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else _format_value(bound)
+                    labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: Optional[bool] = True):
+        """Initialize an empty registry.
+
+        Args:
+            enabled: Record observations; when False every recording call returns immediately.
+                None reads DRYING_METRICS_ENABLED on first use, after .env has been loaded
+        """
+        self._enabled = enabled
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Check whether observations are recorded."""
+        if self._enabled is None:
+            self._enabled = os.getenv("DRYING_METRICS_ENABLED", "true").lower() == "true"
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value: bool) -> None:
+        self._enabled = value
+
+    def _register(self, metric: _Metric) -> _Metric:
+        """Add a metric, returning the existing one if the name is taken."""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Get or create a counter."""
+        return self._register(Counter(self, name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """Get or create a gauge."""
+        return self._register(Gauge(self, name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Optional[Sequence[float]] = None
+    ) -> Histogram:
+        """Get or create a histogram."""
+        return self._register(Histogram(self, name, help, labelnames, buckets=buckets or DEFAULT_BUCKETS))
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Clear every recorded value, keeping the metric definitions."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            with metric._lock:
+                metric._values.clear()
+
+
+REGISTRY = MetricsRegistry(enabled=None)
+
+# Time per stage: preprocessing (decode, reduce, resize, encode), network, response decode,
+# chat completion, image drying and whole interactions
+STAGE_SECONDS = REGISTRY.histogram(
+    "drying_stage_seconds", "Seconds spent in each processing stage", ["component", "stage"]
+)
+ENGINE_ATTEMPTS = REGISTRY.counter(
+    "drying_engine_attempts_total", "Stability API attempts per engine and outcome", ["engine", "outcome"]
+)
+BACKEND_REQUESTS = REGISTRY.counter(
+    "drying_backend_requests_total", "Requests routed to each dryer backend per outcome", ["backend", "outcome"]
+)
+PROGRESSIVE_RESULTS = REGISTRY.counter(
+    "drying_progressive_results_total",
+    "Streamed local previews per outcome: upgraded by the API, kept at the deadline or kept after a failure",
+    ["outcome"]
+)
+SPECULATIONS = REGISTRY.counter(
+    "drying_speculations_total",
+    "Image legs started on upload before the message was sent, and whether they were used or cancelled",
+    ["outcome"]
+)
+CANCELLATIONS = REGISTRY.counter(
+    "drying_cancellations_total", "Cancellation tokens cancelled per reason", ["reason"]
+)
+CANCELLED_WORK = REGISTRY.counter(
+    "drying_cancelled_work_total", "Work stopped early by a cancelled token, per component and stage", ["component", "stage"]
+)
+FREED_WORKERS = REGISTRY.counter(
+    "drying_freed_workers_total", "Agent worker threads released early because their leg was cancelled", ["stage"]
+)
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "drying_rate_limit_wait_seconds", "Seconds requests waited for a token of the shared per-engine rate limiter", ["engine"]
+)
+SCHEDULER_QUEUE_DEPTH = REGISTRY.gauge(
+    "drying_scheduler_queue_depth", "Requests waiting for a scheduler slot per priority class", ["priority"]
+)
+SCHEDULER_ACTIVE = REGISTRY.gauge(
+    "drying_scheduler_active", "Requests holding a scheduler slot per priority class", ["priority"]
+)
+SCHEDULER_WAIT_SECONDS = REGISTRY.histogram(
+    "drying_scheduler_wait_seconds", "Seconds requests waited for a scheduler slot per priority class", ["priority"]
+)
+COALESCED_REQUESTS = REGISTRY.counter(
+    "drying_coalesced_requests_total",
+    "Identical concurrent requests: calls started, requests that joined one, waiters cancelled and calls restarted",
+    ["component", "outcome"]
+)
+NEAR_DUPLICATES = REGISTRY.counter(
+    "drying_near_duplicates_total",
+    "Perceptual near-duplicate lookups: stored results reused as-is or resized, and misses",
+    ["component", "outcome"]
+)
+FALLBACKS = REGISTRY.counter(
+    "drying_fallback_total", "Images dried with the local fallback effect"
+)
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "drying_queue_wait_seconds", "Seconds work waited for a worker thread or upload slot", ["queue"]
+)
+ACTIVE_SESSIONS = REGISTRY.gauge(
+    "drying_active_sessions", "Live sessions in the agent pool"
+)
+INTERACTIONS = REGISTRY.counter(
+    "drying_interactions_total", "Chat interactions handled per handler and outcome", ["handler", "outcome"]
+)
+
+
+def attempt_outcome(status_code: Optional[int]) -> str:
+    """Classify the outcome of an API attempt for ENGINE_ATTEMPTS."""
+    if status_code is None:
+        return "error"
+    if status_code == 200:
+        return "success"
+    if status_code == 429:
+        return "rate_limited"
+    if status_code >= 500:
+        return "server_error"
+    return "client_error"
@@ -0,0 +1,260 @@
+"""
+Near-duplicate lookup of previously dried images.
+Re-uploads of the same item are often re-compressed, resized or
+screenshotted copies whose bytes, and therefore result cache keys, differ.
+Each dried input gets a perceptual signature: a 256-bit difference hash
+(dHash) of a grayscale thumbnail computed with NumPy, plus a coarse colour
+grid and the aspect ratio. Signatures are kept in a BK-tree keyed by
+Hamming distance, so a new input within the configured distance of an
+earlier one from the same session reuses that input's stored result,
+resized to the new input's size.
+"""
+
+import os
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .image_preprocessing import decode_image
+from .metrics import NEAR_DUPLICATES
+from .result_cache import ResultCache
+from .structured_logging import get_logger, log_event
+
+logger = get_logger("perceptual_index")
+
+# Weights of the RGB channels in the grayscale conversion (ITU-R 601, as in Pillow)
+_GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+# Gray levels a neighbour must be brighter by to set a hash bit; flat areas such as
+# a white background otherwise flip bits on compression noise
+_GRADIENT_MARGIN = 2.0
+
+# Cells per side of the colour grid
+_COLOR_GRID = 4
+
+_index_owner: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("drying_index_owner", default=None)
+
+
+@contextmanager
+def use_index_owner(owner: Optional[str]) -> Iterator[None]:
+    """Scope near-duplicate lookups and additions in the with block to an owner, e.g. a session."""
+    reset = _index_owner.set(owner)
+    try:
+        yield
+    finally:
+        _index_owner.reset(reset)
+
+
+class ImageSignature(NamedTuple):
+    # Difference hash of the grayscale thumbnail, one bit per horizontal gradient
+    hash: int
+    # Mean RGB colour of each cell of a coarse grid, row by row; the grayscale
+    # hash does not see colour, and a single mean is dominated by the background
+    colors: Tuple[float, ...]
+    # Width divided by height
+    aspect: float
+
+
+def image_signature(image: Image.Image, hash_size: int = 16) -> Optional[ImageSignature]:
+    """Compute the perceptual signature of an image.
+
+    Returns:
+        The signature, or None for featureless images (e.g. a single colour),
+        whose hash would match every other featureless image
+    """
+    source = image if image.mode in ("RGB", "RGBA", "L") else image.convert("RGB")
+    # Box filtering averages whole blocks, which evens out compression noise and resampling
+    thumbnail = source.resize((hash_size + 1, hash_size), Image.BOX, reducing_gap=2.0).convert("RGB")
+    gray = np.asarray(thumbnail, dtype=np.float32) @ _GRAY_WEIGHTS
+    if np.ptp(gray) < 1.0:
+        return None
+    bits = gray[:, 1:] > gray[:, :-1] + _GRADIENT_MARGIN
+    value = int.from_bytes(np.packbits(bits).tobytes(), "big")
+    grid = source.resize((_COLOR_GRID, _COLOR_GRID), Image.BOX, reducing_gap=2.0).convert("RGB")
+    colors = tuple(np.asarray(grid, dtype=np.float32).ravel().tolist())
+    return ImageSignature(value, colors, image.width / image.height)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Count the bits in which two hashes differ."""
+    return (a ^ b).bit_count()
+
+
+class _Entry(NamedTuple):
+    signature: ImageSignature
+    # Generation settings the stored result was made with
+    scope: str
+    # Session the input came from; results are not shared between sessions
+    owner: Optional[str]
+    value: Any
+
+
+class _Node:
+    __slots__ = ("hash", "entries", "children")
+
+    def __init__(self, value: int):
+        self.hash = value
+        self.entries: List[_Entry] = []
+        # Child nodes by their distance to this node's hash
+        self.children: Dict[int, "_Node"] = {}
+
+
+class BKTree:
+    def __init__(self):
+        """Initialize an empty tree of hashes under the Hamming distance."""
+        self.root: Optional[_Node] = None
+
+    def add(self, value: int, entry: Any) -> None:
+        """Add an entry under a hash."""
+        if self.root is None:
+            self.root = _Node(value)
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node.hash)
+            if distance == 0:
+                node.entries.append(entry)
+                return
+            child = node.children.get(distance)
+            if child is None:
+                child = node.children[distance] = _Node(value)
+            node = child
+
+    def search(self, value: int, max_distance: int) -> Iterator[Tuple[int, Any]]:
+        """Yield (distance, entry) for every entry within max_distance of a hash."""
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node.hash)
+            if distance <= max_distance:
+                for entry in node.entries:
+                    yield distance, entry
+            # By the triangle inequality only children at these distances can hold matches
+            for child_distance, child in node.children.items():
+                if abs(child_distance - distance) <= max_distance:
+                    stack.append(child)
+
+
+class PerceptualIndex:
+    def __init__(
+        self,
+        max_distance: int = 2,
+        max_color_distance: float = 10.0,
+        max_aspect_change: float = 0.05,
+        max_entries: int = 10000
+    ):
+        """Initialize an empty index.
+
+        Args:
+            max_distance: Largest Hamming distance between the hashes of near-duplicates, out of 256 bits
+            max_color_distance: Largest difference of any colour channel in any grid cell of near-duplicates
+            max_aspect_change: Largest relative difference between the aspect ratios of near-duplicates
+            max_entries: Signatures kept; the oldest quarter is dropped when the index is full
+        """
+        self.max_distance = max_distance
+        self.max_color_distance = max_color_distance
+        self.max_aspect_change = max_aspect_change
+        self.max_entries = max_entries
+        self._entries: Deque[_Entry] = deque()
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def add(self, signature: ImageSignature, scope: str, value: Any) -> None:
+        """Index the result of an input made with the given generation settings by the current owner."""
+        entry = _Entry(signature, scope, _index_owner.get(), value)
+        with self._lock:
+            # Repeat hits on the same input would only duplicate entries
+            for distance, existing in self._tree.search(signature.hash, 0):
+                if existing.scope == scope and existing.owner == entry.owner and existing.value == value:
+                    return
+            self._entries.append(entry)
+            self._tree.add(signature.hash, entry)
+            if len(self._entries) > self.max_entries:
+                # BK-trees do not support removal, rebuild from the newer entries
+                for _ in range(max(1, self.max_entries // 4)):
+                    self._entries.popleft()
+                self._tree = BKTree()
+                for kept in self._entries:
+                    self._tree.add(kept.signature.hash, kept)
+
+    def find(self, signature: ImageSignature, scope: str) -> Optional[Tuple[int, Any]]:
+        """Find the current owner's closest near-duplicate made with the same generation settings.
+
+        Returns:
+            The Hamming distance and the value of the match, or None
+        """
+        owner = _index_owner.get()
+        best = None
+        with self._lock:
+            for distance, entry in self._tree.search(signature.hash, self.max_distance):
+                if entry.scope != scope or entry.owner != owner or not self._similar(signature, entry.signature):
+                    continue
+                if best is None or distance < best[0]:
+                    best = (distance, entry.value)
+        return best
+
+    def _similar(self, a: ImageSignature, b: ImageSignature) -> bool:
+        """Check the colour grids and aspect ratios of two signatures whose hashes are close."""
+        color_distance = float(np.abs(np.subtract(a.colors, b.colors)).max())
+        aspect_change = abs(a.aspect - b.aspect) / b.aspect
+        return color_distance <= self.max_color_distance and aspect_change <= self.max_aspect_change
+
+    def find_result(
+        self,
+        signature: Optional[ImageSignature],
+        scope: str,
+        cache: ResultCache,
+        size: Tuple[int, int],
+        component: str
+    ) -> Optional[Image.Image]:
+        """Get the stored result of a near-duplicate input, resized to the given size.
+
+        Values of the index are lists of result cache keys; the first one
+        still in the cache is used.
+        """
+        if signature is None:
+            return None
+        match = self.find(signature, scope)
+        if match is not None:
+            distance, keys = match
+            for key in keys:
+                cached = cache.get(key)
+                if cached is None:
+                    continue
+                result = decode_image(cached)
+                resized = result.size != tuple(size)
+                if resized:
+                    result = result.resize(size, Image.LANCZOS)
+                NEAR_DUPLICATES.inc(component=component, outcome="resized" if resized else "hit")
+                log_event(logger, logging.INFO, "near_duplicate_hit", component=component, distance=distance, resized=resized)
+                return result
+        NEAR_DUPLICATES.inc(component=component, outcome="miss")
+        return None
+
+
+_perceptual_index: Optional[PerceptualIndex] = None
+_perceptual_index_lock = threading.Lock()
+
+
+def get_perceptual_index() -> Optional[PerceptualIndex]:
+    """Get the process-wide near-duplicate index, or None unless DRYING_NEAR_DUPLICATES is true."""
+    global _perceptual_index
+    if os.getenv("DRYING_NEAR_DUPLICATES", "false").lower() != "true":
+        return None
+    with _perceptual_index_lock:
+        if _perceptual_index is None:
+            _perceptual_index = PerceptualIndex(
+                max_distance=int(os.getenv("DRYING_NEAR_DUPLICATE_DISTANCE", 2)),
+                max_color_distance=float(os.getenv("DRYING_NEAR_DUPLICATE_COLOR_DISTANCE", 10)),
+                max_entries=int(os.getenv("DRYING_NEAR_DUPLICATE_MAX_ENTRIES", 10000))
+            )
+        return _perceptual_index
@@ -0,0 +1,305 @@
+"""
+On-demand request profiling.
+Functions decorated with @profiled run under cProfile plus a stack sampler
+when DRYING_PROFILE is true or the call asks for it (a profile=True keyword,
+or an X-Drying-Profile header on the function's request argument). Each
+profiled request writes a cProfile stats file and a flamegraph-compatible
+collapsed-stack file to a directory that keeps only the newest
+DRYING_PROFILE_MAX_FILES profiles. When profiling is off the wrapper checks
+the keyword, one header of the request argument if the function has one,
+and two flags before calling through.
+"""
+
+import os
+import sys
+import time
+import pstats
+import inspect
+import logging
+import cProfile
+import functools
+import itertools
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+from .structured_logging import get_logger, log_event
+
+PROFILE_HEADER = "x-drying-profile"
+
+logger = get_logger("profiling")
+
+_active_session: contextvars.ContextVar[Optional["ProfileSession"]] = contextvars.ContextVar(
+    "drying_profile_session", default=None
+)
+
+
+class ProfileSession:
+    def __init__(self, name: str, sample_interval: float = 0.005):
+        """Initialize a profile of one request.
+
+        Args:
+            name: Name of the profiled function, used in the file names
+            sample_interval: Seconds between stack samples of the attached threads
+        """
+        self.name = name
+        self.sample_interval = sample_interval
+        self.samples: Counter = Counter()
+        self._profiles: List[cProfile.Profile] = []
+        self._threads: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self.started = time.time()
+
+    @contextmanager
+    def attach(self) -> Iterator[None]:
+        """Profile the calling thread while the with block runs."""
+        ident = threading.get_ident()
+        with self._lock:
+            nested = self._threads.get(ident, 0) > 0
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+        # cProfile profiles one thread at a time, nested attaches reuse the outer one
+        profile = None if nested else cProfile.Profile()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            with self._lock:
+                self._threads[ident] -= 1
+                if not self._threads[ident]:
+                    del self._threads[ident]
+                if profile is not None:
+                    self._profiles.append(profile)
+
+    def _sample(self) -> None:
+        """Record the stacks of the attached threads until stopped."""
+        while not self._stop.wait(self.sample_interval):
+            with self._lock:
+                idents: Set[int] = set(self._threads)
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        """Start the stack sampler."""
+        self._sampler = threading.Thread(target=self._sample, name=f"profile-{self.name}", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        """Stop the stack sampler."""
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def collapsed(self) -> str:
+        """Render the samples in the collapsed-stack format read by flamegraph tools."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def stats(self) -> Optional[pstats.Stats]:
+        """Merge the cProfile data of every attached thread."""
+        with self._lock:
+            profiles = [profile for profile in self._profiles if profile.getstats()]
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+
+class RequestProfiler:
+    def __init__(
+        self,
+        enabled: bool = False,
+        output_dir: str = ".cache/profiles",
+        max_files: int = 50,
+        sample_interval: float = 0.005
+    ):
+        """Initialize the profiler.
+
+        Args:
+            enabled: Profile every call of a @profiled function, not only requested ones
+            output_dir: Directory for the .prof and .collapsed files
+            max_files: Number of most recent profiles kept in output_dir
+            sample_interval: Seconds between stack samples
+        """
+        self.enabled = enabled
+        self.output_dir = output_dir
+        self.max_files = max_files
+        self.sample_interval = sample_interval
+        self._sequence = itertools.count(1)
+
+    def start(self, name: str) -> ProfileSession:
+        """Start profiling a request."""
+        session = ProfileSession(name, self.sample_interval)
+        session.start()
+        return session
+
+    def finish(self, session: ProfileSession) -> Optional[str]:
+        """Stop a session and write its files.
+
+        Returns:
+            Path of the written files without extension, or None if nothing was recorded
+        """
+        session.stop()
+        stats = session.stats()
+        if stats is None and not session.samples:
+            return None
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(session.started))
+            base = os.path.join(self.output_dir, f"{stamp}-{os.getpid()}-{next(self._sequence):05d}-{session.name}")
+            if stats is not None:
+                stats.dump_stats(f"{base}.prof")
+            with open(f"{base}.collapsed", "w") as f:
+                f.write(session.collapsed())
+            self._rotate()
+        except OSError as e:
+            log_event(logger, logging.WARNING, "profile_write_failed", name=session.name, error=str(e))
+            return None
+        log_event(logger, logging.INFO, "profile_written", name=session.name, path=base, samples=sum(session.samples.values()))
+        return base
+
+    def _rotate(self) -> None:
+        """Delete the oldest profiles beyond max_files."""
+        profiles: Dict[str, float] = {}
+        for entry in os.scandir(self.output_dir):
+            base, ext = os.path.splitext(entry.path)
+            if ext in (".prof", ".collapsed"):
+                profiles[base] = max(profiles.get(base, 0.0), entry.stat().st_mtime)
+        for base in sorted(profiles, key=lambda base: (profiles[base], base))[:max(0, len(profiles) - self.max_files)]:
+            for ext in (".prof", ".collapsed"):
+                try:
+                    os.remove(base + ext)
+                except FileNotFoundError:
+                    pass
+
+
+_profiler: Optional[RequestProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> RequestProfiler:
+    """Get the process-wide profiler configured from environment variables."""
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = RequestProfiler(
+                enabled=os.getenv("DRYING_PROFILE", "false").lower() == "true",
+                output_dir=os.getenv("DRYING_PROFILE_DIR", ".cache/profiles"),
+                max_files=int(os.getenv("DRYING_PROFILE_MAX_FILES", 50)),
+                sample_interval=float(os.getenv("DRYING_PROFILE_SAMPLE_INTERVAL", 0.005))
+            )
+        return _profiler
+
+
+def attach_current_thread():
+    """Profile the calling thread as part of the request being profiled, if any.
+
+    Work handed to other threads should run in a copy of the caller's context
+    (contextvars.copy_context) for the active profile to be found there.
+    """
+    session = _active_session.get()
+    return nullcontext() if session is None else session.attach()
+
+
+def _request_position(fn: Callable) -> Optional[int]:
+    """Get the position of a function's request parameter, e.g. the gr.Request of a Gradio handler."""
+    parameters = list(inspect.signature(fn).parameters)
+    return parameters.index("request") if "request" in parameters else None
+
+
+def _requested(args: tuple, kwargs: Dict[str, Any], request_position: Optional[int]) -> bool:
+    """Check whether a call asks to be profiled by keyword or request header."""
+    if kwargs.pop("profile", False):
+        return True
+    if request_position is None:
+        return False
+    request = kwargs.get("request", args[request_position] if len(args) > request_position else None)
+    headers = getattr(request, "headers", None)
+    if headers is None:
+        return False
+    try:
+        return str(headers.get(PROFILE_HEADER, "")).lower() in ("1", "true", "yes")
+    except AttributeError:
+        return False
+
+
+@contextmanager
+def _activate(session: ProfileSession) -> Iterator[None]:
+    """Make a session the active profile of the calling thread while the with block runs."""
+    token = _active_session.set(session)
+    try:
+        with session.attach():
+            yield
+    finally:
+        _active_session.reset(token)
+
+
+def profiled(name: str) -> Callable:
+    """Decorate a function or generator function to be profiled on demand.
+
+    The decorated function accepts an extra profile=True keyword, and a
+    parameter named request is checked for the X-Drying-Profile header. Calls made
+    while a profile is already active are recorded into that profile.
+    """
+    def decorator(fn: Callable) -> Callable:
+        # Looked up once, so calls only read one argument for the header
+        request_position = _request_position(fn)
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                requested = _requested(args, kwargs, request_position)
+                profiler = get_profiler()
+                if not (profiler.enabled or requested) or _active_session.get() is not None:
+                    yield from fn(*args, **kwargs)
+                    return
+                session = profiler.start(name)
+                try:
+                    generator = fn(*args, **kwargs)
+                    while True:
+                        # Each step may run on a different worker thread and context
+                        with _activate(session):
+                            try:
+                                item = next(generator)
+                            except StopIteration:
+                                return
+                        yield item
+                finally:
+                    profiler.finish(session)
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            requested = _requested(args, kwargs, request_position)
+            profiler = get_profiler()
+            active = _active_session.get()
+            if active is not None:
+                with active.attach():
+                    return fn(*args, **kwargs)
+            if not (profiler.enabled or requested):
+                return fn(*args, **kwargs)
+            session = profiler.start(name)
+            try:
+                with _activate(session):
+                    return fn(*args, **kwargs)
+            finally:
+                profiler.finish(session)
+        return wrapper
+    return decorator
@@ -0,0 +1,204 @@
+"""
+Proactive rate limiting for Stability AI requests, shared across processes.
+Every dryer takes a token from its engine's bucket before sending. The
+bucket state lives in a SQLite database, so app replicas and batch scripts
+on one host draw from the same budget and stay just under the quota instead
+of discovering it through 429 responses and backoff. Rates and burst sizes
+are configured per engine with a default for the others.
+"""
+
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Dict, NamedTuple, Optional
+
+from .cancellation import OperationCancelled, cancellable_sleep
+from .metrics import RATE_LIMIT_WAIT_SECONDS
+from .structured_logging import get_logger, log_event
+
+logger = get_logger("rate_limiter")
+
+
+class RateLimit(NamedTuple):
+    # Tokens added per second
+    rate: float
+    # Bucket capacity, the number of requests that may be sent at once
+    burst: float
+
+
+def parse_rate_limit(value: str) -> RateLimit:
+    """Parse a "rate:burst" limit, e.g. "2:5"; the burst defaults to the rate, at least 1."""
+    rate, _, burst = value.strip().partition(":")
+    rate = float(rate)
+    if rate <= 0:
+        raise ValueError(f"Rate must be positive: {value}")
+    return RateLimit(rate, float(burst) if burst else max(1.0, rate))
+
+
+def parse_rate_limits(value: str) -> Dict[str, RateLimit]:
+    """Parse per-engine limits given as "engine=rate:burst,engine=rate:burst"."""
+    limits = {}
+    for entry in filter(None, (entry.strip() for entry in value.split(","))):
+        engine, _, limit = entry.partition("=")
+        limits[engine.strip()] = parse_rate_limit(limit)
+    return limits
+
+
+class SharedRateLimiter:
+    def __init__(
+        self,
+        path: str,
+        limits: Optional[Dict[str, RateLimit]] = None,
+        default: Optional[RateLimit] = None,
+        max_wait: float = 30.0
+    ):
+        """Initialize the limiter.
+
+        Args:
+            path: SQLite database holding the buckets; every process using the same file shares them
+            limits: Limit per engine
+            default: Limit for engines without their own, or None to leave them unlimited
+            max_wait: Longest wait for a token; requests that would wait longer are refused
+        """
+        self.path = path
+        self.limits = limits or {}
+        self.default = default
+        self.max_wait = max_wait
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, creating the table on first use."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def limit_for(self, key: str) -> Optional[RateLimit]:
+        """Get the limit of an engine."""
+        return self.limits.get(key, self.default)
+
+    def _update(self, key: str, limit: RateLimit, take: float, max_wait: Optional[float]) -> Optional[float]:
+        """Refill a bucket and take tokens from it in one cross-process transaction.
+
+        A token may be taken before it has refilled; the caller then waits for
+        it, which keeps one round trip per request.
+
+        Returns:
+            Seconds to wait for the taken token, or None if that exceeds max_wait and nothing was taken
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            tokens = limit.burst if row is None else min(limit.burst, row[0] + max(0.0, now - row[1]) * limit.rate)
+            tokens = min(limit.burst, tokens - take)
+            wait = max(0.0, -tokens / limit.rate)
+            if max_wait is not None and wait > max_wait:
+                connection.execute("ROLLBACK")
+                return None
+            connection.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now)
+            )
+            connection.execute("COMMIT")
+            return wait
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+
+    def reserve(self, key: str) -> Optional[float]:
+        """Take a token for an engine.
+
+        Returns:
+            Seconds to wait before sending, or None if the wait would exceed max_wait
+        """
+        limit = self.limit_for(key)
+        if limit is None:
+            return 0.0
+        try:
+            return self._update(key, limit, 1.0, self.max_wait)
+        except sqlite3.Error as e:
+            # Fail open: the reactive 429 handling still protects the API
+            log_event(logger, logging.WARNING, "rate_limiter_unavailable", key=key, error=str(e))
+            return 0.0
+
+    def refund(self, key: str) -> None:
+        """Return a token taken for a request that was not sent."""
+        limit = self.limit_for(key)
+        if limit is None:
+            return
+        try:
+            self._update(key, limit, -1.0, None)
+        except sqlite3.Error as e:
+            log_event(logger, logging.WARNING, "rate_limiter_unavailable", key=key, error=str(e))
+
+    def acquire(self, key: str) -> bool:
+        """Wait for a token for an engine; the wait ends early if the current work is cancelled.
+
+        Returns:
+            False if the wait would exceed max_wait and the request should not be sent now
+        """
+        wait = self.reserve(key)
+        if wait is None:
+            log_event(logger, logging.INFO, "rate_limit_exceeded", key=key, max_wait=self.max_wait)
+            return False
+        RATE_LIMIT_WAIT_SECONDS.observe(wait, engine=key)
+        if wait > 0:
+            log_event(logger, logging.DEBUG, "rate_limit_wait", key=key, seconds=round(wait, 3))
+            try:
+                cancellable_sleep(wait, component="rate_limiter", stage="wait")
+            except OperationCancelled:
+                self.refund(key)
+                raise
+        return True
+
+    async def aacquire(self, key: str) -> bool:
+        """Async variant of acquire that waits without blocking the event loop."""
+        wait = await asyncio.to_thread(self.reserve, key)
+        if wait is None:
+            log_event(logger, logging.INFO, "rate_limit_exceeded", key=key, max_wait=self.max_wait)
+            return False
+        RATE_LIMIT_WAIT_SECONDS.observe(wait, engine=key)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                await asyncio.to_thread(self.refund, key)
+                raise
+        return True
+
+
+_rate_limiter: Optional[SharedRateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[SharedRateLimiter]:
+    """Get the process-wide rate limiter, or None if STABILITY_RATE_LIMIT_ENABLED is false."""
+    global _rate_limiter
+    if os.getenv("STABILITY_RATE_LIMIT_ENABLED", "true").lower() != "true":
+        return None
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            default = os.getenv("STABILITY_RATE_LIMIT", "15:150")
+            _rate_limiter = SharedRateLimiter(
+                path=os.getenv("STABILITY_RATE_LIMIT_DB", ".cache/rate_limits.sqlite3"),
+                limits=parse_rate_limits(os.getenv("STABILITY_RATE_LIMITS", "")),
+                default=parse_rate_limit(default) if default.strip() else None,
+                max_wait=float(os.getenv("STABILITY_RATE_LIMIT_MAX_WAIT", 30))
+            )
+        return _rate_limiter
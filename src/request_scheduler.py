@@ -0,0 +1,409 @@
+"""
+Priority scheduling of Stability AI requests.
+Interactive requests from the chat, speculative requests started on upload
+and batch runs share one pool of request slots. Waiting requests are served
+in priority order (interactive > speculative > batch), each class is capped
+at its own number of concurrent requests, and waiting time ages a request
+towards the front so batch work keeps moving while live users are served
+first. Queue depth, active requests and wait time are exported per class.
+
+The web app and batch runs are separate processes, so each scheduler also
+publishes its waiting and active requests per class to a SQLite database.
+Schedulers sharing the file count each other's requests against the slot
+limits and leave a free slot to a more urgent request waiting in another
+process. The shared view is refreshed by polling, so the limits may be
+briefly exceeded when processes take slots at the same moment.
+"""
+
+import os
+import time
+import uuid
+import atexit
+import sqlite3
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from .cancellation import check_cancelled, current_token
+from .metrics import SCHEDULER_ACTIVE, SCHEDULER_QUEUE_DEPTH, SCHEDULER_WAIT_SECONDS
+from .structured_logging import get_logger, log_event
+
+logger = get_logger("scheduler")
+
+INTERACTIVE = "interactive"
+SPECULATIVE = "speculative"
+BATCH = "batch"
+
+# Lower ranks are served first
+PRIORITY_RANKS = {INTERACTIVE: 0, SPECULATIVE: 1, BATCH: 2}
+
+
+class RequestTicket:
+    def __init__(self, priority: str = INTERACTIVE):
+        """Initialize the scheduling class of a piece of work.
+
+        Args:
+            priority: INTERACTIVE, SPECULATIVE or BATCH
+        """
+        if priority not in PRIORITY_RANKS:
+            raise ValueError(f"Unknown priority class: {priority}")
+        self.priority = priority
+
+    def promote(self, priority: str) -> None:
+        """Move waiting work to a higher priority class, e.g. when a user starts waiting for a speculation."""
+        if PRIORITY_RANKS[priority] < PRIORITY_RANKS[self.priority]:
+            self.priority = priority
+
+
+_current_ticket: contextvars.ContextVar[Optional[RequestTicket]] = contextvars.ContextVar(
+    "drying_request_ticket", default=None
+)
+
+
+def current_ticket() -> RequestTicket:
+    """Get the ticket of the work running in the current context; work without one is interactive."""
+    return _current_ticket.get() or RequestTicket(INTERACTIVE)
+
+
+@contextmanager
+def use_ticket(ticket: RequestTicket) -> Iterator[RequestTicket]:
+    """Make a ticket the current one while the with block runs."""
+    reset = _current_ticket.set(ticket)
+    try:
+        yield ticket
+    finally:
+        _current_ticket.reset(reset)
+
+
+class _Waiter:
+    def __init__(self, ticket: RequestTicket, sequence: int):
+        self.ticket = ticket
+        self.sequence = sequence
+        self.enqueued = time.monotonic()
+        # Wall clock time, comparable with the waiters of other processes
+        self.enqueued_at = time.time()
+        self.enqueued_as = ticket.priority
+
+
+class ClassDemand(NamedTuple):
+    waiting: int
+    active: int
+    # Wall clock time the longest waiting request was enqueued, or None
+    oldest: Optional[float]
+
+
+class SharedSchedulerState:
+    def __init__(self, path: str, stale_after: float = 30.0):
+        """Initialize the state shared by the schedulers of several processes.
+
+        Args:
+            path: SQLite database holding the demand of every process using the same file
+            stale_after: Seconds after which a process that stopped publishing is ignored,
+                e.g. because it crashed
+        """
+        self.path = path
+        self.stale_after = stale_after
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, creating the table on first use."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS demand (process TEXT NOT NULL, priority TEXT NOT NULL, "
+                "waiting INTEGER NOT NULL, active INTEGER NOT NULL, oldest REAL, updated REAL NOT NULL, "
+                "PRIMARY KEY (process, priority))"
+            )
+            self._local.connection = connection
+        return connection
+
+    def publish(self, process: str, demand: Dict[str, ClassDemand]) -> None:
+        """Replace the demand of a process, and forget processes that stopped publishing long ago."""
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "INSERT INTO demand (process, priority, waiting, active, oldest, updated) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(process, priority) DO UPDATE SET waiting = excluded.waiting, "
+                    "active = excluded.active, oldest = excluded.oldest, updated = excluded.updated",
+                    [(process, priority, *entry, now) for priority, entry in demand.items()]
+                )
+                connection.execute("DELETE FROM demand WHERE updated < ?", (now - 10 * self.stale_after,))
+                connection.execute("COMMIT")
+            except BaseException:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # Fail open: the process then schedules on its own
+            log_event(logger, logging.WARNING, "scheduler_state_unavailable", error=str(e))
+
+    def others(self, process: str) -> Dict[str, ClassDemand]:
+        """Get the demand per class of every other live process."""
+        try:
+            rows = self._connection().execute(
+                "SELECT priority, SUM(waiting), SUM(active), MIN(CASE WHEN waiting > 0 THEN oldest END) "
+                "FROM demand WHERE process != ? AND updated >= ? GROUP BY priority",
+                (process, time.time() - self.stale_after)
+            ).fetchall()
+        except sqlite3.Error as e:
+            log_event(logger, logging.WARNING, "scheduler_state_unavailable", error=str(e))
+            return {}
+        return {priority: ClassDemand(waiting, active, oldest) for priority, waiting, active, oldest in rows}
+
+    def remove(self, process: str) -> None:
+        """Forget a process, e.g. when it exits."""
+        try:
+            self._connection().execute("DELETE FROM demand WHERE process = ?", (process,))
+        except sqlite3.Error as e:
+            log_event(logger, logging.WARNING, "scheduler_state_unavailable", error=str(e))
+
+
+class RequestScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        class_limits: Optional[Dict[str, int]] = None,
+        aging: float = 30.0,
+        shared: Optional[SharedSchedulerState] = None,
+        poll_interval: float = 0.25
+    ):
+        """Initialize the scheduler.
+
+        Args:
+            max_concurrency: Requests in flight at once across all classes
+            class_limits: Requests in flight at once per class, by default max_concurrency
+            aging: Seconds of waiting that move a request up by one priority class; 0 disables aging
+            shared: State shared with the schedulers of other processes, or None to schedule this process alone;
+                the limits then hold for all the processes together
+            poll_interval: Seconds between reads of the shared state while requests wait
+        """
+        self.max_concurrency = max_concurrency
+        self.class_limits = {name: max_concurrency for name in PRIORITY_RANKS}
+        self.class_limits.update(class_limits or {})
+        self.aging = aging
+        self.shared = shared
+        self.poll_interval = poll_interval
+        self._waiting: List[_Waiter] = []
+        self._active = {name: 0 for name in PRIORITY_RANKS}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        # Demand of the other processes sharing the state, and when it was read
+        self._process = uuid.uuid4().hex
+        self._remote: Dict[str, ClassDemand] = {}
+        self._remote_read = 0.0
+        self._publish_lock = threading.Lock()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    def _score(self, waiter: _Waiter, now: float) -> float:
+        """Get a waiter's effective rank, lowered by the time it has waited."""
+        rank = PRIORITY_RANKS[waiter.ticket.priority]
+        if self.aging > 0:
+            rank -= (now - waiter.enqueued) / self.aging
+        return rank
+
+    def _active_in(self, priority: str) -> int:
+        """Count the active requests of a class in every process; call with the condition held."""
+        remote = self._remote.get(priority)
+        return self._active[priority] + (remote.active if remote is not None else 0)
+
+    def _next(self) -> Optional[_Waiter]:
+        """Get the waiter to serve next, if a slot is free for it; call with the condition held."""
+        self._refresh_remote()
+        if sum(self._active_in(name) for name in PRIORITY_RANKS) >= self.max_concurrency:
+            return None
+        now = time.monotonic()
+        eligible = [
+            waiter for waiter in self._waiting
+            if self._active_in(waiter.ticket.priority) < self.class_limits[waiter.ticket.priority]
+        ]
+        if not eligible:
+            return None
+        waiter = min(eligible, key=lambda waiter: (self._score(waiter, now), waiter.sequence))
+        # Leave the slot to a more urgent request waiting in another process
+        score = self._score(waiter, now)
+        wall = time.time()
+        for priority, remote in self._remote.items():
+            if not remote.waiting or remote.oldest is None or self._active_in(priority) >= self.class_limits[priority]:
+                continue
+            remote_score = PRIORITY_RANKS[priority]
+            if self.aging > 0:
+                remote_score -= (wall - remote.oldest) / self.aging
+            if remote_score < score:
+                return None
+        return waiter
+
+    def _refresh_remote(self) -> None:
+        """Read the other processes' demand at most once per poll interval; call with the condition held."""
+        if self.shared is None:
+            return
+        now = time.monotonic()
+        if now - self._remote_read >= self.poll_interval:
+            self._remote = self.shared.others(self._process)
+            self._remote_read = now
+
+    def _demand(self) -> Dict[str, ClassDemand]:
+        """Get this process's demand per class; call with the condition held."""
+        demand = {}
+        for name in PRIORITY_RANKS:
+            waiting = [waiter.enqueued_at for waiter in self._waiting if waiter.ticket.priority == name]
+            demand[name] = ClassDemand(len(waiting), self._active[name], min(waiting) if waiting else None)
+        return demand
+
+    def _publish(self) -> None:
+        """Publish this process's demand to the shared state."""
+        if self.shared is None:
+            return
+        # Snapshots are taken and written in order, so an older one never overwrites a newer one
+        with self._publish_lock:
+            with self._condition:
+                demand = self._demand()
+            self.shared.publish(self._process, demand)
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, name="scheduler-heartbeat", daemon=True)
+                self._heartbeat.start()
+                atexit.register(self.shared.remove, self._process)
+
+    def _beat(self) -> None:
+        """Keep publishing while requests are active, so other processes do not take this one for dead."""
+        while True:
+            time.sleep(self.shared.stale_after / 3)
+            with self._condition:
+                busy = self._waiting or any(self._active.values())
+            if busy:
+                self._publish()
+
+    def _update_gauges(self) -> None:
+        """Export the queue depth and active requests per class; call with the condition held."""
+        for name in PRIORITY_RANKS:
+            SCHEDULER_QUEUE_DEPTH.set(sum(1 for waiter in self._waiting if waiter.ticket.priority == name), priority=name)
+            SCHEDULER_ACTIVE.set(self._active[name], priority=name)
+
+    def wake(self) -> None:
+        """Re-evaluate the queue, e.g. after a ticket was promoted."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def acquire(self, ticket: Optional[RequestTicket] = None) -> str:
+        """Wait for a request slot; the wait ends with OperationCancelled if the current work is cancelled.
+
+        Returns:
+            The priority class the slot was granted under, to pass to release
+        """
+        ticket = ticket or current_ticket()
+        token = current_token()
+        with self._condition:
+            waiter = _Waiter(ticket, next(self._sequence))
+            self._waiting.append(waiter)
+            self._update_gauges()
+            granted = self._next() is waiter
+        if not granted:
+            # Let the other processes know this request is waiting
+            self._publish()
+        remove = token.add_callback(self.wake) if token is not None else None
+        # Aging and the other processes change the order over time, so waiters also re-check periodically
+        poll = self.poll_interval if self.shared is not None else 1.0
+        try:
+            with self._condition:
+                try:
+                    while self._next() is not waiter:
+                        check_cancelled("scheduler", "queue")
+                        self._condition.wait(timeout=poll)
+                    check_cancelled("scheduler", "queue")
+                finally:
+                    self._waiting.remove(waiter)
+                    self._update_gauges()
+                priority = ticket.priority
+                self._active[priority] += 1
+                self._update_gauges()
+                # Another waiter may fit in the slots that are still free
+                self._condition.notify_all()
+        finally:
+            if remove is not None:
+                remove()
+            self._publish()
+        waited = time.monotonic() - waiter.enqueued
+        SCHEDULER_WAIT_SECONDS.observe(waited, priority=priority)
+        if priority != waiter.enqueued_as:
+            log_event(logger, logging.DEBUG, "ticket_promoted", priority=priority, enqueued_as=waiter.enqueued_as)
+        log_event(logger, logging.DEBUG, "slot_granted", priority=priority, waited=round(waited, 3))
+        return priority
+
+    def release(self, priority: str) -> None:
+        """Give back a slot granted under a priority class."""
+        with self._condition:
+            self._active[priority] -= 1
+            self._update_gauges()
+            self._condition.notify_all()
+        self._publish()
+
+    @contextmanager
+    def slot(self, ticket: Optional[RequestTicket] = None) -> Iterator[str]:
+        """Hold a request slot while the with block runs."""
+        priority = self.acquire(ticket)
+        try:
+            yield priority
+        finally:
+            self.release(priority)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Get the waiting and active requests per class, in this process and in the others sharing its state."""
+        with self._condition:
+            self._refresh_remote()
+            return {
+                name: {
+                    "waiting": sum(1 for waiter in self._waiting if waiter.ticket.priority == name),
+                    "active": self._active[name],
+                    "limit": self.class_limits[name],
+                    "other_waiting": self._remote[name].waiting if name in self._remote else 0,
+                    "other_active": self._remote[name].active if name in self._remote else 0
+                }
+                for name in PRIORITY_RANKS
+            }
+
+
+def parse_class_limits(value: str) -> Dict[str, int]:
+    """Parse per-class limits given as "interactive=8,speculative=4,batch=4"."""
+    limits = {}
+    for entry in filter(None, (entry.strip() for entry in value.split(","))):
+        name, _, limit = entry.partition("=")
+        name = name.strip()
+        if name not in PRIORITY_RANKS:
+            raise ValueError(f"Unknown priority class: {name}")
+        limits[name] = int(limit)
+    return limits
+
+
+_scheduler: Optional[RequestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_request_scheduler() -> RequestScheduler:
+    """Get the process-wide request scheduler configured from environment variables.
+
+    Unless DRYING_SCHEDULER_SHARED is false, it coordinates with the other
+    processes using the same DRYING_SCHEDULER_DB, e.g. the web app and batch runs.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            shared = None
+            if os.getenv("DRYING_SCHEDULER_SHARED", "true").lower() == "true":
+                shared = SharedSchedulerState(os.getenv("DRYING_SCHEDULER_DB", ".cache/scheduler.sqlite3"))
+            _scheduler = RequestScheduler(
+                max_concurrency=int(os.getenv("DRYING_SCHEDULER_MAX_CONCURRENCY", 8)),
+                class_limits=parse_class_limits(os.getenv("DRYING_SCHEDULER_LIMITS", "speculative=4,batch=4")),
+                aging=float(os.getenv("DRYING_SCHEDULER_AGING", 30)),
+                shared=shared
+            )
+        return _scheduler
@@ -0,0 +1,198 @@
+"""
+Response cache for context-free drying-advice questions.
+Answers are keyed by the normalized message together with the model name,
+temperature and system prompt. An optional near-duplicate tier matches
+rephrasings using a 64-bit SimHash fingerprint of the message words.
+"""
+
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Set, Tuple
+
+FINGERPRINT_BITS = 64
+# The fingerprint is split into bands; two fingerprints within BANDS - 1 bits
+# of each other agree exactly on at least one band
+BANDS = 4
+BAND_BITS = FINGERPRINT_BITS // BANDS
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase a message and strip punctuation and repeated whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", message.lower()).split())
+
+
+def _hash64(token: str) -> int:
+    """Hash a token to 64 bits."""
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(message: str) -> int:
+    """Compute a 64-bit SimHash of a message's words and word pairs."""
+    words = normalize_message(message).split()
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    if not features:
+        return 0
+    weights = [0] * FINGERPRINT_BITS
+    for feature in features:
+        value = _hash64(feature)
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Count the differing bits of two fingerprints."""
+    return bin(a ^ b).count("1")
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: Optional[float] = 60 * 60,
+        near_duplicates: bool = False,
+        max_distance: int = 3
+    ):
+        """Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of cached responses
+            ttl: Seconds a response stays valid, or None to never expire
+            near_duplicates: Also match messages with a similar fingerprint
+            max_distance: Maximum fingerprint Hamming distance for a near-duplicate match
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_duplicates = near_duplicates
+        self.max_distance = min(max_distance, BANDS - 1)
+        # key -> (response, stored_at, context, fingerprint)
+        self._entries: "OrderedDict[str, Tuple[str, float, str, int]]" = OrderedDict()
+        self._bands: Dict[Tuple[str, int, int], Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _context(model: str, temperature: float, system_prompt: str) -> str:
+        """Build the part of the key shared by every message for one model configuration."""
+        raw = f"{model}\x00{temperature}\x00{system_prompt}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _band_keys(context: str, fingerprint: int):
+        """Get the band index keys of a fingerprint."""
+        mask = (1 << BAND_BITS) - 1
+        return [(context, band, fingerprint >> (band * BAND_BITS) & mask) for band in range(BANDS)]
+
+    def _remove(self, key: str) -> None:
+        """Remove an entry and its band index keys."""
+        _, _, context, fingerprint = self._entries.pop(key)
+        for band_key in self._band_keys(context, fingerprint):
+            keys = self._bands.get(band_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._bands[band_key]
+
+    def _live(self, key: str) -> bool:
+        """Check that an entry exists and has not expired, dropping it if it has."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        if self.ttl is not None and time.time() - entry[1] > self.ttl:
+            self._remove(key)
+            return False
+        return True
+
+    def get(self, message: str, model: str, temperature: float, system_prompt: str) -> Optional[str]:
+        """Get a cached response for a message, or None on a miss."""
+        context = self._context(model, temperature, system_prompt)
+        key = f"{context}:{normalize_message(message)}"
+        with self._lock:
+            if self._live(key):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+            if self.near_duplicates:
+                fingerprint = simhash(message)
+                candidates = set()
+                for band_key in self._band_keys(context, fingerprint):
+                    candidates.update(self._bands.get(band_key, ()))
+                best = None
+                for candidate in candidates:
+                    if not self._live(candidate):
+                        continue
+                    distance = hamming_distance(fingerprint, self._entries[candidate][3])
+                    if distance <= self.max_distance and (best is None or distance < best[0]):
+                        best = (distance, candidate)
+                if best is not None:
+                    self._entries.move_to_end(best[1])
+                    self.hits += 1
+                    self.near_hits += 1
+                    return self._entries[best[1]][0]
+
+            self.misses += 1
+            return None
+
+    def put(self, message: str, model: str, temperature: float, system_prompt: str, response: str) -> None:
+        """Store the response to a message."""
+        context = self._context(model, temperature, system_prompt)
+        key = f"{context}:{normalize_message(message)}"
+        fingerprint = simhash(message)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (response, time.time(), context, fingerprint)
+            for band_key in self._band_keys(context, fingerprint):
+                self._bands.setdefault(band_key, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all cached responses."""
+        with self._lock:
+            self._entries.clear()
+            self._bands.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit, miss and eviction counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries
+            }
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Get the process-wide response cache, or None unless DRYING_RESPONSE_CACHE is true."""
+    global _default_cache
+    if os.getenv("DRYING_RESPONSE_CACHE", "false").lower() != "true":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            ttl = float(os.getenv("DRYING_RESPONSE_CACHE_TTL", 60 * 60))
+            _default_cache = ResponseCache(
+                max_entries=int(os.getenv("DRYING_RESPONSE_CACHE_MAX_ENTRIES", 1000)),
+                ttl=ttl if ttl > 0 else None,
+                near_duplicates=os.getenv("DRYING_RESPONSE_CACHE_NEAR_DUPLICATES", "false").lower() == "true",
+                max_distance=int(os.getenv("DRYING_RESPONSE_CACHE_MAX_DISTANCE", 3))
+            )
+        return _default_cache
@@ -0,0 +1,266 @@
+"""
+Content-addressed cache for dried images.
+This module provides a two-tier cache for Stability AI results: an in-memory
+LRU bounded by a byte budget, backed by an on-disk store bounded by its own
+budget, which drops the oldest files first. Entries are keyed by
+a hash of the preprocessed image bytes and every generation parameter, so a
+repeated request with the same image, engine and prompts skips the API call.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any
+
+from .structured_logging import get_logger, log_event
+
+logger = get_logger("result_cache")
+
+
+def make_cache_key(
+    image_bytes: bytes,
+    engine_id: str,
+    prompts: List[Dict[str, Any]],
+    image_strength: float,
+    cfg_scale: float,
+    steps: int
+) -> str:
+    """Build a cache key from the preprocessed image bytes and generation parameters."""
+    params = json.dumps(
+        {
+            "engine_id": engine_id,
+            "prompts": prompts,
+            "image_strength": image_strength,
+            "cfg_scale": cfg_scale,
+            "steps": steps
+        },
+        sort_keys=True
+    )
+    digest = hashlib.sha256(image_bytes)
+    digest.update(params.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        cache_dir: Optional[str] = None,
+        ttl: Optional[float] = 24 * 60 * 60,
+        max_disk_bytes: Optional[int] = 512 * 1024 * 1024
+    ):
+        """Initialize the cache.
+
+        Args:
+            max_bytes: Byte budget for the in-memory tier
+            cache_dir: Directory for the on-disk tier, or None for memory only
+            ttl: Seconds an entry stays valid, or None to never expire
+            max_disk_bytes: Byte budget for the on-disk tier, or None for no limit
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._size = 0
+        # Estimated size of the disk tier, counted from the directory on the first write;
+        # other processes sharing the directory are only seen when it is pruned
+        self._disk_size: Optional[int] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_evictions = 0
+
+    def _path(self, key: str) -> str:
+        """Get the on-disk path for a key."""
+        return os.path.join(self.cache_dir, key[:2], f"{key}.png")
+
+    def _expired(self, stored_at: float) -> bool:
+        """Check whether an entry stored at the given time has expired."""
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _store_memory(self, key: str, data: bytes, stored_at: float) -> None:
+        """Insert an entry in the memory tier and evict down to the byte budget."""
+        if len(data) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key)[0])
+        self._entries[key] = (data, stored_at)
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Get cached bytes for a key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                data, stored_at = entry
+                if not self._expired(stored_at):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return data
+                self._entries.pop(key)
+                self._size -= len(data)
+                self.expirations += 1
+
+        data = self._read_disk(key)
+
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._store_memory(key, data[0], data[1])
+            return data[0]
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store bytes under a key in both tiers."""
+        stored_at = time.time()
+        with self._lock:
+            self._store_memory(key, data, stored_at)
+        self._write_disk(key, data)
+
+    def _read_disk(self, key: str) -> Optional[tuple]:
+        """Read an entry from the disk tier, removing it if expired."""
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if self._expired(stored_at):
+                os.remove(path)
+                with self._lock:
+                    self.expirations += 1
+                return None
+            with open(path, "rb") as f:
+                return f.read(), stored_at
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        """Write an entry to the disk tier atomically."""
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log_event(logger, logging.WARNING, "cache_write_failed", key=key, error=str(e))
+            return
+        if self.max_disk_bytes is None:
+            return
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = sum(size for _, size, _ in self._disk_files())
+            else:
+                self._disk_size += len(data) - replaced
+            over = self._disk_size > self.max_disk_bytes
+        if over:
+            self._prune_disk()
+
+    def _disk_files(self) -> List[tuple]:
+        """List (mtime, size, path) of every entry in the disk tier."""
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".png"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _prune_disk(self) -> None:
+        """Remove the oldest entries of the disk tier until it is 10% under its byte budget."""
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        # Pruning below the budget spreads the directory scans over many writes
+        target = int(self.max_disk_bytes * 0.9)
+        removed = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._disk_size = total
+            self.disk_evictions += removed
+        log_event(logger, logging.INFO, "disk_cache_pruned", removed=removed, bytes=total)
+
+    def clear(self) -> None:
+        """Remove all entries from both tiers."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._disk_size = None
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.endswith(".png"):
+                        os.remove(os.path.join(root, name))
+
+    def stats(self) -> Dict[str, Any]:
+        """Get cache counters and current memory usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "disk_evictions": self.disk_evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "disk_bytes": self._disk_size,
+                "max_disk_bytes": self.max_disk_bytes
+            }
+
+
+_default_cache: Optional[ResultCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> Optional[ResultCache]:
+    """Get the process-wide result cache configured from environment variables.
+
+    Returns None when DRYER_CACHE_ENABLED is false.
+    """
+    global _default_cache
+    if os.getenv("DRYER_CACHE_ENABLED", "true").lower() == "false":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            ttl = float(os.getenv("DRYER_CACHE_TTL", 24 * 60 * 60))
+            max_disk_bytes = int(os.getenv("DRYER_CACHE_MAX_DISK_BYTES", 512 * 1024 * 1024))
+            _default_cache = ResultCache(
+                max_bytes=int(os.getenv("DRYER_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+                cache_dir=os.getenv("DRYER_CACHE_DIR", ".cache/dried_images") or None,
+                ttl=ttl if ttl > 0 else None,
+                max_disk_bytes=max_disk_bytes if max_disk_bytes > 0 else None
+            )
+        return _default_cache
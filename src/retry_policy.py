@@ -0,0 +1,66 @@
+"""
+Retry policy for Stability AI API requests.
+This module provides exponential backoff with full jitter and support for
+the Retry-After header sent with 429 and 503 responses.
+"""
+
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        base_delay: float = 2.0,
+        max_delay: float = 30.0,
+        jitter: bool = True,
+        rng: Optional[random.Random] = None
+    ):
+        """Initialize the retry policy.
+
+        Args:
+            base_delay: Delay cap in seconds for the first retry
+            max_delay: Upper bound on any delay, including Retry-After
+            jitter: Draw the delay uniformly from [0, cap] (full jitter)
+            rng: Random number generator, for reproducible delays
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+
+    def get_delay(self, retry: int, retry_after: Optional[float] = None) -> float:
+        """Get the number of seconds to wait before the given retry.
+
+        Args:
+            retry: Zero-based index of the failed attempt
+            retry_after: Seconds requested by the server, if any
+        """
+        cap = min(self.max_delay, self.base_delay * (2 ** retry))
+        delay = self.rng.uniform(0, cap) if self.jitter else cap
+        if retry_after is not None:
+            # Never retry earlier than the server asked
+            delay = max(delay, retry_after)
+        return min(delay, self.max_delay)
+
+    @staticmethod
+    def is_retryable(status_code: Optional[int]) -> bool:
+        """Check whether a failure is transient (network error, timeout, 429 or 5xx)."""
+        return status_code is None or status_code in (408, 429) or status_code >= 500
+
+    @staticmethod
+    def parse_retry_after(value) -> Optional[float]:
+        """Parse a Retry-After header given in seconds or as an HTTP date."""
+        if not isinstance(value, str) or not value.strip():
+            return None
+        value = value.strip()
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
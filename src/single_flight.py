@@ -0,0 +1,132 @@
+"""
+Coalescing of identical concurrent drying requests.
+When several sessions submit the same image at once (a shared demo image,
+a double-clicked Send) the first caller makes the call and every caller
+arriving with the same key while it runs waits for its result, so a burst
+of duplicates costs one API request. A waiter that is cancelled stops
+waiting without affecting the others; if the caller making the call is
+cancelled, the waiters start the call again.
+"""
+
+import os
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .cancellation import OperationCancelled, check_cancelled, current_token
+from .metrics import COALESCED_REQUESTS
+from .request_scheduler import RequestTicket, current_ticket, get_request_scheduler
+from .structured_logging import get_logger, log_event
+
+logger = get_logger("single_flight")
+
+
+class _Flight:
+    def __init__(self, ticket: RequestTicket):
+        # Ticket of the caller making the call, promoted to the most urgent waiter's class
+        self.ticket = ticket
+        self.done = False
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        # Events of the waiters to wake when the call finishes
+        self.listeners: List[threading.Event] = []
+
+
+class SingleFlight:
+    def __init__(self, component: str = "dryer"):
+        """Initialize an empty group of in-flight calls.
+
+        Args:
+            component: Name used in the coalescing metrics and logs
+        """
+        self.component = component
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self) -> int:
+        """Get the number of calls currently running."""
+        with self._lock:
+            return len(self._flights)
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, bool]:
+        """Call fn, or wait for the call already running under the same key.
+
+        A waiter whose work is cancelled raises OperationCancelled on its own;
+        the call goes on for the others.
+
+        Returns:
+            The result of the call and whether it was made by another caller
+        """
+        ticket = current_ticket()
+        while True:
+            check_cancelled("single_flight", "wait")
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight(ticket)
+                else:
+                    wake = threading.Event()
+                    flight.listeners.append(wake)
+
+            if leader:
+                COALESCED_REQUESTS.inc(component=self.component, outcome="started")
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    self._finish(key, flight, None, e)
+                    raise
+                self._finish(key, flight, result, None)
+                return result, False
+
+            COALESCED_REQUESTS.inc(component=self.component, outcome="joined")
+            log_event(logger, logging.INFO, "request_coalesced", component=self.component, waiters=len(flight.listeners))
+            if flight.ticket.priority != ticket.priority:
+                # The call now also serves this caller, so it may not wait behind it
+                flight.ticket.promote(ticket.priority)
+                get_request_scheduler().wake()
+
+            token = current_token()
+            remove = token.add_callback(wake.set) if token is not None else None
+            try:
+                wake.wait()
+            finally:
+                if remove is not None:
+                    remove()
+            with self._lock:
+                if not flight.done:
+                    flight.listeners.remove(wake)
+            if not flight.done:
+                COALESCED_REQUESTS.inc(component=self.component, outcome="waiter_cancelled")
+                check_cancelled("single_flight", "wait")
+            if isinstance(flight.error, OperationCancelled):
+                # Only the caller making the call was cancelled, make it again for this one
+                COALESCED_REQUESTS.inc(component=self.component, outcome="restarted")
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+    def _finish(self, key: str, flight: _Flight, result: Any, error: Optional[BaseException]) -> None:
+        """Hand the outcome of a call to its waiters."""
+        with self._lock:
+            del self._flights[key]
+            flight.result, flight.error, flight.done = result, error, True
+            listeners, flight.listeners = flight.listeners, []
+        for wake in listeners:
+            wake.set()
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    """Get the process-wide request coalescer, or None if DRYING_COALESCE is false."""
+    global _single_flight
+    if os.getenv("DRYING_COALESCE", "true").lower() != "true":
+        return None
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight("router")
+        return _single_flight
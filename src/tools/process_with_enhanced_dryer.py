@@ -1,114 +1,92 @@
 """
-Process test images using the EnhancedImageDryer.
+Process test images using the dryer backends.
 This script takes images from the test_images directory,
-processes them with the EnhancedImageDryer, and saves the results
-to the test_results directory.
+processes them with the fastest healthy dryer backend, and saves the results
+to the test_results directory. Decoding runs on a process pool and several
+images are dried at once; a manifest in the output directory lets an
+interrupted run resume without redoing finished images.
 """
 
 import os
-import sys
-import datetime
-from PIL import Image
-from pathlib import Path
+import argparse
 from dotenv import load_dotenv
 
-# Import the enhanced image dryer
-from src.enhanced_image_dryer import EnhancedImageDryer
+# Import the dryer backends and the batch pipeline
+from src.batch_pipeline import BatchPipeline, find_images
+from src.dryer_backends import LocalEffectBackend
+from src.dryer_router import get_dryer_router
 
 # Load environment variables
 load_dotenv()
 
-def process_image(image_path, use_fallback=False):
-    """Process an image using the EnhancedImageDryer."""
-    # Ensure test_results directory exists
-    os.makedirs("test_results", exist_ok=True)
-    
-    # Load the image
-    try:
-        image = Image.open(image_path)
-        print(f"Loaded image: {image_path}")
-        print(f"Image size: {image.size}, Mode: {image.mode}")
-    except Exception as e:
-        print(f"Error loading image: {str(e)}")
-        return False
-    
-    # Process the image with the EnhancedImageDryer
-    print("Initializing EnhancedImageDryer...")
-    dryer = EnhancedImageDryer()
-    
-    # Check if API key is set
-    if not dryer.api_key:
-        print("Error: STABILITY_API_KEY not found in environment variables.")
-        print("Please set your Stability API key in the .env file.")
-        return False
-    
-    print(f"API Key found: {dryer.api_key[:5]}...{dryer.api_key[-5:] if len(dryer.api_key) > 10 else ''}")
-    
-    if use_fallback:
-        # Use the fallback method directly
-        print("Using fallback drying method as requested...")
-        processed_image = dryer.apply_fallback_drying_effect(image)
-    else:
-        # Try the API first
-        print("Attempting to process with Stability AI API...")
-        processed_image = dryer.process_image(image)
-        
-        # If API fails, use fallback method
-        if processed_image is None:
-            print("API processing failed. Using fallback drying method...")
-            processed_image = dryer.apply_fallback_drying_effect(image)
-    
-    if processed_image:
-        # Save the processed image
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"test_results/enhanced_dried_{Path(image_path).stem}_{timestamp}.png"
-        processed_image.save(output_filename)
-        print(f"Successfully processed image and saved to: {output_filename}")
-        return True
+def parse_args(argv=None):
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description="Dry a folder of images with the dryer backends")
+    parser.add_argument("--fallback", action="store_true", help="Use the local drying effect instead of the API")
+    parser.add_argument("--input-dir", default="test_images", help="Directory with the images to dry")
+    parser.add_argument("--output-dir", default="test_results", help="Directory for the dried images")
+    parser.add_argument("--manifest", default=None, help="Manifest file (default: <output-dir>/manifest.jsonl)")
+    parser.add_argument("--workers", type=int, default=None, help="Processes decoding and resizing images (default: CPU count)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Images dried at once")
+    return parser.parse_args(argv)
+
+def print_result(path, record):
+    """Print the outcome of one image."""
+    if record["status"] == "done":
+        print(f"[SUCCESS] {os.path.basename(path)} -> {record['output']}")
     else:
-        print(f"Failed to process image: {image_path}")
-        return False
+        print(f"[FAILED] {os.path.basename(path)}: {record.get('error')}")
 
-def main():
-    """Main function to process images from the test_images directory."""
-    print("\n=== Processing Test Images with EnhancedImageDryer ===\n")
+def main(argv=None):
+    """Main function to process images from the input directory."""
+    args = parse_args(argv)
+    print("\n=== Processing Test Images with the Dryer Backends ===\n")
     
-    # Parse command line arguments
-    use_fallback = "--fallback" in sys.argv
-    if use_fallback:
+    if args.fallback:
         print("Fallback mode enabled: Will use local processing instead of API")
+        process = LocalEffectBackend().process_image
+    else:
+        # Check if API key is set
+        api_key = os.getenv("STABILITY_API_KEY")
+        if not api_key:
+            print("Warning: STABILITY_API_KEY not found in environment variables.")
+            print("Only the local drying effect is available.")
+        else:
+            print(f"API Key found: {api_key[:5]}...{api_key[-5:] if len(api_key) > 10 else ''}")
+        # The router tries the fastest healthy Stability backend first and
+        # falls back to the local effect
+        process = get_dryer_router().process_image
     
-    # Check if test_images directory exists
-    if not os.path.exists("test_images"):
-        print("Error: test_images directory not found.")
+    # Check if the input directory exists
+    if not os.path.exists(args.input_dir):
+        print(f"Error: {args.input_dir} directory not found.")
         return
     
-    # Get list of image files in the test_images directory
-    image_files = [f for f in os.listdir("test_images") 
-                  if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif'))]
-    
+    image_files = find_images(args.input_dir)
     if not image_files:
-        print("No image files found in the test_images directory.")
-        print("Please place your test images in the test_images directory.")
+        print(f"No image files found in the {args.input_dir} directory.")
+        print(f"Please place your test images in the {args.input_dir} directory.")
         return
     
-    print(f"Found {len(image_files)} image(s) in the test_images directory:")
-    for i, file in enumerate(image_files, 1):
-        print(f"{i}. {file}")
+    print(f"Found {len(image_files)} image(s) in the {args.input_dir} directory.")
     
-    # Process each image
+    pipeline = BatchPipeline(
+        process,
+        output_dir=args.output_dir,
+        manifest_path=args.manifest,
+        workers=args.workers,
+        concurrency=args.concurrency
+    )
     print("\nProcessing images...")
-    for file in image_files:
-        image_path = os.path.join("test_images", file)
-        print(f"\nProcessing: {file}")
-        success = process_image(image_path, use_fallback)
-        if success:
-            print(f"[SUCCESS] Successfully processed {file}")
-        else:
-            print(f"[FAILED] Failed to process {file}")
+    try:
+        summary = pipeline.run(image_files, on_result=print_result)
+    except KeyboardInterrupt:
+        print("\nInterrupted. Run again to resume; finished images are skipped.")
+        return
     
     print("\nAll processing complete!")
-    print(f"Processed images saved to the test_results directory.")
+    print(f"Processed: {summary['processed']}, skipped (already done): {summary['skipped']}, failed: {summary['failed']}")
+    print(f"Processed images saved to the {args.output_dir} directory.")
 
 if __name__ == "__main__":
     main()
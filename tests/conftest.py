@@ -0,0 +1,19 @@
+import pytest
+from src import dryer_router, rate_limiter, request_scheduler, result_cache
+
+
+@pytest.fixture(autouse=True)
+def isolated_state_files(tmp_path, monkeypatch):
+    """Keep the default disk cache, rate limiter and scheduler databases out of the working directory."""
+    monkeypatch.setenv("DRYER_CACHE_DIR", str(tmp_path / "dried_images"))
+    monkeypatch.setenv("STABILITY_RATE_LIMIT_DB", str(tmp_path / "rate_limits.sqlite3"))
+    monkeypatch.setenv("DRYING_SCHEDULER_DB", str(tmp_path / "scheduler.sqlite3"))
+    monkeypatch.setenv("DRYING_PROFILE_DIR", str(tmp_path / "profiles"))
+    # The process-wide instances were configured by earlier tests, make them read the paths above
+    for module, name in (
+        (result_cache, "_default_cache"),
+        (rate_limiter, "_rate_limiter"),
+        (request_scheduler, "_scheduler"),
+        (dryer_router, "_default_router")
+    ):
+        monkeypatch.setattr(module, name, None)
@@ -0,0 +1,109 @@
+from unittest.mock import MagicMock, patch
+from PIL import Image
+from src.app import AgentPool, DryingApp
+
+
+def fake_agent():
+    agent = MagicMock()
+    agent.current_image = None
+    agent.processed_image = None
+    return agent
+
+
+def test_pool_keeps_one_agent_per_session():
+    """Test that sessions get separate agents and reuse their own."""
+    pool = AgentPool(agent_factory=fake_agent)
+    first = pool.get("a")
+    assert pool.get("a") is first
+    assert pool.get("b") is not first
+    assert pool.stats()["live_sessions"] == 2
+
+
+def test_pool_evicts_least_recently_used_past_max_sessions():
+    """Test that the oldest session is evicted when the session limit is reached."""
+    pool = AgentPool(agent_factory=fake_agent, max_sessions=2)
+    a = pool.get("a")
+    pool.get("b")
+    pool.get("a")
+    pool.get("c")
+    assert pool.get("a") is a
+    stats = pool.stats()
+    assert stats["evictions"] == 1  # "b" was the least recently used
+    assert stats["live_sessions"] == 2
+    assert stats["created"] == 3
+
+
+def test_pool_evicts_idle_sessions():
+    """Test that sessions idle longer than the timeout are evicted."""
+    pool = AgentPool(agent_factory=fake_agent, idle_timeout=10)
+    with patch("src.app.time.monotonic", return_value=0):
+        a = pool.get("a")
+    with patch("src.app.time.monotonic", return_value=100):
+        pool.get("b")
+        assert pool.stats()["live_sessions"] == 1
+        assert pool.get("a") is not a
+
+
+def test_pool_enforces_image_memory_budget():
+    """Test that held images count towards the memory budget."""
+    pool = AgentPool(agent_factory=fake_agent, max_image_bytes=100 * 100 * 3)
+    pool.get("a").current_image = Image.new("RGB", (100, 100))
+    pool.get("b").current_image = Image.new("RGB", (100, 100))
+    pool.get("b")
+    stats = pool.stats()
+    assert stats["live_sessions"] == 1
+    assert stats["image_bytes"] == 100 * 100 * 3
+
+
+def test_evicted_sessions_cancel_their_pending_images():
+    """Test that evicted agents stop their speculative and in-flight image requests, unlike the agents kept."""
+    pool = AgentPool(agent_factory=fake_agent, max_sessions=1)
+    a = pool.get("a")
+    b = pool.get("b")
+    a.cancel_pending.assert_called_once_with("evicted")
+    b.cancel_pending.assert_not_called()
+
+
+def test_sessions_do_not_share_history():
+    """Test that interactions from two sessions go to different agents."""
+    app = DryingApp()
+    app.agents = AgentPool(agent_factory=fake_agent)
+    for agent_id in ("a", "b"):
+        app.agents.get(agent_id).process_message.return_value = (
+            [{"role": "user", "content": "hi"}, {"role": "assistant", "content": agent_id}], None
+        )
+    history, _ = app.process_interaction("hi", None, [], request=MagicMock(session_hash="a"))
+    assert history[-1]["content"] == "a"
+    history, _ = app.process_interaction("hi", None, [], request=MagicMock(session_hash="b"))
+    assert history[-1]["content"] == "b"
+    app.reset_conversation(request=MagicMock(session_hash="a"))
+    assert app.agents.stats()["live_sessions"] == 1
+
+
+def test_streaming_interaction_updates_last_assistant_message():
+    """Test that the streaming handler rewrites the assistant message with each partial reply."""
+    app = DryingApp()
+    app.agents = AgentPool(agent_factory=fake_agent)
+    processed = Image.new("RGB", (8, 8))
+    app.agents.get("a").stream_message.return_value = iter([("Dry", None), ("Dry it", None), ("Dry it", processed)])
+
+    contents = []
+    for history, image in app.process_interaction_stream("hi", None, [], request=MagicMock(session_hash="a")):
+        contents.append(history[-1]["content"])
+    assert contents == ["Dry", "Dry it", "Dry it"]
+    assert history[-2] == {"role": "user", "content": "hi"}
+    assert image is processed
+
+
+def test_upload_starts_speculation_on_the_session_agent():
+    """Test that the image change handler hands the upload to the session's agent."""
+    app = DryingApp()
+    app.agents = AgentPool(agent_factory=fake_agent)
+    app.speculative = True
+    image = Image.new("RGB", (8, 8))
+    app.speculate(image, request=MagicMock(session_hash="a"))
+    app.agents.get("a").speculate.assert_called_once_with(image)
+
+    app.speculative = False
+    app.speculate(None, request=MagicMock(session_hash="a"))
+    assert app.agents.get("a").speculate.call_count == 1
@@ -0,0 +1,129 @@
+import io
+import base64
+import asyncio
+import pytest
+from unittest.mock import MagicMock
+from PIL import Image
+from src.enhanced_image_dryer import EnhancedImageDryer
+from src.latency_tracker import LatencyTracker
+from src.circuit_breaker import reset_circuit_breakers
+from src.result_cache import ResultCache
+from src.retry_policy import RetryPolicy
+
+
+def png_base64(color="blue"):
+    buffered = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode()
+
+
+class FakeAsyncTransport:
+    """Async transport that records how many requests are in flight."""
+
+    def __init__(self, statuses=None, latency=0.01, engine_latency=None):
+        self.statuses = list(statuses or [])
+        self.latency = latency
+        self.engine_latency = engine_latency or {}
+        self.cancelled = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.urls = []
+
+    async def post(self, url, **kwargs):
+        self.urls.append(url)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        engine = url.split("/")[-2]
+        try:
+            await asyncio.sleep(self.engine_latency.get(engine, self.latency))
+        except asyncio.CancelledError:
+            self.cancelled.append(engine)
+            raise
+        finally:
+            self.in_flight -= 1
+        status = self.statuses.pop(0) if self.statuses else 200
+        response = MagicMock(status_code=status, text="error", headers={"Content-Type": "application/json"})
+        response.json.return_value = {"artifacts": [{"base64": png_base64()}]}
+        return response
+
+
+@pytest.fixture(autouse=True)
+def fresh_circuit_breakers():
+    reset_circuit_breakers()
+    yield
+    reset_circuit_breakers()
+
+
+def make_dryer(transport, monkeypatch):
+    monkeypatch.setenv("STABILITY_API_KEY", "test_key")
+    dryer = EnhancedImageDryer(cache=ResultCache(cache_dir=None), transport=MagicMock(), async_transport=transport)
+    dryer.retry_policy = RetryPolicy(base_delay=0)
+    return dryer
+
+
+def test_aprocess_image_rotates_engines_on_failure(monkeypatch):
+    """Test that failed attempts move on to the next engine."""
+    transport = FakeAsyncTransport(statuses=[500, 500, 200])
+    dryer = make_dryer(transport, monkeypatch)
+    result = asyncio.run(dryer.aprocess_image(Image.new("RGB", (32, 32), "red")))
+    assert result is not None
+    assert [url.split("/")[-2] for url in transport.urls] == dryer.engines
+
+
+def test_aprocess_many_bounds_concurrency(monkeypatch):
+    """Test that the batch API keeps at most max_concurrent_uploads requests in flight."""
+    transport = FakeAsyncTransport()
+    dryer = make_dryer(transport, monkeypatch)
+    dryer.max_concurrent_uploads = 2
+    images = [Image.new("RGB", (32, 32), (i, 0, 0)) for i in range(6)]
+    results = asyncio.run(dryer.aprocess_many(images))
+    assert all(result is not None for result in results)
+    assert len(transport.urls) == 6
+    assert transport.max_in_flight == 2
+
+
+def test_aprocess_image_returns_none_after_all_attempts_fail(monkeypatch):
+    """Test that exhausted retries return None like the sync path."""
+    transport = FakeAsyncTransport(statuses=[429, 503, 500])
+    dryer = make_dryer(transport, monkeypatch)
+    assert asyncio.run(dryer.aprocess_image(Image.new("RGB", (32, 32)))) is None
+    assert len(transport.urls) == dryer.max_retries
+
+
+def test_hedging_takes_the_faster_engine_and_cancels_the_rest(monkeypatch):
+    """Test that a slow primary engine is hedged and the slow request is cancelled."""
+    transport = FakeAsyncTransport(engine_latency={"stable-diffusion-xl-1024-v1-0": 5})
+    dryer = make_dryer(transport, monkeypatch)
+    dryer.hedging_enabled = True
+    dryer.hedge_default_delay = 0.05
+    dryer.latency_tracker = LatencyTracker()
+
+    result = asyncio.run(dryer.aprocess_image(Image.new("RGB", (32, 32))))
+    assert result is not None
+    assert dryer.last_winner["engine"] == "stable-diffusion-v1-5"
+    assert dryer.last_winner["latency"] < 1
+    assert dryer.hedge_stats["hedges_sent"] == 1
+    assert transport.cancelled == ["stable-diffusion-xl-1024-v1-0"]
+
+
+def test_hedging_does_not_hedge_a_fast_primary(monkeypatch):
+    """Test that no hedge is sent when the primary answers within its delay."""
+    transport = FakeAsyncTransport()
+    dryer = make_dryer(transport, monkeypatch)
+    dryer.hedging_enabled = True
+    dryer.hedge_default_delay = 1
+    dryer.latency_tracker = LatencyTracker()
+
+    assert dryer.process_image(Image.new("RGB", (32, 32))) is not None
+    assert len(transport.urls) == 1
+    assert dryer.last_winner["engine"] == dryer.engines[0]
+
+
+def test_hedge_delay_uses_observed_percentile():
+    """Test that the hedge delay follows the engine's latency percentile once warmed up."""
+    tracker = LatencyTracker()
+    for latency in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]:
+        tracker.record("engine", latency)
+    assert tracker.percentile("engine", 90) == 9
+    assert tracker.percentile("engine", 50) == 5
+    assert tracker.percentile("other", 50) is None
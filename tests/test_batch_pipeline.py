@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+from PIL import Image
+from src.batch_pipeline import BatchManifest, BatchPipeline, find_images
+
+
+def make_inputs(directory, count=4):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        Image.new("RGB", (64 + i, 48), (120, 80 + i, 40)).save(os.path.join(directory, f"item{i}.jpg"))
+    return find_images(directory)
+
+
+def test_pipeline_dries_every_input_concurrently(tmp_path):
+    """Test that all inputs are dried, saved and recorded, with several dried at once."""
+    inputs = make_inputs(str(tmp_path / "in"))
+    active, peak, lock = [0], [0], threading.Lock()
+    barrier = threading.Barrier(2, timeout=5)
+
+    def process(image):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        barrier.wait()
+        with lock:
+            active[0] -= 1
+        return image
+
+    pipeline = BatchPipeline(process, output_dir=str(tmp_path / "out"), workers=2, concurrency=2)
+    summary = pipeline.run(inputs)
+
+    assert summary["processed"] == 4 and summary["failed"] == 0
+    assert peak[0] == 2
+    records = pipeline.manifest.records
+    assert all(os.path.exists(records[path]["output"]) for path in inputs)
+
+
+def test_rerun_skips_finished_inputs_and_retries_failures(tmp_path):
+    """Test that a second run only redoes failed, changed or missing inputs."""
+    inputs = make_inputs(str(tmp_path / "in"))
+    failing = inputs[0]
+    first = BatchPipeline(
+        lambda image: None if image.size[0] == 64 else image, output_dir=str(tmp_path / "out"), workers=1
+    )
+    assert first.run(inputs)["failed"] == 1
+
+    Image.new("RGB", (80, 80)).save(inputs[1])
+    os.utime(inputs[1], ns=(1, 1))
+    calls = []
+    second = BatchPipeline(lambda image: calls.append(image.size) or image, output_dir=str(tmp_path / "out"), workers=1)
+    summary = second.run(inputs)
+
+    assert summary == dict(summary, processed=2, skipped=2, failed=0)
+    assert sorted(calls) == [(64, 48), (80, 80)]
+    assert second.manifest.records[failing]["status"] == "done"
+
+
+def test_local_fallback_results_are_dried_again_by_the_next_run(tmp_path):
+    """Test that results of the local effect standing in for the API are kept but not taken as done."""
+    inputs = make_inputs(str(tmp_path / "in"), count=2)
+    first = BatchPipeline(
+        lambda image: (image, "local" if image.size[0] == 64 else "stability-xl"),
+        output_dir=str(tmp_path / "out"), workers=1, fallback_backends={"local"}
+    )
+    summary = first.run(inputs)
+    assert summary == dict(summary, processed=1, fallback=1, failed=0)
+    record = first.manifest.records[inputs[0]]
+    assert record["status"] == "fallback" and record["backend"] == "local"
+    assert os.path.exists(record["output"])
+
+    calls = []
+    second = BatchPipeline(
+        lambda image: calls.append(image.size) or (image, "stability-xl"),
+        output_dir=str(tmp_path / "out"), workers=1, fallback_backends={"local"}
+    )
+    summary = second.run(inputs)
+    assert summary == dict(summary, processed=1, skipped=1, fallback=0)
+    assert calls == [(64, 48)]
+    assert second.manifest.records[inputs[0]]["status"] == "done"
+
+
+def test_manifest_ignores_a_truncated_last_line(tmp_path):
+    """Test that a record cut short by an interrupted run is ignored."""
+    path = tmp_path / "manifest.jsonl"
+    record = {"input": "a.jpg", "fingerprint": {"size": 1, "mtime_ns": 1}, "status": "failed"}
+    path.write_text(json.dumps(record) + "\n" + '{"input": "b.jp')
+    manifest = BatchManifest(str(path))
+    assert list(manifest.records) == ["a.jpg"]
+
+
+class UnsavableImage:
+    def save(self, path):
+        raise OSError("disk full")
+
+
+def test_failing_save_is_recorded_without_hanging(tmp_path):
+    """Test that an image that cannot be saved fails its input and the run still finishes."""
+    inputs = make_inputs(str(tmp_path / "in"), count=6)
+    pipeline = BatchPipeline(
+        lambda image: UnsavableImage() if image.size[0] == 64 else image,
+        output_dir=str(tmp_path / "out"), workers=1, concurrency=2
+    )
+    done = []
+    thread = threading.Thread(target=lambda: done.append(pipeline.run(inputs)), daemon=True)
+    thread.start()
+    thread.join(timeout=20)
+
+    assert done, "the run hung"
+    assert done[0] == dict(done[0], processed=5, failed=1)
+    assert "disk full" in pipeline.manifest.records[inputs[0]]["error"]
+
+
+def test_stage_failure_stops_the_run_and_is_raised(tmp_path):
+    """Test that an error escaping a stage stops the pipeline and is re-raised by run."""
+    inputs = make_inputs(str(tmp_path / "in"), count=6)
+
+    def on_result(path, record):
+        raise RuntimeError("callback broke")
+
+    pipeline = BatchPipeline(lambda image: image, output_dir=str(tmp_path / "out"), workers=1, concurrency=2)
+    errors = []
+
+    def run():
+        try:
+            pipeline.run(inputs, on_result=on_result)
+        except RuntimeError as e:
+            errors.append(e)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=20)
+
+    assert not thread.is_alive(), "the run hung"
+    assert [str(e) for e in errors] == ["callback broke"]
@@ -0,0 +1,105 @@
+import threading
+import time
+import pytest
+from unittest.mock import MagicMock
+from PIL import Image
+from src.cancellation import (
+    CancellationToken, OperationCancelled, cancellable_call, cancellable_sleep, check_cancelled, use_token
+)
+from src.circuit_breaker import get_circuit_breaker, reset_circuit_breakers, CLOSED
+from src.drying_agent import _submit_leg
+from src.enhanced_image_dryer import EnhancedImageDryer
+from src.metrics import CANCELLATIONS, CANCELLED_WORK, FREED_WORKERS
+from src.result_cache import ResultCache
+from src.retry_policy import RetryPolicy
+
+
+@pytest.fixture(autouse=True)
+def fresh_circuit_breakers():
+    reset_circuit_breakers()
+    yield
+    reset_circuit_breakers()
+
+
+def cancel_later(token, delay=0.1, reason="test"):
+    timer = threading.Timer(delay, token.cancel, args=(reason,))
+    timer.start()
+    return timer
+
+
+def test_token_cancels_once_and_runs_callbacks():
+    """Test that callbacks run once and late callbacks run straight away."""
+    token = CancellationToken()
+    calls = []
+    token.add_callback(lambda: calls.append("early"))
+    remove = token.add_callback(lambda: calls.append("removed"))
+    remove()
+    before = CANCELLATIONS.value(reason="unit")
+    assert token.cancel("unit")
+    assert not token.cancel("unit")
+    token.add_callback(lambda: calls.append("late"))
+    assert calls == ["early", "late"]
+    assert token.reason == "unit"
+    assert CANCELLATIONS.value(reason="unit") == before + 1
+
+
+def test_checks_only_raise_under_a_cancelled_token():
+    """Test that work without a token, or with a live one, is never interrupted."""
+    check_cancelled("test", "check")
+    token = CancellationToken()
+    with use_token(token):
+        check_cancelled("test", "check")
+        token.cancel("test")
+        with pytest.raises(OperationCancelled):
+            check_cancelled("test", "check")
+
+
+def test_sleep_and_blocking_calls_return_early_when_cancelled():
+    """Test that retry sleeps and blocking calls stop as soon as the token is cancelled."""
+    token = CancellationToken()
+    before = CANCELLED_WORK.value(component="test", stage="retry_sleep")
+    with use_token(token):
+        cancel_later(token)
+        start = time.monotonic()
+        with pytest.raises(OperationCancelled):
+            cancellable_sleep(5, component="test")
+        assert time.monotonic() - start < 1
+    assert CANCELLED_WORK.value(component="test", stage="retry_sleep") == before + 1
+
+    token = CancellationToken()
+    with use_token(token):
+        assert cancellable_call(lambda x: x * 2, 21, component="test") == 42
+        cancel_later(token)
+        start = time.monotonic()
+        with pytest.raises(OperationCancelled):
+            cancellable_call(time.sleep, 5, component="test")
+        assert time.monotonic() - start < 1
+
+
+def test_cancelled_dryer_stops_retrying(monkeypatch):
+    """Test that cancelling during the backoff skips the remaining attempts and releases the breaker."""
+    monkeypatch.setenv("STABILITY_API_KEY", "test_key")
+    transport = MagicMock()
+    transport.post.return_value = MagicMock(status_code=500, text="error", headers={})
+    dryer = EnhancedImageDryer(cache=ResultCache(cache_dir=None), transport=transport, engines=["engine-a"])
+    dryer.retry_policy = RetryPolicy(base_delay=5, max_delay=5, jitter=False)
+
+    token = CancellationToken()
+    before = FREED_WORKERS.value(stage="image")
+    future = _submit_leg("image", dryer.process_image, Image.new("RGB", (32, 32)), token=token)
+    cancel_later(token, 0.3)
+    with pytest.raises(OperationCancelled):
+        future.result(timeout=2)
+    assert transport.post.call_count == 1
+    assert FREED_WORKERS.value(stage="image") == before + 1
+    assert get_circuit_breaker("engine-a").state == CLOSED
+
+
+def test_leg_cancelled_before_it_starts_does_no_work():
+    """Test that a leg whose token is already cancelled returns without calling its function."""
+    token = CancellationToken()
+    token.cancel("test")
+    work = MagicMock()
+    with pytest.raises(OperationCancelled):
+        _submit_leg("image", work, token=token).result(timeout=1)
+    work.assert_not_called()
@@ -0,0 +1,91 @@
+from unittest.mock import MagicMock
+from langchain_core.messages import AIMessage, SystemMessage
+from src.conversation_memory import ConversationMemory, estimate_tokens
+
+SYSTEM = SystemMessage(content="system")
+
+
+def count_messages(messages):
+    """Token counter charging 10 tokens per message."""
+    return 10 * len(messages)
+
+
+def make_memory(summarizer=None, **kwargs):
+    options = {"max_tokens": 40, "recent_turns": 1, "summarize_every": 2, "token_counter": count_messages}
+    options.update(kwargs)
+    return ConversationMemory(summarizer=summarizer, **options)
+
+
+def test_history_within_budget_is_kept_verbatim():
+    """Test that turns fitting the budget are sent verbatim."""
+    memory = make_memory()
+    memory.add_exchange("q1", "a1")
+    memory.add_exchange("q2", "a2")
+    prompt = memory.build_prompt(SYSTEM, "q3")
+    assert [m.content for m in prompt] == ["system", "q1", "a1", "q2", "a2", "q3"]
+
+
+def test_overflow_is_dropped_without_summarizer():
+    """Test that without a summarizer the oldest turns are dropped to fit the budget."""
+    memory = make_memory()
+    for i in range(10):
+        memory.add_exchange(f"q{i}", f"a{i}")
+    assert memory.stats()["history_tokens"] <= 40
+    assert memory.messages[-1].content == "a9"
+
+
+def test_summarizes_once_per_batch_of_overflowing_turns():
+    """Test that old turns are folded with one call per summarize_every turns."""
+    summarizer = MagicMock()
+    summarizer.invoke.return_value = AIMessage(content="user dries a towel")
+    memory = make_memory(summarizer)
+
+    calls = 0
+    for i in range(8):
+        memory.add_exchange(f"q{i}", f"a{i}")
+        if memory.needs_summary():
+            assert memory.maybe_summarize()
+            calls += 1
+
+    assert summarizer.invoke.call_count == calls
+    assert 0 < calls < 8
+    assert memory.summary == "user dries a towel"
+    prompt = memory.build_prompt(SYSTEM, "next")
+    assert "user dries a towel" in prompt[1].content
+    assert prompt[-2].content == "a7"
+
+
+def test_prompt_tokens_stay_flat_for_long_conversations():
+    """Test that the prompt size stops growing with conversation length."""
+    summarizer = MagicMock()
+    summarizer.invoke.return_value = AIMessage(content="summary")
+    memory = make_memory(summarizer)
+    sizes = []
+    for i in range(30):
+        memory.add_exchange(f"q{i}", f"a{i}")
+        memory.maybe_summarize()
+        sizes.append(memory.count_tokens(memory.build_prompt(SYSTEM, "next")))
+    assert max(sizes[10:]) <= max(sizes[:10])
+
+
+def test_reset_during_summarization_discards_the_result():
+    """Test that a reset while summarizing does not resurrect old state."""
+    memory = make_memory()
+    summarizer = MagicMock()
+
+    def reset_then_reply(messages):
+        memory.reset()
+        return AIMessage(content="stale summary")
+
+    summarizer.invoke.side_effect = reset_then_reply
+    memory.summarizer = summarizer
+    for i in range(4):
+        memory.add_exchange(f"q{i}", f"a{i}")
+    assert not memory.maybe_summarize()
+    assert memory.summary == ""
+    assert memory.messages == []
+
+
+def test_estimate_tokens_counts_characters():
+    """Test the default four-characters-per-token estimate."""
+    assert estimate_tokens([SYSTEM]) == len("system") // 4 + 4
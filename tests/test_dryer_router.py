@@ -0,0 +1,90 @@
+import pytest
+from PIL import Image
+from src import dryer_backends
+from src.dryer_backends import LocalEffectBackend, create_backend, create_backends, register_backend
+from src.dryer_router import BackendRouter
+
+
+class FakeBackend:
+    remote = True
+
+    def __init__(self, name, succeed=True, up=True):
+        self.name = name
+        self.succeed = succeed
+        self.up = up
+        self.calls = 0
+
+    def available(self):
+        return self.up
+
+    def process_image(self, image, use_cache=True):
+        self.calls += 1
+        if isinstance(self.succeed, Exception):
+            raise self.succeed
+        return image if self.succeed else None
+
+
+def make_image():
+    return Image.new("RGB", (8, 8), (120, 80, 40))
+
+
+def test_plan_orders_remote_backends_by_latency():
+    """Test that backends with samples are tried fastest first, with local ones last."""
+    slow, fast, local = FakeBackend("slow"), FakeBackend("fast"), LocalEffectBackend()
+    router = BackendRouter([slow, fast, local], min_samples=2)
+    for _ in range(2):
+        router.record("slow", 5.0, True)
+        router.record("fast", 1.0, True)
+    assert [backend.name for backend in router.plan()] == ["fast", "slow", "local"]
+
+
+def test_plan_skips_unhealthy_and_slow_backends():
+    """Test that unavailable, failing and over-SLO backends are left out of the plan."""
+    down = FakeBackend("down", up=False)
+    failing, slow, fresh = FakeBackend("failing"), FakeBackend("slow"), FakeBackend("fresh")
+    router = BackendRouter([down, failing, slow, fresh], slo=10, min_samples=2)
+    for _ in range(2):
+        router.record("failing", 1.0, False)
+        router.record("slow", 20.0, True)
+    assert [backend.name for backend in router.plan()] == ["fresh"]
+
+
+def test_process_image_fails_over_to_local():
+    """Test that failed and raising backends are recorded and the next one is tried."""
+    failing, raising = FakeBackend("failing", succeed=False), FakeBackend("raising", succeed=RuntimeError("boom"))
+    router = BackendRouter([failing, raising, LocalEffectBackend()])
+    result = router.process_image(make_image())
+
+    assert result is not None
+    assert router.last_route["backend"] == "local"
+    assert router.last_route["tried"] == ["failing", "raising", "local"]
+    stats = router.stats()
+    assert stats["failing"]["requests"] == 1 and stats["failing"]["successes"] == 0
+    assert stats["local"]["successes"] == 1
+
+
+def test_route_names_the_backend_that_made_the_result():
+    """Test that route tells callers such as batch runs which backend dried the image."""
+    router = BackendRouter([FakeBackend("failing", succeed=False), LocalEffectBackend()])
+    result, backend = router.route(make_image())
+    assert result is not None and backend == "local"
+    assert BackendRouter([FakeBackend("failing", succeed=False)]).route(make_image()) == (None, None)
+
+
+def test_process_image_returns_none_when_every_backend_fails():
+    """Test that the route records the failure when no backend dries the image."""
+    router = BackendRouter([FakeBackend("failing", succeed=False)])
+    assert router.process_image(make_image()) is None
+    assert router.last_route["backend"] is None
+
+
+def test_registry():
+    """Test creating backends by name and registering new ones."""
+    with pytest.raises(ValueError):
+        create_backend("missing")
+    try:
+        register_backend("fake", lambda: FakeBackend("fake"))
+        backends = create_backends("fake, local")
+        assert [backend.name for backend in backends] == ["fake", "local"]
+    finally:
+        dryer_backends._factories.pop("fake", None)
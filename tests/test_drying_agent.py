@@ -1,7 +1,11 @@
+import threading
+import time
 import pytest
 from unittest.mock import MagicMock, patch
 from PIL import Image
+from src.cancellation import current_token
 from src.drying_agent import DryingAgent
+from src.metrics import PROGRESSIVE_RESULTS
 from langchain.schema import AIMessage, HumanMessage, SystemMessage
 
 @pytest.fixture
@@ -14,7 +18,7 @@ def mock_chat_model():
 
 @pytest.fixture
 def mock_image_dryer():
-    with patch('src.drying_agent.ImageDryer') as mock:
+    with patch('src.drying_agent.get_dryer_router') as mock:
         mock_instance = MagicMock()
         mock.return_value = mock_instance
         mock_instance.process_image.return_value = MagicMock(spec=Image.Image)
@@ -67,4 +71,218 @@ def test_reset(mock_chat_model, mock_image_dryer):
     
     assert len(agent.chat_history) == 0
     assert agent.current_image is None
-    assert agent.processed_image is None 
\ No newline at end of file
+    assert agent.processed_image is None 
+
+def test_process_message_runs_chat_and_image_concurrently(mock_chat_model, mock_image_dryer):
+    """Test that the chat and image legs overlap instead of running back to back."""
+    def slow_invoke(messages):
+        time.sleep(0.3)
+        return AIMessage(content="Test response")
+
+    def slow_process_image(image):
+        time.sleep(0.3)
+        return Image.new("RGB", (8, 8))
+
+    mock_chat_model.invoke.side_effect = slow_invoke
+    mock_image_dryer.process_image.side_effect = slow_process_image
+    agent = DryingAgent()
+
+    start = time.monotonic()
+    messages, processed_image = agent.process_message("test message", Image.new("RGB", (8, 8)))
+    assert time.monotonic() - start < 0.55
+    assert messages[1]["content"] == "Test response"
+    assert processed_image is not None
+
+
+def test_process_message_image_timeout_keeps_chat_response(mock_chat_model, mock_image_dryer):
+    """Test that a slow image leg times out without losing the chat response."""
+    mock_chat_model.invoke.return_value = AIMessage(content="Test response")
+    mock_image_dryer.process_image.side_effect = lambda image: time.sleep(0.5)
+    agent = DryingAgent()
+    agent.image_timeout = 0.1
+
+    messages, processed_image = agent.process_message("test message", Image.new("RGB", (8, 8)))
+    assert messages[1]["content"] == "Test response"
+    assert processed_image is None
+    assert len(agent.chat_history) == 2
+
+
+def test_process_message_chat_timeout_returns_error(mock_chat_model, mock_image_dryer):
+    """Test that a chat timeout is reported like other errors."""
+    mock_chat_model.invoke.side_effect = lambda messages: time.sleep(0.5)
+    agent = DryingAgent()
+    agent.chat_timeout = 0.1
+
+    messages, processed_image = agent.process_message("test message")
+    assert "timed out" in messages[0]["content"]
+    assert processed_image is None
+
+
+def test_stream_message_yields_partial_responses(mock_chat_model, mock_image_dryer):
+    """Test that streamed chunks are yielded as they arrive and the image lands once ready."""
+    mock_chat_model.stream.return_value = iter([AIMessage(content="Dry "), AIMessage(content="it "), AIMessage(content="slowly.")])
+    processed = Image.new("RGB", (8, 8))
+    mock_image_dryer.process_image.return_value = processed
+    agent = DryingAgent()
+
+    updates = list(agent.stream_message("test message", Image.new("RGB", (8, 8))))
+    texts = [text for text, _ in updates]
+    assert "Dry " in texts
+    assert texts[-1] == "Dry it slowly."
+    assert updates[-1][1] is processed
+    assert agent.chat_history[-1].content == "Dry it slowly."
+
+
+def test_stream_message_reports_chat_errors(mock_chat_model, mock_image_dryer):
+    """Test that a failing stream yields an error message and leaves history untouched."""
+    mock_chat_model.stream.side_effect = RuntimeError("boom")
+    agent = DryingAgent()
+
+    updates = list(agent.stream_message("test message"))
+    assert updates[-1] == ("An error occurred: boom", None)
+    assert agent.chat_history == []
+
+
+def test_stream_message_shows_preview_before_api_result(mock_chat_model, mock_image_dryer):
+    """Test that a local preview is yielded first and replaced by the API result."""
+    mock_chat_model.stream.return_value = iter([AIMessage(content="Dry it.")])
+    processed = Image.new("RGB", (8, 8))
+    mock_image_dryer.process_image.side_effect = lambda image: time.sleep(0.2) or processed
+    agent = DryingAgent()
+    agent.progressive = True
+
+    updates = list(agent.stream_message("test message", Image.new("RGB", (8, 8), (120, 80, 40))))
+    preview = updates[0][1]
+    assert updates[0][0] == ""
+    assert preview is not None and preview is not processed
+    assert updates[-1][1] is processed
+
+
+def test_stream_message_keeps_preview_after_deadline(mock_chat_model, mock_image_dryer):
+    """Test that the preview is the final image and the API request is cancelled when it misses the deadline."""
+    mock_chat_model.stream.return_value = iter([AIMessage(content="Dry it.")])
+    tokens = []
+    mock_image_dryer.process_image.side_effect = lambda image: tokens.append(current_token()) or time.sleep(0.5)
+    agent = DryingAgent()
+    agent.progressive = True
+    agent.progressive_deadline = 0.1
+
+    start = time.monotonic()
+    updates = list(agent.stream_message("test message", Image.new("RGB", (8, 8), (120, 80, 40))))
+    assert time.monotonic() - start < 0.4
+    assert updates[-1][0] == "Dry it."
+    assert updates[-1][1] is updates[0][1]
+    assert agent.processed_image is updates[0][1]
+    assert tokens[0].cancelled
+    assert agent._pending_image is None
+
+
+def test_stream_message_ignores_an_image_arriving_after_the_deadline(mock_chat_model, mock_image_dryer):
+    """Test that an image finishing after the deadline while the chat still streams does not replace the preview."""
+    def chunks():
+        yield AIMessage(content="Dry ")
+        time.sleep(0.4)
+        yield AIMessage(content="it.")
+    mock_chat_model.stream.return_value = chunks()
+    processed = Image.new("RGB", (8, 8))
+    mock_image_dryer.process_image.side_effect = lambda image: time.sleep(0.2) or processed
+    agent = DryingAgent()
+    agent.progressive = True
+    agent.progressive_deadline = 0.1
+    before = {outcome: PROGRESSIVE_RESULTS.value(outcome=outcome) for outcome in ("deadline", "upgraded", "cancelled")}
+
+    updates = list(agent.stream_message("test message", Image.new("RGB", (8, 8), (120, 80, 40))))
+    preview = updates[0][1]
+    assert updates[-1] == ("Dry it.", preview)
+    assert all(image is preview for _, image in updates)
+    assert PROGRESSIVE_RESULTS.value(outcome="deadline") == before["deadline"] + 1
+    assert PROGRESSIVE_RESULTS.value(outcome="upgraded") == before["upgraded"]
+    assert PROGRESSIVE_RESULTS.value(outcome="cancelled") == before["cancelled"]
+
+
+def test_stream_message_keeps_preview_when_api_fails(mock_chat_model, mock_image_dryer):
+    """Test that a failed API call does not blank the preview."""
+    mock_chat_model.stream.return_value = iter([AIMessage(content="Dry it.")])
+    mock_image_dryer.process_image.return_value = None
+    agent = DryingAgent()
+    agent.progressive = True
+
+    updates = list(agent.stream_message("test message", Image.new("RGB", (8, 8), (120, 80, 40))))
+    assert updates[-1][1] is not None
+    assert updates[-1][1] is updates[0][1]
+
+
+def test_speculation_is_reused_for_the_same_image(mock_chat_model, mock_image_dryer):
+    """Test that an image dried on upload is not sent again with the message."""
+    mock_chat_model.invoke.return_value = AIMessage(content="Test response")
+    processed = Image.new("RGB", (8, 8))
+    mock_image_dryer.process_image.return_value = processed
+    agent = DryingAgent()
+
+    agent.speculate(Image.new("RGB", (8, 8), (120, 80, 40)))
+    messages, processed_image = agent.process_message("test message", Image.new("RGB", (8, 8), (120, 80, 40)))
+    assert processed_image is processed
+    assert mock_image_dryer.process_image.call_count == 1
+
+
+def test_speculation_is_cancelled_when_the_image_changes(mock_chat_model, mock_image_dryer):
+    """Test that replacing or clearing the image drops the previous speculation."""
+    mock_chat_model.invoke.return_value = AIMessage(content="Test response")
+    mock_image_dryer.process_image.side_effect = lambda image: image
+    agent = DryingAgent()
+
+    agent.speculate(Image.new("RGB", (8, 8), (120, 80, 40)))
+    agent.speculate(Image.new("RGB", (8, 8), (0, 0, 0)))
+    first_key = agent._speculation[0]
+    agent.speculate(None)
+    assert agent._speculation is None
+
+    replaced = Image.new("RGB", (8, 8), (255, 255, 255))
+    agent.speculate(Image.new("RGB", (8, 8), (0, 0, 0)))
+    assert agent._speculation[0] == first_key
+    _, processed_image = agent.process_message("test message", replaced)
+    assert processed_image is replaced
+    assert agent._speculation is None
+
+
+def test_new_message_and_reset_cancel_image_legs_in_flight(mock_chat_model, mock_image_dryer):
+    """Test that a superseded or reset image leg stops at its next cancellation check."""
+    from concurrent.futures import CancelledError
+    from src.cancellation import OperationCancelled, cancellable_sleep
+
+    def slow_process_image(image):
+        cancellable_sleep(5, component="test")
+        return image
+
+    mock_image_dryer.process_image.side_effect = slow_process_image
+    agent = DryingAgent()
+
+    first = agent._image_leg(Image.new("RGB", (8, 8), (120, 80, 40)))
+    second = agent._image_leg(Image.new("RGB", (8, 8), (0, 0, 0)))
+    # A leg still queued is cancelled outright, a running one stops at its next check
+    with pytest.raises((OperationCancelled, CancelledError)):
+        first.result(timeout=1)
+    assert not second.done()
+
+    agent.reset()
+    with pytest.raises((OperationCancelled, CancelledError)):
+        second.result(timeout=1)
+
+
+def test_resending_the_same_image_keeps_its_leg_in_flight(mock_chat_model, mock_image_dryer):
+    """Test that a second message with the same image reuses the running leg instead of cancelling it."""
+    release = threading.Event()
+
+    def slow_process_image(image):
+        release.wait(5)
+        return image
+
+    mock_image_dryer.process_image.side_effect = slow_process_image
+    agent = DryingAgent()
+
+    first = agent._image_leg(Image.new("RGB", (8, 8), (120, 80, 40)))
+    second = agent._image_leg(Image.new("RGB", (8, 8), (120, 80, 40)))
+    assert second is first
+    release.set()
+    assert first.result(timeout=2) is not None
+    assert mock_image_dryer.process_image.call_count == 1
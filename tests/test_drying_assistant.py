@@ -32,7 +32,7 @@ def mock_chat_model():
 @pytest.fixture
 def mock_image_dryer(mock_stable_diffusion):
     # Use direct import path to match the agent's import
-    with patch('src.drying_agent.ImageDryer') as mock:
+    with patch('src.drying_agent.get_dryer_router') as mock:
         mock_instance = MagicMock()
         mock.return_value = mock_instance
         mock_instance.process_image.return_value = MagicMock(spec=Image.Image)
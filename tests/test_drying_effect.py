@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from colorsys import rgb_to_hsv, hsv_to_rgb
+from PIL import Image
+from src.drying_effect import apply_drying_effect, build_tone_lut
+from src.enhanced_image_dryer import EnhancedImageDryer
+
+
+def legacy_drying_effect(image):
+    """Per-pixel reference implementation of the original fallback effect."""
+    result = image.convert("RGB")
+    result = result.point(lambda p: min(255, int(p * 1.2)))
+    result = result.point(lambda p: min(255, int(128 + 1.1 * (p - 128))))
+    width, height = result.size
+    for x in range(width):
+        for y in range(height):
+            r, g, b = result.getpixel((x, y))
+            h, s, v = rgb_to_hsv(r / 255, g / 255, b / 255)
+            s *= 0.8
+            r, g, b = hsv_to_rgb(h, s, v)
+            result.putpixel((x, y), (int(r * 255), int(g * 255), int(b * 255)))
+    return result
+
+
+@pytest.fixture
+def random_image():
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (64, 96, 3), dtype=np.uint8))
+
+
+def test_tone_lut_matches_point_passes():
+    """Test that the combined LUT matches the two original point passes."""
+    ramp = Image.new("L", (256, 1))
+    ramp.putdata(list(range(256)))
+    expected = ramp.point(lambda p: min(255, int(p * 1.2)))
+    expected = expected.point(lambda p: min(255, int(128 + 1.1 * (p - 128))))
+    assert build_tone_lut(1.2, 1.1).tolist() == list(expected.getdata())
+
+
+def test_parity_with_legacy_effect(random_image):
+    """Test that the vectorized effect matches the per-pixel implementation."""
+    expected = np.asarray(legacy_drying_effect(random_image), dtype=np.int16)
+    actual = np.asarray(EnhancedImageDryer().apply_fallback_drying_effect(random_image), dtype=np.int16)
+    assert actual.shape == expected.shape
+    # Only float truncation differences of a single level are allowed
+    assert np.abs(actual - expected).max() <= 1
+    assert (actual != expected).mean() < 0.1
+
+
+def test_tiled_matches_whole_image(random_image):
+    """Test that tiled processing gives the same result as whole-image processing."""
+    whole = apply_drying_effect(random_image)
+    tiled = apply_drying_effect(random_image, tile_rows=7)
+    assert np.array_equal(np.asarray(whole), np.asarray(tiled))
+
+
+def test_converts_non_rgb_input():
+    """Test that RGBA and grayscale inputs are converted to RGB."""
+    for mode in ("RGBA", "L"):
+        result = apply_drying_effect(Image.new(mode, (8, 8)))
+        assert result.mode == "RGB"
+        assert result.size == (8, 8)
@@ -0,0 +1,133 @@
+import io
+import base64
+import asyncio
+import threading
+from unittest.mock import MagicMock, patch
+import requests
+from PIL import Image
+from src.http_transport import AsyncStabilityTransport, StabilityTransport, accept_header, read_artifact
+from src.image_dryer import ImageDryer
+from src.result_cache import ResultCache
+
+
+def test_session_uses_pool_and_default_timeouts():
+    """Test that requests go through the pooled session with (connect, read) timeouts."""
+    transport = StabilityTransport(pool_size=4, connect_timeout=2, read_timeout=30)
+    adapter = transport.session.get_adapter("https://api.stability.ai")
+    assert adapter._pool_maxsize == 4
+
+    with patch.object(transport.session, "post") as mock_post:
+        transport.post("https://api.stability.ai/x", data={})
+        assert mock_post.call_args.kwargs["timeout"] == (2, 30)
+        transport.post("https://api.stability.ai/x", timeout=(1, 1))
+        assert mock_post.call_args.kwargs["timeout"] == (1, 1)
+
+
+def test_warm_up_counts_established_connections():
+    """Test that warm-up reports failures without raising."""
+    transport = StabilityTransport(pool_size=2)
+    with patch.object(transport.session, "head") as mock_head:
+        assert transport.warm_up("https://api.stability.ai", connections=5) == 2
+        assert mock_head.call_count == 2
+        mock_head.side_effect = requests.ConnectionError("down")
+        assert transport.warm_up("https://api.stability.ai") == 0
+
+
+def test_async_transport_keeps_one_client_per_event_loop():
+    """Test that concurrent loops keep their own clients and closed loops do not pile up clients."""
+    transport = AsyncStabilityTransport()
+
+    async def get_client():
+        client = transport._get_client()
+        assert transport._get_client() is client
+        return client
+
+    results = {}
+    ready = threading.Barrier(2)
+
+    def run_loop(name):
+        async def hold():
+            client = await get_client()
+            ready.wait(timeout=2)
+            return client
+        results[name] = asyncio.run(hold())
+
+    threads = [threading.Thread(target=run_loop, args=(name,)) for name in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=2)
+    assert results["a"] is not results["b"]
+
+    loops = [asyncio.new_event_loop() for _ in range(3)]
+    for loop in loops:
+        loop.run_until_complete(get_client())
+        loop.close()
+    assert transport.client_count() <= 1
+
+    async def close():
+        await get_client()
+        await transport.aclose()
+    asyncio.run(close())
+    assert transport.client_count() == 0
+
+
+def test_image_dryer_sends_through_transport():
+    """Test that ImageDryer uses the shared transport instead of requests.post."""
+    transport = MagicMock()
+    transport.post.return_value = MagicMock(status_code=500, text="error")
+    dryer = ImageDryer(cache=ResultCache(cache_dir=None), transport=transport)
+    with patch("requests.post") as mock_post:
+        assert dryer.process_image(Image.new("RGB", (1024, 1024))) is None
+        mock_post.assert_not_called()
+    transport.post.assert_called_once()
+
+
+def png_bytes():
+    buffered = io.BytesIO()
+    Image.new("RGB", (8, 8), "blue").save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def test_read_artifact_prefers_binary_body():
+    """Test that binary responses are used as-is and JSON responses are base64-decoded."""
+    data = png_bytes()
+    binary = MagicMock(headers={"Content-Type": "image/png"}, content=data)
+    assert read_artifact(binary) == data
+    binary.json.assert_not_called()
+
+    payload = MagicMock(headers={"Content-Type": "application/json"})
+    payload.json.return_value = {"artifacts": [{"base64": base64.b64encode(data).decode()}]}
+    assert read_artifact(payload) == data
+
+
+def test_image_dryer_requests_binary_png():
+    """Test that ImageDryer asks for a PNG body and decodes it without JSON."""
+    transport = MagicMock()
+    transport.post.return_value = MagicMock(status_code=200, headers={"Content-Type": "image/png"}, content=png_bytes())
+    dryer = ImageDryer(cache=ResultCache(cache_dir=None), transport=transport)
+    result = dryer.process_image(Image.new("RGB", (1024, 1024)))
+    assert result is not None and result.size == (8, 8)
+    assert transport.post.call_args.kwargs["headers"]["Accept"] == "image/png"
+    transport.post.return_value.json.assert_not_called()
+
+    dryer.binary_responses = False
+    dryer.process_image(Image.new("RGB", (1024, 1024)), use_cache=False)
+    assert transport.post.call_args.kwargs["headers"] == {"Authorization": f"Bearer {dryer.api_key}", **accept_header(False)}
+
+
+def test_api_host_set_after_import_is_used(monkeypatch):
+    """Test that STABILITY_API_HOST loaded from .env after the modules were imported still applies."""
+    monkeypatch.setenv("STABILITY_API_HOST", "http://127.0.0.1:8601")
+    transport = MagicMock()
+    transport.post.return_value = MagicMock(status_code=200, headers={"Content-Type": "image/png"}, content=png_bytes())
+    dryer = ImageDryer(cache=ResultCache(cache_dir=None), transport=transport)
+    dryer.process_image(Image.new("RGB", (1024, 1024)))
+    assert transport.post.call_args.args[0].startswith("http://127.0.0.1:8601/v1/generation/")
+
+
+def test_binary_responses_set_after_import_are_used(monkeypatch):
+    """Test that STABILITY_BINARY_RESPONSES loaded from .env after the modules were imported still applies."""
+    monkeypatch.setenv("STABILITY_BINARY_RESPONSES", "false")
+    assert accept_header() == {"Accept": "application/json"}
+    assert not ImageDryer(cache=ResultCache(cache_dir=None), transport=MagicMock()).binary_responses
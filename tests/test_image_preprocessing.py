@@ -0,0 +1,69 @@
+import io
+from unittest.mock import MagicMock
+from PIL import Image
+from src.image_preprocessing import (
+    SDXL_DIMENSIONS, fit_within, get_compress_level, prepare_image, preprocess_for_upload, snap_to_sdxl
+)
+from src.image_dryer import ImageDryer
+from src.enhanced_image_dryer import EnhancedImageDryer
+
+
+def test_snap_to_sdxl_picks_closest_aspect_ratio():
+    """Test that sizes snap to the supported dimensions with the closest aspect ratio."""
+    assert snap_to_sdxl((500, 500)) == (1024, 1024)
+    assert snap_to_sdxl((1920, 1080)) == (1344, 768)
+    assert snap_to_sdxl((1080, 1920)) == (768, 1344)
+
+
+def test_fit_within_only_shrinks():
+    """Test that fit_within keeps small images and scales large ones down."""
+    target = fit_within(1024)
+    assert target((800, 600)) == (800, 600)
+    assert target((4096, 2048)) == (1024, 512)
+
+
+def test_prepare_image_skips_resize_at_target_size():
+    """Test that an RGB image already at the target size is not resampled."""
+    image = Image.new("RGB", (1024, 1024), "blue")
+    assert prepare_image(image, snap_to_sdxl) is image
+
+
+def test_prepare_image_converts_and_resizes():
+    """Test that large non-RGB images are converted and resized to the target."""
+    image = Image.new("RGBA", (4000, 3000), (255, 0, 0, 255))
+    result = prepare_image(image, snap_to_sdxl)
+    assert result.mode == "RGB"
+    assert result.size in SDXL_DIMENSIONS
+    # The caller's image is left untouched
+    assert image.size == (4000, 3000)
+
+
+def test_prepare_image_drafts_jpeg_paths(tmp_path):
+    """Test that JPEG files given by path are decoded at reduced scale."""
+    path = tmp_path / "large.jpg"
+    Image.new("RGB", (4096, 4096), "green").save(path, format="JPEG")
+    result = prepare_image(str(path), fit_within(512))
+    assert result.size == (512, 512)
+    assert result.getpixel((256, 256))[1] > 100
+
+
+def test_preprocess_for_upload_times_each_stage():
+    """Test that the upload pipeline reports decode, resize and encode timings."""
+    image = Image.new("RGB", (4096, 4096), "red")
+    img_bytes, timings = preprocess_for_upload(image, fit_within(1024), compress_level=1)
+    assert Image.open(io.BytesIO(img_bytes)).size == (1024, 1024)
+    assert {"decode", "reduce", "resize", "encode"} <= set(timings)
+
+
+def test_dryers_share_preprocessing():
+    """Test that both dryers preprocess through the shared pipeline."""
+    image = Image.new("RGB", (1920, 1080), "white")
+    assert ImageDryer().preprocess_image(image).size == (1344, 768)
+    assert EnhancedImageDryer().preprocess_image(image).size == (1024, 576)
+
+
+def test_compress_level_set_after_import_is_used(monkeypatch):
+    """Test that STABILITY_PNG_COMPRESS_LEVEL loaded from .env after the modules were imported still applies."""
+    monkeypatch.setenv("STABILITY_PNG_COMPRESS_LEVEL", "1")
+    assert get_compress_level() == 1
+    assert EnhancedImageDryer(transport=MagicMock()).png_compress_level == 1
@@ -0,0 +1,93 @@
+import pytest
+from unittest.mock import MagicMock
+from fastapi.testclient import TestClient
+from PIL import Image
+from src.app import AgentPool, DryingApp, create_server
+from src.circuit_breaker import reset_circuit_breakers
+from src.enhanced_image_dryer import EnhancedImageDryer
+from src.metrics import ACTIVE_SESSIONS, ENGINE_ATTEMPTS, FALLBACKS, REGISTRY, STAGE_SECONDS, MetricsRegistry
+from src.result_cache import ResultCache
+from src.retry_policy import RetryPolicy
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    REGISTRY.reset()
+    reset_circuit_breakers()
+    yield
+    REGISTRY.reset()
+    reset_circuit_breakers()
+
+
+def test_registry_renders_prometheus_text():
+    """Test that counters, gauges and histograms render in the exposition format."""
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ["code"])
+    latency = registry.histogram("latency_seconds", "Latency", buckets=[0.1, 1])
+    registry.gauge("sessions", "Sessions").set(3)
+    requests.inc(code="200")
+    requests.inc(2, code="200")
+    latency.observe(0.5)
+    text = registry.render()
+    assert 'requests_total{code="200"} 3' in text
+    assert 'latency_seconds_bucket{le="0.1"} 0' in text
+    assert 'latency_seconds_bucket{le="1"} 1' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 1' in text
+    assert "latency_seconds_count 1" in text
+    assert "sessions 3" in text
+    with pytest.raises(ValueError):
+        requests.inc(status="200")
+
+
+def test_disabled_registry_records_nothing():
+    """Test that recording is a no-op when metrics are disabled."""
+    registry = MetricsRegistry(enabled=False)
+    counter = registry.counter("c_total", "C")
+    counter.inc()
+    assert counter.value() == 0
+
+
+def test_dryer_counts_attempts_per_engine(monkeypatch):
+    """Test that each attempt is counted by engine and outcome and the network stage is timed."""
+    monkeypatch.setenv("STABILITY_API_KEY", "test_key")
+    transport = MagicMock()
+    transport.post.return_value = MagicMock(status_code=500, text="error", headers={})
+    dryer = EnhancedImageDryer(cache=ResultCache(cache_dir=None), transport=transport)
+    dryer.retry_policy = RetryPolicy(base_delay=0)
+    assert dryer.process_image(Image.new("RGB", (16, 16))) is None
+    assert ENGINE_ATTEMPTS.value(engine=dryer.engines[0], outcome="server_error") == 1
+    assert STAGE_SECONDS.count(component="enhanced_dryer", stage="network") == transport.post.call_count
+    assert STAGE_SECONDS.count(component="preprocess", stage="encode") == 1
+
+    dryer.apply_fallback_drying_effect(Image.new("RGB", (4, 4)))
+    assert FALLBACKS.value() == 1
+
+
+def test_pool_reports_active_sessions():
+    """Test that the active session gauge follows the pool size."""
+    pool = AgentPool(agent_factory=lambda: MagicMock(current_image=None, processed_image=None))
+    pool.get("a")
+    pool.get("b")
+    assert ACTIVE_SESSIONS.value() == 2
+    pool.remove("a")
+    assert ACTIVE_SESSIONS.value() == 1
+
+
+def test_metrics_route_next_to_gradio():
+    """Test that the server exposes /metrics alongside the Gradio interface."""
+    ENGINE_ATTEMPTS.inc(engine="engine", outcome="success")
+    client = TestClient(create_server(DryingApp()))
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'drying_engine_attempts_total{engine="engine",outcome="success"} 1' in response.text
+
+
+def test_registry_reads_its_switch_on_first_use(monkeypatch):
+    """Test that DRYING_METRICS_ENABLED loaded from .env after the modules were imported still applies."""
+    registry = MetricsRegistry(enabled=None)
+    counter = registry.counter("c_total", "C")
+    monkeypatch.setenv("DRYING_METRICS_ENABLED", "false")
+    counter.inc()
+    assert not registry.enabled
+    assert counter.value() == 0
@@ -0,0 +1,150 @@
+import io
+import base64
+import random
+import pytest
+from unittest.mock import MagicMock
+from PIL import Image, ImageDraw
+from src.circuit_breaker import reset_circuit_breakers
+from src.enhanced_image_dryer import EnhancedImageDryer
+from src.image_dryer import ImageDryer
+from src.perceptual_index import (
+    BKTree, ImageSignature, PerceptualIndex, hamming_distance, image_signature, use_index_owner
+)
+from src.result_cache import ResultCache
+
+
+@pytest.fixture(autouse=True)
+def fresh_circuit_breakers():
+    reset_circuit_breakers()
+    yield
+    reset_circuit_breakers()
+
+
+def make_scene(size=(800, 600), flip=False):
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    draw.ellipse((width // 8, height // 6, width * 5 // 8, height * 2 // 3), fill="red")
+    draw.rectangle((width * 11 // 16, height // 12, width * 15 // 16, height * 11 // 12), fill="navy")
+    return image.transpose(Image.FLIP_LEFT_RIGHT) if flip else image
+
+
+def make_shirt(logo=False):
+    image = Image.new("RGB", (800, 800), "white")
+    draw = ImageDraw.Draw(image)
+    draw.polygon(
+        [(250, 150), (550, 150), (700, 300), (620, 360), (560, 300), (560, 700),
+         (240, 700), (240, 300), (180, 360), (100, 300)],
+        fill=(40, 70, 160)
+    )
+    if logo:
+        draw.ellipse((430, 250, 500, 320), fill=(240, 240, 240))
+    return image
+
+
+def make_dress():
+    image = Image.new("RGB", (800, 800), "white")
+    ImageDraw.Draw(image).polygon([(300, 150), (500, 150), (540, 300), (650, 700), (150, 700), (260, 300)], fill=(40, 70, 160))
+    return image
+
+
+def recompressed(image, size, quality=60):
+    buffered = io.BytesIO()
+    image.resize(size).save(buffered, format="JPEG", quality=quality)
+    return Image.open(io.BytesIO(buffered.getvalue()))
+
+
+def mock_transport():
+    buffered = io.BytesIO()
+    Image.new("RGB", (64, 48), "tan").save(buffered, format="PNG")
+    response = MagicMock(status_code=200, headers={"Content-Type": "application/json"})
+    response.json.return_value = {"artifacts": [{"base64": base64.b64encode(buffered.getvalue()).decode()}]}
+    transport = MagicMock()
+    transport.post.return_value = response
+    return transport
+
+
+def test_signature_survives_resizing_and_recompression():
+    """Test that a re-encoded copy hashes close to the original and a different image does not."""
+    original = image_signature(make_scene())
+    copy = image_signature(recompressed(make_scene(), (800, 600), quality=40))
+    other = image_signature(make_scene(flip=True))
+    assert hamming_distance(original.hash, copy.hash) <= 2
+    assert hamming_distance(original.hash, other.hash) > 32
+    assert image_signature(Image.new("RGB", (32, 32), "red")) is None
+
+
+def test_similar_products_do_not_match():
+    """Test that different items of the same colour on the same background are not near-duplicates."""
+    index = PerceptualIndex()
+    index.add(image_signature(make_shirt()), "settings", "shirt")
+    assert index.find(image_signature(recompressed(make_shirt(), (800, 800), quality=40)), "settings") is not None
+    assert index.find(image_signature(make_dress()), "settings") is None
+    assert index.find(image_signature(make_shirt(logo=True)), "settings") is None
+
+
+def test_index_is_scoped_to_its_owner():
+    """Test that one session never gets another session's result."""
+    index = PerceptualIndex()
+    signature = image_signature(make_scene())
+    with use_index_owner("session-a"):
+        index.add(signature, "settings", "result")
+        assert index.find(signature, "settings") == (0, "result")
+    with use_index_owner("session-b"):
+        assert index.find(signature, "settings") is None
+    assert index.find(signature, "settings") is None
+
+
+def test_bk_tree_matches_brute_force():
+    """Test that the pruned tree search returns exactly the hashes within the distance."""
+    rng = random.Random(7)
+    hashes = [rng.getrandbits(64) for _ in range(500)]
+    query = hashes[0] ^ 0b1011
+    tree = BKTree()
+    for value in hashes:
+        tree.add(value, value)
+    found = sorted(entry for _, entry in tree.search(query, 12))
+    assert found == sorted(value for value in hashes if hamming_distance(value, query) <= 12)
+
+
+def test_index_checks_scope_colour_and_capacity():
+    """Test that matches need the same settings and colour, and old entries are dropped when full."""
+    index = PerceptualIndex(max_distance=4, max_color_distance=10, max_entries=4)
+    signature = ImageSignature(0b1111, (100.0, 100.0, 100.0), 1.0)
+    index.add(signature, "settings", "result")
+    assert index.find(signature._replace(hash=0b0111), "settings") == (1, "result")
+    assert index.find(signature, "other settings") is None
+    assert index.find(signature._replace(colors=(100.0, 100.0, 120.0)), "settings") is None
+    assert index.find(signature._replace(aspect=1.5), "settings") is None
+
+    for i in range(4):
+        index.add(ImageSignature(1 << (20 + i * 8), (0.0, 0.0, 0.0), 1.0), "settings", i)
+    assert len(index) == 4
+    assert index.find(signature, "settings") is None
+
+
+def test_enhanced_dryer_reuses_result_for_near_duplicate(monkeypatch):
+    """Test that a recompressed re-upload gets the stored result at its own size."""
+    monkeypatch.setenv("STABILITY_API_KEY", "test_key")
+    transport = mock_transport()
+    dryer = EnhancedImageDryer(
+        cache=ResultCache(cache_dir=None), transport=transport, near_duplicates=PerceptualIndex()
+    )
+    assert dryer.process_image(make_scene()) is not None
+    result = dryer.process_image(recompressed(make_scene(), (800, 600)))
+    assert transport.post.call_count == 1
+    assert result.size == (800, 600)
+
+    assert dryer.process_image(make_scene(flip=True)) is not None
+    assert transport.post.call_count == 2
+
+
+def test_image_dryer_reuses_result_for_near_duplicate(monkeypatch):
+    """Test that ImageDryer resizes a near-duplicate's result to the SDXL size of the new input."""
+    monkeypatch.setenv("STABILITY_API_KEY", "test_key")
+    transport = mock_transport()
+    dryer = ImageDryer(cache=ResultCache(cache_dir=None), transport=transport, near_duplicates=PerceptualIndex())
+    assert dryer.process_image(make_scene()) is not None
+    result = dryer.process_image(recompressed(make_scene(), (800, 600)))
+    assert transport.post.call_count == 1
+    assert result.size == (1152, 896)
@@ -0,0 +1,102 @@
+import os
+import pstats
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+from src import profiling
+from src.profiling import RequestProfiler, attach_current_thread, profiled
+
+
+def busy(seconds=0.05):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+
+
+@profiled("work")
+def work(request=None):
+    busy()
+    return "done"
+
+
+@profiled("stream")
+def stream(count):
+    for i in range(count):
+        busy(0.01)
+        yield i
+
+
+def use_profiler(tmp_path, enabled=False, max_files=50):
+    return patch.object(profiling, "_profiler", RequestProfiler(
+        enabled=enabled, output_dir=str(tmp_path), max_files=max_files, sample_interval=0.001
+    ))
+
+
+def test_disabled_profiler_writes_nothing(tmp_path):
+    """Test that calls run unprofiled unless profiling is enabled or requested."""
+    with use_profiler(tmp_path):
+        assert work() == "done"
+    assert os.listdir(tmp_path) == []
+
+
+def test_profile_flag_writes_stats_and_collapsed_stacks(tmp_path):
+    """Test that a requested profile writes cProfile stats and collapsed stacks."""
+    with use_profiler(tmp_path):
+        assert work(profile=True) == "done"
+    files = sorted(os.listdir(tmp_path))
+    assert [os.path.splitext(name)[1] for name in files] == [".collapsed", ".prof"]
+    stats = pstats.Stats(str(tmp_path / files[1]))
+    assert any(func[2] == "busy" for func in stats.stats)
+    collapsed = (tmp_path / files[0]).read_text()
+    assert "busy (test_profiling.py" in collapsed
+    assert collapsed.splitlines()[0].rsplit(" ", 1)[1].isdigit()
+
+
+def test_request_header_enables_profile(tmp_path):
+    """Test that an X-Drying-Profile header profiles a single request."""
+    request = SimpleNamespace(headers={"x-drying-profile": "1"})
+    with use_profiler(tmp_path):
+        work(request)
+        work(SimpleNamespace(headers={}))
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_only_the_request_argument_is_checked_for_the_header(tmp_path):
+    """Test that the header is read from the request parameter, by position or keyword, and nothing else."""
+    @profiled("handler")
+    def handler(message, history=None, request=None):
+        return message
+
+    header = SimpleNamespace(headers={"x-drying-profile": "1"})
+    with use_profiler(tmp_path):
+        handler(header)
+        handler("hi", header)
+        assert os.listdir(tmp_path) == []
+        handler("hi", None, header)
+        handler("hi", request=header)
+    assert len(os.listdir(tmp_path)) == 4
+
+
+def test_generators_and_nested_calls_share_one_profile(tmp_path):
+    """Test that a streamed response and the calls it makes produce one profile."""
+    with use_profiler(tmp_path, enabled=True):
+        assert list(stream(3)) == [0, 1, 2]
+
+        @profiled("outer")
+        def outer():
+            with attach_current_thread():
+                return work()
+
+        outer()
+    names = {name.rsplit("-", 1)[1].split(".")[0] for name in os.listdir(tmp_path)}
+    assert names == {"stream", "outer"}
+
+
+def test_rotation_keeps_newest_profiles(tmp_path):
+    """Test that only the newest max_files profiles are kept."""
+    with use_profiler(tmp_path, enabled=True, max_files=2):
+        for _ in range(4):
+            work()
+    bases = {os.path.splitext(name)[0] for name in os.listdir(tmp_path)}
+    assert len(bases) == 2
+    assert all(base.split("-")[3] in ("00003", "00004") for base in bases)
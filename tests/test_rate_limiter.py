@@ -0,0 +1,79 @@
+import multiprocessing
+import pytest
+from unittest.mock import MagicMock
+from PIL import Image
+from src.circuit_breaker import reset_circuit_breakers
+from src.enhanced_image_dryer import EnhancedImageDryer
+from src.rate_limiter import RateLimit, SharedRateLimiter, parse_rate_limit, parse_rate_limits
+from src.result_cache import ResultCache
+
+
+@pytest.fixture(autouse=True)
+def fresh_circuit_breakers():
+    reset_circuit_breakers()
+    yield
+    reset_circuit_breakers()
+
+
+def reserve_many(path, count):
+    limiter = SharedRateLimiter(path, default=RateLimit(rate=0.01, burst=6), max_wait=3600)
+    return [limiter.reserve("engine") for _ in range(count)]
+
+
+def test_parse_rate_limits():
+    """Test the rate:burst and per-engine formats."""
+    assert parse_rate_limit("2:5") == RateLimit(2.0, 5.0)
+    assert parse_rate_limit("0.5") == RateLimit(0.5, 1.0)
+    assert parse_rate_limits("a=1:2, b=3") == {"a": RateLimit(1.0, 2.0), "b": RateLimit(3.0, 3.0)}
+    with pytest.raises(ValueError):
+        parse_rate_limit("0")
+
+
+def test_burst_then_waits_for_refill(tmp_path):
+    """Test that the burst is free and later tokens wait for the refill rate."""
+    limiter = SharedRateLimiter(str(tmp_path / "limits.db"), limits={"a": RateLimit(rate=10, burst=2)})
+    assert limiter.reserve("a") == 0
+    assert limiter.reserve("a") == 0
+    assert 0.05 < limiter.reserve("a") <= 0.1
+    assert limiter.reserve("unlimited") == 0
+
+
+def test_waits_beyond_max_wait_are_refused_without_taking_a_token(tmp_path):
+    """Test that a refused reservation leaves the bucket as it was and refunds restore tokens."""
+    limiter = SharedRateLimiter(str(tmp_path / "limits.db"), default=RateLimit(rate=1, burst=1), max_wait=1.5)
+    assert limiter.reserve("a") == 0
+    assert 0.9 < limiter.reserve("a") <= 1
+    assert limiter.reserve("a") is None
+    assert limiter.reserve("a") is None
+    limiter.refund("a")
+    assert 0.9 < limiter.reserve("a") <= 1
+    assert not limiter.acquire("a")
+
+
+def test_buckets_are_shared_across_processes(tmp_path):
+    """Test that processes using the same database draw from one bucket."""
+    path = str(tmp_path / "limits.db")
+    with multiprocessing.get_context("fork").Pool(2) as pool:
+        results = pool.starmap(reserve_many, [(path, 4), (path, 4)])
+    waits = sorted(wait for waits in results for wait in waits)
+    assert waits[:6] == [0] * 6
+    assert all(wait > 50 for wait in waits[6:])
+
+
+def test_dryer_skips_throttled_engines(tmp_path, monkeypatch):
+    """Test that an engine over its rate is skipped without a request."""
+    monkeypatch.setenv("STABILITY_API_KEY", "test_key")
+    limiter = SharedRateLimiter(
+        str(tmp_path / "limits.db"), limits={"engine-a": RateLimit(rate=0.01, burst=1)}, max_wait=1
+    )
+    limiter.reserve("engine-a")
+    transport = MagicMock()
+    transport.post.return_value = MagicMock(status_code=500, text="error", headers={})
+    dryer = EnhancedImageDryer(
+        cache=ResultCache(cache_dir=None), transport=transport, engines=["engine-a", "engine-b"], rate_limiter=limiter
+    )
+    dryer.max_retries = 2
+
+    assert dryer.process_image(Image.new("RGB", (32, 32))) is None
+    engines = [call.args[0].split("/")[-2] for call in transport.post.call_args_list]
+    assert engines == ["engine-b"]
@@ -0,0 +1,187 @@
+import time
+import threading
+import pytest
+from src.cancellation import CancellationToken, OperationCancelled, use_token
+from src.dryer_router import BackendRouter
+from src.metrics import SCHEDULER_WAIT_SECONDS
+from src.request_scheduler import (
+    BATCH, INTERACTIVE, SPECULATIVE, ClassDemand, RequestScheduler, RequestTicket, SharedSchedulerState,
+    current_ticket, parse_class_limits, use_ticket
+)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def queue_waiter(scheduler, ticket, order, token=None):
+    """Start a thread that takes a slot, records its class and gives the slot back."""
+    def run():
+        with use_token(token):
+            try:
+                with scheduler.slot(ticket) as priority:
+                    order.append(priority)
+            except OperationCancelled:
+                order.append("cancelled")
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_parse_class_limits():
+    """Test the per-class limit format."""
+    assert parse_class_limits("speculative=4, batch=2") == {SPECULATIVE: 4, BATCH: 2}
+    with pytest.raises(ValueError):
+        parse_class_limits("urgent=1")
+
+
+def test_tickets_default_to_interactive():
+    """Test that work without a ticket is interactive and promotion only moves up."""
+    assert current_ticket().priority == INTERACTIVE
+    ticket = RequestTicket(SPECULATIVE)
+    with use_ticket(ticket):
+        assert current_ticket() is ticket
+    ticket.promote(BATCH)
+    assert ticket.priority == SPECULATIVE
+    ticket.promote(INTERACTIVE)
+    assert ticket.priority == INTERACTIVE
+
+
+def test_freed_slot_goes_to_the_highest_priority():
+    """Test that waiting interactive work is served before earlier batch and speculative work."""
+    scheduler = RequestScheduler(max_concurrency=1, aging=0)
+    order = []
+    held = scheduler.acquire(RequestTicket(BATCH))
+    threads = [
+        queue_waiter(scheduler, RequestTicket(priority), order)
+        for priority in (BATCH, SPECULATIVE, INTERACTIVE)
+    ]
+    wait_for(lambda: sum(entry["waiting"] for entry in scheduler.stats().values()) == 3)
+    before = SCHEDULER_WAIT_SECONDS.count(priority=INTERACTIVE)
+    scheduler.release(held)
+    for thread in threads:
+        thread.join(timeout=2)
+    assert order == [INTERACTIVE, SPECULATIVE, BATCH]
+    assert SCHEDULER_WAIT_SECONDS.count(priority=INTERACTIVE) == before + 1
+
+
+def test_class_limit_leaves_slots_for_other_classes():
+    """Test that a class at its cap waits while other classes use the free slots."""
+    scheduler = RequestScheduler(max_concurrency=3, class_limits={BATCH: 1}, aging=0)
+    order = []
+    held = scheduler.acquire(RequestTicket(BATCH))
+    batch = queue_waiter(scheduler, RequestTicket(BATCH), order)
+    wait_for(lambda: scheduler.stats()[BATCH]["waiting"] == 1)
+    interactive = queue_waiter(scheduler, RequestTicket(INTERACTIVE), order)
+    interactive.join(timeout=2)
+    assert order == [INTERACTIVE]
+    scheduler.release(held)
+    batch.join(timeout=2)
+    assert order == [INTERACTIVE, BATCH]
+
+
+def test_aging_lets_long_waiting_batch_work_go_first():
+    """Test that batch work that waited long enough is served before fresh speculative work."""
+    scheduler = RequestScheduler(max_concurrency=1, aging=0.05)
+    order = []
+    held = scheduler.acquire(RequestTicket(INTERACTIVE))
+    batch = queue_waiter(scheduler, RequestTicket(BATCH), order)
+    wait_for(lambda: scheduler.stats()[BATCH]["waiting"] == 1)
+    time.sleep(0.2)
+    speculative = queue_waiter(scheduler, RequestTicket(SPECULATIVE), order)
+    wait_for(lambda: scheduler.stats()[SPECULATIVE]["waiting"] == 1)
+    scheduler.release(held)
+    batch.join(timeout=2)
+    speculative.join(timeout=2)
+    assert order == [BATCH, SPECULATIVE]
+
+
+def test_promoted_ticket_is_served_as_interactive():
+    """Test that a speculation picked up by a message overtakes other speculative work."""
+    scheduler = RequestScheduler(max_concurrency=1, aging=0)
+    order = []
+    held = scheduler.acquire(RequestTicket(INTERACTIVE))
+    first = queue_waiter(scheduler, RequestTicket(SPECULATIVE), order)
+    wait_for(lambda: scheduler.stats()[SPECULATIVE]["waiting"] == 1)
+    ticket = RequestTicket(SPECULATIVE)
+    second = queue_waiter(scheduler, ticket, order)
+    wait_for(lambda: scheduler.stats()[SPECULATIVE]["waiting"] == 2)
+    ticket.promote(INTERACTIVE)
+    scheduler.wake()
+    scheduler.release(held)
+    first.join(timeout=2)
+    second.join(timeout=2)
+    assert order == [INTERACTIVE, SPECULATIVE]
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    """Test that cancelling queued work stops its wait and frees its place."""
+    scheduler = RequestScheduler(max_concurrency=1)
+    order = []
+    held = scheduler.acquire()
+    token = CancellationToken()
+    thread = queue_waiter(scheduler, RequestTicket(BATCH), order, token=token)
+    wait_for(lambda: scheduler.stats()[BATCH]["waiting"] == 1)
+    token.cancel("test")
+    thread.join(timeout=0.5)
+    assert order == ["cancelled"]
+    assert scheduler.stats()[BATCH]["waiting"] == 0
+    scheduler.release(held)
+    assert scheduler.stats()[INTERACTIVE]["active"] == 0
+
+
+def test_batch_process_yields_to_interactive_requests_of_another_process(tmp_path):
+    """Test that schedulers sharing a database count each other's requests and serve other processes' users first."""
+    path = str(tmp_path / "scheduler.sqlite3")
+    app = RequestScheduler(max_concurrency=2, aging=0, shared=SharedSchedulerState(path), poll_interval=0.02)
+    batch = RequestScheduler(max_concurrency=2, aging=0, shared=SharedSchedulerState(path), poll_interval=0.02)
+    order = []
+    held = [app.acquire(RequestTicket(INTERACTIVE)), app.acquire(RequestTicket(INTERACTIVE))]
+
+    # The app's requests fill the slots of the batch process too
+    batch_thread = queue_waiter(batch, RequestTicket(BATCH), order)
+    wait_for(lambda: batch.stats()[INTERACTIVE]["other_active"] == 2)
+    interactive_thread = queue_waiter(app, RequestTicket(INTERACTIVE), order)
+    wait_for(lambda: batch.stats()[INTERACTIVE]["other_waiting"] == 1)
+
+    # A freed slot goes to the waiting user, not to the batch request that waited longer
+    app.release(held.pop())
+    interactive_thread.join(timeout=2)
+    batch_thread.join(timeout=2)
+    assert order == [INTERACTIVE, BATCH]
+    app.release(held.pop())
+
+
+def test_shared_state_ignores_processes_that_stopped_publishing(tmp_path):
+    """Test that a crashed process does not hold its slots forever."""
+    state = SharedSchedulerState(str(tmp_path / "scheduler.sqlite3"), stale_after=0.1)
+    state.publish("crashed", {INTERACTIVE: ClassDemand(0, 8, None)})
+    assert state.others("alive")[INTERACTIVE].active == 8
+    assert state.others("crashed") == {}
+    time.sleep(0.2)
+    assert state.others("alive") == {}
+
+
+def test_router_holds_a_slot_for_remote_backends():
+    """Test that the router sends remote requests under the current ticket's class."""
+    scheduler = RequestScheduler(max_concurrency=1)
+    seen = []
+
+    class RemoteBackend:
+        name, remote = "remote", True
+
+        def available(self):
+            return True
+
+        def process_image(self, image, use_cache=True):
+            seen.append(scheduler.stats()[BATCH]["active"])
+            return image
+
+    router = BackendRouter([RemoteBackend()], scheduler=scheduler)
+    with use_ticket(RequestTicket(BATCH)):
+        assert router.process_image(object()) is not None
+    assert seen == [1]
+    assert scheduler.stats()[BATCH]["active"] == 0
@@ -0,0 +1,73 @@
+from unittest.mock import MagicMock, patch
+from langchain_core.messages import AIMessage
+from src.drying_agent import DryingAgent
+from src.response_cache import ResponseCache, hamming_distance, normalize_message, simhash
+
+CONTEXT = ("google/gemini-pro", 0.7, "system prompt")
+
+
+def test_exact_tier_matches_normalized_messages():
+    """Test that case, punctuation and whitespace do not affect exact matches."""
+    cache = ResponseCache()
+    cache.put("How do I dry a wet phone?", *CONTEXT, "Use silica gel.")
+    assert cache.get("  how do i DRY a wet phone ", *CONTEXT) == "Use silica gel."
+    assert cache.get("How do I dry a wet phone?", "other-model", 0.7, "system prompt") is None
+    assert cache.get("How do I dry a wet phone?", "google/gemini-pro", 0.2, "system prompt") is None
+    assert cache.get("How do I dry a wet phone?", "google/gemini-pro", 0.7, "other prompt") is None
+    assert normalize_message("Wet, sneakers!") == "wet sneakers"
+
+
+def test_near_duplicate_tier_matches_rephrasings():
+    """Test that a small rewording hits the near-duplicate tier only when enabled."""
+    question = "how do i dry my wet sneakers after running in the rain today quickly"
+    rephrased = "how do i dry my wet sneakers after running in the rain today quickly please"
+    assert hamming_distance(simhash(question), simhash(rephrased)) <= 3
+
+    exact_only = ResponseCache()
+    exact_only.put(question, *CONTEXT, "Stuff them with newspaper.")
+    assert exact_only.get(rephrased, *CONTEXT) is None
+
+    cache = ResponseCache(near_duplicates=True)
+    cache.put(question, *CONTEXT, "Stuff them with newspaper.")
+    assert cache.get(rephrased, *CONTEXT) == "Stuff them with newspaper."
+    assert cache.get("what is the capital of france", *CONTEXT) is None
+    assert cache.stats()["near_hits"] == 1
+
+
+def test_ttl_and_size_limits():
+    """Test expiry and least recently used eviction."""
+    cache = ResponseCache(max_entries=2, ttl=10)
+    with patch("src.response_cache.time.time", return_value=0):
+        cache.put("a", *CONTEXT, "A")
+        cache.put("b", *CONTEXT, "B")
+        cache.get("a", *CONTEXT)
+        cache.put("c", *CONTEXT, "C")
+        assert cache.get("b", *CONTEXT) is None
+        assert cache.stats()["evictions"] == 1
+    with patch("src.response_cache.time.time", return_value=100):
+        assert cache.get("a", *CONTEXT) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert round(stats["hit_rate"], 2) == 0.33
+
+
+def test_agent_answers_repeated_first_turn_from_cache(monkeypatch):
+    """Test that a repeated first question skips the LLM but follow-ups do not."""
+    monkeypatch.setenv("DRYING_RESPONSE_CACHE", "true")
+    with patch("src.drying_agent.ChatOpenAI") as chat_cls, patch("src.drying_agent.get_dryer_router"), \
+            patch("src.response_cache._default_cache", ResponseCache()):
+        chat_model = chat_cls.return_value
+        chat_model.model_name = "google/gemini-pro"
+        chat_model.temperature = 0.7
+        chat_model.invoke.return_value = AIMessage(content="Use rice.")
+
+        first = DryingAgent()
+        first.process_message("How do I dry a wet phone?")
+        second = DryingAgent()
+        messages, _ = second.process_message("how do I dry a wet phone")
+        assert messages[1]["content"] == "Use rice."
+        assert chat_model.invoke.call_count == 1
+
+        second.process_message("How do I dry a wet phone?")
+        assert chat_model.invoke.call_count == 2
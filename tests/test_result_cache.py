@@ -0,0 +1,123 @@
+import io
+import os
+import base64
+import pytest
+from unittest.mock import MagicMock, patch
+from PIL import Image
+from src.result_cache import ResultCache, make_cache_key
+from src.enhanced_image_dryer import EnhancedImageDryer
+
+PROMPTS = [{"text": "dry", "weight": 1}]
+
+
+def png_bytes(color="red", size=(8, 8)):
+    buffered = io.BytesIO()
+    Image.new("RGB", size, color).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def test_cache_key_depends_on_all_parameters():
+    """Test that every generation parameter changes the cache key."""
+    base = make_cache_key(b"image", "engine", PROMPTS, 0.35, 7, 30)
+    assert base == make_cache_key(b"image", "engine", PROMPTS, 0.35, 7, 30)
+    variants = [
+        make_cache_key(b"other", "engine", PROMPTS, 0.35, 7, 30),
+        make_cache_key(b"image", "other", PROMPTS, 0.35, 7, 30),
+        make_cache_key(b"image", "engine", [{"text": "wet", "weight": 1}], 0.35, 7, 30),
+        make_cache_key(b"image", "engine", PROMPTS, 0.4, 7, 30),
+        make_cache_key(b"image", "engine", PROMPTS, 0.35, 8, 30),
+        make_cache_key(b"image", "engine", PROMPTS, 0.35, 7, 25),
+    ]
+    assert base not in variants
+    assert len(set(variants)) == len(variants)
+
+
+def test_memory_lru_respects_byte_budget():
+    """Test that least recently used entries are evicted past the byte budget."""
+    cache = ResultCache(max_bytes=10, cache_dir=None)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"  # "a" is now most recently used
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+    assert stats["bytes"] <= 10
+
+
+def test_ttl_expires_entries(tmp_path):
+    """Test that expired entries are dropped from both tiers."""
+    cache = ResultCache(cache_dir=str(tmp_path), ttl=60)
+    cache.put("key", b"data")
+    with patch("src.result_cache.time.time", return_value=os.path.getmtime(cache._path("key")) + 120):
+        assert cache.get("key") is None
+    assert not os.path.exists(cache._path("key"))
+    assert cache.stats()["expirations"] >= 1
+
+
+def test_disk_tier_survives_new_instance(tmp_path):
+    """Test that entries written to disk are served by a fresh cache."""
+    ResultCache(cache_dir=str(tmp_path)).put("key", b"data")
+    cache = ResultCache(cache_dir=str(tmp_path))
+    assert cache.get("key") == b"data"
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.get("key") == b"data"
+    assert cache.stats()["disk_hits"] == 1  # promoted to memory
+
+
+def test_disk_tier_evicts_oldest_files_over_budget(tmp_path):
+    """Test that the disk tier stays within its byte budget by removing the oldest files first."""
+    cache = ResultCache(max_bytes=0, cache_dir=str(tmp_path), max_disk_bytes=350)
+    for i in range(3):
+        cache.put(f"key{i}", bytes(100))
+        os.utime(cache._path(f"key{i}"), (1000 + i, 1000 + i))
+    assert cache.stats()["disk_bytes"] == 300
+
+    # A restarted process counts the existing files before adding its own
+    cache = ResultCache(max_bytes=0, cache_dir=str(tmp_path), max_disk_bytes=350, ttl=None)
+    cache.put("key3", bytes(100))
+    assert cache.stats()["disk_evictions"] == 1
+    assert cache.stats()["disk_bytes"] == 300
+    assert cache.get("key0") is None
+    assert all(cache.get(f"key{i}") == bytes(100) for i in (1, 2, 3))
+
+    # Overwriting an entry does not count its old size twice
+    cache.put("key3", bytes(100))
+    assert cache.stats()["disk_bytes"] == 300
+
+
+def test_disk_tier_without_budget_is_not_scanned(tmp_path):
+    """Test that no limit means no eviction."""
+    cache = ResultCache(cache_dir=str(tmp_path), max_disk_bytes=None)
+    for i in range(5):
+        cache.put(f"key{i}", bytes(100))
+    assert cache.stats()["disk_evictions"] == 0
+    assert cache.stats()["disk_bytes"] is None
+
+
+@pytest.fixture
+def mock_transport():
+    transport = MagicMock()
+    response = MagicMock(status_code=200, headers={"Content-Type": "application/json"})
+    response.json.return_value = {"artifacts": [{"base64": base64.b64encode(png_bytes("blue")).decode()}]}
+    transport.post.return_value = response
+    return transport
+
+
+def test_enhanced_dryer_serves_repeat_requests_from_cache(mock_transport, monkeypatch):
+    """Test that a repeated image skips the API call and bypass forces one."""
+    monkeypatch.setenv("STABILITY_API_KEY", "test_key")
+    dryer = EnhancedImageDryer(cache=ResultCache(cache_dir=None), transport=mock_transport)
+    image = Image.new("RGB", (16, 16), "red")
+
+    assert dryer.process_image(image) is not None
+    assert dryer.process_image(image) is not None
+    assert mock_transport.post.call_count == 1
+    assert dryer.cache.stats()["hits"] == 1
+
+    assert dryer.process_image(image, use_cache=False) is not None
+    assert mock_transport.post.call_count == 2
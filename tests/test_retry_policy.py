@@ -0,0 +1,127 @@
+import random
+import pytest
+from unittest.mock import MagicMock, patch
+from PIL import Image
+from src.circuit_breaker import CircuitBreaker, get_circuit_breaker, reset_circuit_breakers, CLOSED, OPEN, HALF_OPEN
+from src.dryer_backends import StabilityXLBackend
+from src.enhanced_image_dryer import EnhancedImageDryer
+from src.image_dryer import ImageDryer
+from src.result_cache import ResultCache
+from src.retry_policy import RetryPolicy
+
+
+@pytest.fixture(autouse=True)
+def fresh_circuit_breakers():
+    reset_circuit_breakers()
+    yield
+    reset_circuit_breakers()
+
+
+def test_backoff_is_exponential_with_full_jitter():
+    """Test that delays stay within the exponential cap and the max delay."""
+    policy = RetryPolicy(base_delay=1, max_delay=5, rng=random.Random(0))
+    for retry, cap in enumerate([1, 2, 4, 5, 5]):
+        delays = [policy.get_delay(retry) for _ in range(50)]
+        assert all(0 <= delay <= cap for delay in delays)
+    assert RetryPolicy(base_delay=1, max_delay=5, jitter=False).get_delay(2) == 4
+
+
+def test_retry_after_sets_the_minimum_delay():
+    """Test that Retry-After is honoured in seconds and as an HTTP date."""
+    policy = RetryPolicy(base_delay=0.1, max_delay=30)
+    assert policy.get_delay(0, retry_after=7) == 7
+    assert policy.get_delay(0, retry_after=60) == 30
+    assert RetryPolicy.parse_retry_after("12") == 12
+    assert RetryPolicy.parse_retry_after(None) is None
+    assert RetryPolicy.parse_retry_after("garbage") is None
+    assert 0 < RetryPolicy.parse_retry_after("Wed, 21 Oct 2099 07:28:00 GMT")
+
+
+def test_breaker_opens_and_half_opens_on_schedule():
+    """Test the closed -> open -> half-open -> closed cycle."""
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10)
+    with patch("src.circuit_breaker.time.monotonic", return_value=100):
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        assert not breaker.allow_request()
+    with patch("src.circuit_breaker.time.monotonic", return_value=111):
+        assert breaker.state == HALF_OPEN
+        assert breaker.allow_request()
+        assert not breaker.allow_request()  # only one trial request
+        breaker.record_failure()
+        assert breaker.state == OPEN
+    with patch("src.circuit_breaker.time.monotonic", return_value=122):
+        assert breaker.allow_request()
+        breaker.record_success()
+        assert breaker.state == CLOSED
+
+
+def make_response(status_code, headers=None):
+    response = MagicMock(status_code=status_code, text="error", headers=headers or {})
+    response.json.return_value = {"artifacts": [{"base64": ""}]}
+    return response
+
+
+def test_dryer_skips_open_engines_without_sleeping(monkeypatch):
+    """Test that a failing engine is skipped by later requests and retries go straight to another engine."""
+    monkeypatch.setenv("STABILITY_API_KEY", "test_key")
+    transport = MagicMock()
+    transport.post.return_value = make_response(503)
+    dryer = EnhancedImageDryer(cache=ResultCache(cache_dir=None), transport=transport)
+    xl = dryer.engines[0]
+    for _ in range(get_circuit_breaker(xl).failure_threshold):
+        get_circuit_breaker(xl).record_failure()
+
+    with patch("src.enhanced_image_dryer.time.sleep") as mock_sleep:
+        assert dryer.process_image(Image.new("RGB", (32, 32))) is None
+        mock_sleep.assert_not_called()
+    engines = [call.args[0].split("/")[-2] for call in transport.post.call_args_list]
+    assert xl not in engines
+    assert engines == dryer.engines[1:]
+
+
+def test_dryer_waits_for_retry_after_on_rate_limit(monkeypatch):
+    """Test that a 429 with Retry-After delays the next attempt by at least that long."""
+    monkeypatch.setenv("STABILITY_API_KEY", "test_key")
+    transport = MagicMock()
+    transport.post.side_effect = [make_response(429, {"Retry-After": "3"}), make_response(500), make_response(500)]
+    dryer = EnhancedImageDryer(cache=ResultCache(cache_dir=None), transport=transport)
+
+    with patch("src.enhanced_image_dryer.time.sleep") as mock_sleep:
+        dryer.process_image(Image.new("RGB", (32, 32)))
+    assert mock_sleep.call_args_list[0].args[0] >= 3
+    assert get_circuit_breaker(dryer.engines[0]).state == OPEN
+
+
+def test_sdxl_dryer_opens_its_circuit_on_repeated_failures(monkeypatch):
+    """Test that the SDXL dryer records outcomes, so its backend stops being offered once the engine fails."""
+    monkeypatch.setenv("STABILITY_API_KEY", "test_key")
+    transport = MagicMock()
+    transport.post.return_value = make_response(503)
+    dryer = ImageDryer(cache=ResultCache(cache_dir=None), transport=transport)
+    backend = StabilityXLBackend(dryer)
+    breaker = get_circuit_breaker(dryer.engine_id)
+
+    for _ in range(breaker.failure_threshold):
+        assert backend.available()
+        assert dryer.process_image(Image.new("RGB", (32, 32))) is None
+    assert breaker.state == OPEN
+    assert not backend.available()
+
+    # Requests made anyway do not reach the API until the circuit half-opens
+    assert dryer.process_image(Image.new("RGB", (32, 32))) is None
+    assert transport.post.call_count == breaker.failure_threshold
+
+
+def test_sdxl_dryer_client_errors_do_not_open_its_circuit(monkeypatch):
+    """Test that 4xx responses other than 408 and 429 leave the circuit closed."""
+    monkeypatch.setenv("STABILITY_API_KEY", "test_key")
+    transport = MagicMock()
+    transport.post.return_value = make_response(400)
+    dryer = ImageDryer(cache=ResultCache(cache_dir=None), transport=transport)
+
+    for _ in range(5):
+        assert dryer.process_image(Image.new("RGB", (32, 32))) is None
+    assert get_circuit_breaker(dryer.engine_id).state == CLOSED
@@ -0,0 +1,174 @@
+import time
+import threading
+import pytest
+from PIL import Image
+from src.cancellation import CancellationToken, OperationCancelled, use_token
+from src.dryer_router import BackendRouter
+from src.metrics import COALESCED_REQUESTS
+from src.request_scheduler import BATCH, INTERACTIVE, RequestScheduler, RequestTicket, use_ticket
+from src.single_flight import SingleFlight
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def run_in_thread(fn, *args, token=None):
+    """Run fn on a thread under an optional token, collecting its result or exception."""
+    outcome = {}
+
+    def run():
+        with use_token(token):
+            try:
+                outcome["result"] = fn(*args)
+            except BaseException as e:
+                outcome["error"] = e
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, outcome
+
+
+def test_concurrent_callers_share_one_call():
+    """Test that callers with the same key wait for the running call and get its result."""
+    group = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def work(value):
+        calls.append(value)
+        release.wait(2)
+        return value * 2
+
+    before = COALESCED_REQUESTS.value(component="test", outcome="joined")
+    leader, leader_outcome = run_in_thread(group.do, "key", work, 21)
+    wait_for(lambda: calls)
+    joiners = [run_in_thread(group.do, "key", work, 21) for _ in range(3)]
+    wait_for(lambda: COALESCED_REQUESTS.value(component="test", outcome="joined") == before + 3)
+    release.set()
+    for thread, _ in [(leader, leader_outcome)] + joiners:
+        thread.join(timeout=2)
+
+    assert calls == [21]
+    assert leader_outcome["result"] == (42, False)
+    assert all(outcome["result"] == (42, True) for _, outcome in joiners)
+    assert group.in_flight() == 0
+
+
+def test_errors_are_shared_and_later_calls_start_fresh():
+    """Test that joined callers see the call's error and the key is free afterwards."""
+    group = SingleFlight("test")
+    release = threading.Event()
+
+    def failing():
+        release.wait(2)
+        raise ValueError("boom")
+
+    leader, leader_outcome = run_in_thread(group.do, "key", failing)
+    wait_for(lambda: group.in_flight() == 1)
+    joiner, joiner_outcome = run_in_thread(group.do, "key", failing)
+    time.sleep(0.05)
+    release.set()
+    leader.join(timeout=2)
+    joiner.join(timeout=2)
+    assert isinstance(leader_outcome["error"], ValueError)
+    assert isinstance(joiner_outcome["error"], ValueError)
+    assert group.do("key", lambda: "fresh") == ("fresh", False)
+
+
+def test_cancelled_waiter_leaves_without_stopping_the_call():
+    """Test that cancelling one waiter only ends its own wait."""
+    group = SingleFlight("test")
+    release = threading.Event()
+    leader, leader_outcome = run_in_thread(group.do, "key", lambda: release.wait(2) and "done")
+    wait_for(lambda: group.in_flight() == 1)
+    token = CancellationToken()
+    joiner, joiner_outcome = run_in_thread(group.do, "key", lambda: "other", token=token)
+    time.sleep(0.05)
+    token.cancel("test")
+    joiner.join(timeout=1)
+    assert isinstance(joiner_outcome["error"], OperationCancelled)
+
+    release.set()
+    leader.join(timeout=2)
+    assert leader_outcome["result"] == ("done", False)
+
+
+def test_waiters_restart_the_call_when_its_caller_is_cancelled():
+    """Test that a waiter makes the call itself when the caller making it was cancelled."""
+    group = SingleFlight("test")
+    token = CancellationToken()
+    started = threading.Event()
+
+    def cancellable():
+        started.set()
+        token.wait(2)
+        raise OperationCancelled("test")
+
+    leader, leader_outcome = run_in_thread(group.do, "key", cancellable, token=token)
+    started.wait(2)
+    joiner, joiner_outcome = run_in_thread(group.do, "key", lambda: "restarted")
+    wait_for(lambda: COALESCED_REQUESTS.value(component="test", outcome="joined") > 0)
+    time.sleep(0.05)
+    token.cancel("test")
+    leader.join(timeout=2)
+    joiner.join(timeout=2)
+    assert isinstance(leader_outcome["error"], OperationCancelled)
+    assert joiner_outcome["result"] == ("restarted", False)
+
+
+def test_joining_promotes_the_call_to_the_waiter_priority():
+    """Test that an interactive caller joining a batch call raises its priority class."""
+    group = SingleFlight("test")
+    release = threading.Event()
+    ticket = RequestTicket(BATCH)
+
+    def batch_call():
+        with use_ticket(ticket):
+            return group.do("key", lambda: release.wait(2))
+
+    leader, _ = run_in_thread(batch_call)
+    wait_for(lambda: group.in_flight() == 1)
+    joiner, _ = run_in_thread(group.do, "key", lambda: None)
+    wait_for(lambda: ticket.priority == INTERACTIVE)
+    release.set()
+    leader.join(timeout=2)
+    joiner.join(timeout=2)
+
+
+def test_router_coalesces_duplicates_before_taking_a_scheduler_slot():
+    """Test that identical requests cost one backend call and do not hold slots while they wait."""
+    release = threading.Event()
+    calls = []
+
+    class SlowBackend:
+        name, remote = "slow", True
+
+        def available(self):
+            return True
+
+        def process_image(self, image, use_cache=True):
+            calls.append(image.getpixel((0, 0)))
+            if image.getpixel((0, 0)) == (255, 0, 0):
+                release.wait(2)
+            return image
+
+    scheduler = RequestScheduler(max_concurrency=2)
+    router = BackendRouter([SlowBackend()], scheduler=scheduler, coalescer=SingleFlight("router_test"))
+    callers = [run_in_thread(router.process_image, Image.new("RGB", (32, 32), "red")) for _ in range(4)]
+    wait_for(lambda: COALESCED_REQUESTS.value(component="router_test", outcome="joined") == 3)
+    assert scheduler.stats()[INTERACTIVE]["active"] == 1
+
+    # The second slot is still free for another session's image
+    assert router.process_image(Image.new("RGB", (32, 32), "blue")) is not None
+    release.set()
+    for thread, _ in callers:
+        thread.join(timeout=2)
+
+    results = [outcome["result"] for _, outcome in callers]
+    assert calls.count((255, 0, 0)) == 1
+    assert all(result is not None and result.size == (32, 32) for result in results)
+    assert len({id(result) for result in results}) == 4
+    assert router.stats()["slow"]["requests"] == 2
@@ -0,0 +1,41 @@
+import io
+import json
+import logging
+from src.structured_logging import JsonFormatter, configure_logging, get_logger, log_event
+
+
+def capture():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    logging.getLogger("drying").addHandler(handler)
+    return stream, handler
+
+
+def test_events_carry_structured_fields():
+    """Test that events are rendered as JSON with their fields."""
+    configure_logging(level="INFO", disable="")
+    stream, handler = capture()
+    try:
+        log_event(get_logger("test"), logging.INFO, "engine_attempt", engine="sdxl", attempt=1)
+        entry = json.loads(stream.getvalue().strip())
+        assert entry["event"] == "engine_attempt"
+        assert entry["logger"] == "drying.test"
+        assert entry["engine"] == "sdxl" and entry["attempt"] == 1
+    finally:
+        logging.getLogger("drying").removeHandler(handler)
+
+
+def test_disabled_loggers_skip_events():
+    """Test that loggers listed in disable emit nothing, even warnings."""
+    configure_logging(level="INFO", disable="quiet")
+    stream, handler = capture()
+    try:
+        log_event(get_logger("quiet"), logging.WARNING, "hot_path_event")
+        log_event(get_logger("quiet.child"), logging.WARNING, "hot_path_event")
+        log_event(get_logger("loud"), logging.DEBUG, "below_level")
+        assert stream.getvalue() == ""
+    finally:
+        logging.getLogger("drying").removeHandler(handler)
+        configure_logging(level="INFO", disable="")
+        logging.getLogger("drying.quiet").setLevel(logging.NOTSET)
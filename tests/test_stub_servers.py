@@ -0,0 +1,54 @@
+import random
+import requests
+from langchain_openai import ChatOpenAI
+from PIL import Image
+from benchmarks.stub_servers import LatencyModel, StubBehaviour, start_openrouter_stub, start_stability_stub
+from src.image_dryer import ImageDryer
+from src.result_cache import ResultCache
+
+
+def test_latency_model_parses_specs():
+    """Test that latency specs parse into the right distributions."""
+    rng = random.Random(0)
+    assert LatencyModel.parse("0.25").sample(rng) == 0.25
+    assert 0.1 <= LatencyModel.parse("uniform:0.1:0.2").sample(rng) <= 0.2
+    assert LatencyModel.parse("lognormal:0.5:0.3").sample(rng) > 0
+
+
+def test_stub_rate_limits_with_retry_after():
+    """Test that the sustained rate limit answers with 429 and Retry-After."""
+    server = start_stability_stub(StubBehaviour(max_rps=1, retry_after=2), image_size=(8, 8))
+    try:
+        url = f"{server.url}/v1/generation/engine/image-to-image"
+        assert requests.post(url, data={}).status_code == 200
+        response = requests.post(url, data={})
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "2"
+    finally:
+        server.stop()
+
+
+def test_image_dryer_against_stub():
+    """Test that ImageDryer can be pointed at the stub, binary and JSON."""
+    server = start_stability_stub(image_size=(8, 8))
+    try:
+        dryer = ImageDryer(cache=ResultCache(cache_dir=None))
+        dryer.api_host = server.url
+        assert dryer.process_image(Image.new("RGB", (64, 64))).size == (8, 8)
+        dryer.binary_responses = False
+        assert dryer.process_image(Image.new("RGB", (64, 64)), use_cache=False).size == (8, 8)
+        assert server.statuses[200] == 2
+    finally:
+        server.stop()
+
+
+def test_chat_model_against_stub():
+    """Test that an OpenAI-compatible client can invoke and stream from the stub."""
+    server = start_openrouter_stub(reply="Dry it flat")
+    try:
+        model = ChatOpenAI(base_url=f"{server.url}/api/v1", model_name="stub", openai_api_key="stub", max_retries=0)
+        assert model.invoke("wet towel").content.startswith("Dry it flat")
+        streamed = "".join(chunk.content for chunk in model.stream("wet towel"))
+        assert streamed.startswith("Dry it flat")
+    finally:
+        server.stop()